@@ -0,0 +1,179 @@
+""" measures how apply scales by running pkictl.main against a fake Vault server with synthetic manifests """
+from benchmarks.fake_vault import FakeVault, FakeVaultServer
+from contextlib import redirect_stdout
+from multiprocessing import Process, Queue
+from typing import Dict, List
+import argparse
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+import yaml
+
+# (intermediate CAs, hierarchy depth, roles per CA)
+DEFAULT_SCENARIOS = [(10, 2, 5), (100, 3, 10), (500, 4, 20)]
+
+KV_ENGINE = 'kv/pkictl-bench'
+
+
+def root_ca(i: int) -> dict:
+    return {
+        'kind': 'RootCA',
+        'metadata': {'name': f"pki/root-ca-{i}", 'description': f"Benchmark Root CA {i}"},
+        'spec': {'key_type': 'ec', 'key_bits': 384, 'ttl': '87600h', 'subject': {'common_name': f"Benchmark Root CA {i}"}}
+    }
+
+
+def intermediate_ca(i: int, issuer: str, roles: int, catype: str='internal') -> dict:
+    name = f"pki/intermediate-ca-{i}"
+    ca   = {
+        'kind': 'IntermediateCA',
+        'metadata': {'name': name, 'description': f"Benchmark Intermediate CA {i}", 'issuer': issuer},
+        'spec': {
+            'type': catype,
+            'key_type': 'rsa',
+            'key_bits': 2048,
+            'ttl': '43800h',
+            'crl': {'expiry': '48h'},
+            'subject': {'common_name': f"Benchmark Intermediate CA {i}"},
+            'roles': [{
+                'name': f"role-{j}",
+                'config': {
+                    'max_ttl': '720h',
+                    'ttl': '24h',
+                    'server_flag': j % 2 == 0,
+                    'client_flag': j % 2 == 1,
+                    'allow_subdomains': True,
+                    'allowed_domains': [f"ca-{i}.role-{j}.example.com"]
+                }
+            } for j in range(roles)],
+            'policies': [{'name': f"intermediate-ca-{i}-policy", 'policy': f'path "{name}/issue/*" {{\n  capabilities = ["update"]\n}}\n'}]
+        }
+    }
+
+    # every fourth CA exports its private key to exercise the KV engine
+    if i % 4 == 0:
+        ca['metadata']['kv_engine'] = KV_ENGINE
+        if catype == 'internal':
+            ca['spec']['type'] = 'exported'
+    return ca
+
+
+def generate_manifests(directory: str, cas: int, depth: int, roles: int, roots: int=1, catype: str='internal') -> None:
+    """ writes one manifest file per resource, spreading the intermediate CAs evenly over the hierarchy levels """
+    documents = [{
+        'kind': 'KV',
+        'metadata': {'name': KV_ENGINE, 'description': 'Benchmark KV engine'},
+        'spec': {'options': {'version': 1}}
+    }]
+    documents.extend(root_ca(i) for i in range(roots))
+
+    issuers = [d['metadata']['name'] for d in documents[1:]]
+    per_level = max(1, -(-cas // depth))
+
+    for start in range(0, cas, per_level):
+        level = [intermediate_ca(i, issuers[i % len(issuers)], roles, catype) for i in range(start, min(cas, start + per_level))]
+        documents.extend(level)
+        issuers = [ca['metadata']['name'] for ca in level]
+
+    for i, document in enumerate(documents):
+        with open(os.path.join(directory, f"{i:05d}.yaml"), 'w') as f:
+            yaml.safe_dump(document, f)
+
+
+def run_pkictl(argv: List[str]) -> None:
+    from pkictl.pkictl import main
+
+    sys.argv = ['pkictl'] + argv
+    with redirect_stdout(io.StringIO()):
+        main()
+
+
+def run_scenario(queue: Queue, cas: int, depth: int, roles: int, latency: Dict[str, float], rate_limit: float, catype: str, extra: List[str]) -> None:
+    """ runs in a child process, so that the peak RSS belongs to this scenario alone """
+    vault  = FakeVault(latency, rate_limit)
+    server = FakeVaultServer(vault).start()
+
+    os.environ.update({'VAULT_ADDR': server.url, 'VAULT_TOKEN': 'benchmark', 'VAULT_SKIP_VERIFY': 'false'})
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifests = os.path.join(tmpdir, 'manifests')
+        os.mkdir(manifests)
+        generate_manifests(manifests, cas, depth, roles, catype=catype)
+
+        state_file = os.path.join(tmpdir, 'state.json')
+        runs = [
+            ('apply', []),
+            ('re-apply', []),
+            ('re-apply --refresh', ['--refresh'])
+        ]
+
+        for label, flags in runs:
+            before = vault.request_count
+            start  = time.perf_counter()
+            try:
+                run_pkictl(['apply', '-f', manifests, '--state-file', state_file] + flags + extra)
+                error = None
+            except SystemExit as err:
+                error = err.code
+            elapsed = time.perf_counter() - start
+
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            rss = rss / 1024 if sys.platform != 'darwin' else rss / 1024 / 1024
+
+            results.append((label, elapsed, vault.request_count - before, rss, error))
+
+    server.stop()
+    queue.put(results)
+
+
+def parse_latency(values: List[str]) -> Dict[str, float]:
+    latency = {}
+    for value in values:
+        endpoint, _, seconds = value.partition('=')
+        latency[endpoint] = float(seconds)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cas', type=int, help='number of intermediate CAs, runs the default scenarios when not set')
+    parser.add_argument('--depth', type=int, default=3, help='number of levels of intermediate CAs')
+    parser.add_argument('--roles', type=int, default=10, help='number of roles per intermediate CA')
+    parser.add_argument('--latency', action='append', default=[], metavar='ENDPOINT=SECONDS',
+                        help="delay the responses of an endpoint, 'default' applies to every endpoint")
+    parser.add_argument('--rate-limit', type=float, default=0.0, metavar='FRACTION',
+                        help='the fraction of requests the fake Vault rejects with 429')
+    parser.add_argument('--local-keygen', action='store_true',
+                        help='generate the intermediate CA keys in pkictl (spec.type: local) instead of in Vault')
+    parser.add_argument('--sequential', action='store_true', help='apply one operation at a time')
+    parser.add_argument('-c', '--concurrency', type=int, help='the maximum number of Vault operations to run at once')
+    args = parser.parse_args()
+
+    latency   = parse_latency(args.latency)
+    scenarios = [(args.cas, args.depth, args.roles)] if args.cas else DEFAULT_SCENARIOS
+
+    extra = ['--sequential'] if args.sequential else []
+    if args.concurrency:
+        extra.extend(['-c', str(args.concurrency)])
+
+    print(f"{'CAs':>5} {'depth':>5} {'roles':>5}  {'run':<20} {'wall (s)':>9} {'requests':>9} {'peak RSS (MB)':>14}")
+    for cas, depth, roles in scenarios:
+        queue   = Queue()
+        catype  = 'local' if args.local_keygen else 'internal'
+        process = Process(target=run_scenario, args=(queue, cas, depth, roles, latency, args.rate_limit, catype, extra))
+        process.start()
+        results = queue.get()
+        process.join()
+
+        for label, elapsed, requests, rss, error in results:
+            line = f"{cas:>5} {depth:>5} {roles:>5}  {label:<20} {elapsed:>9.2f} {requests:>9} {rss:>14.1f}"
+            print(line if error is None else f"{line}  failed: {error}")
+
+
+if __name__ == '__main__':
+    main()
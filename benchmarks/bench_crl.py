@@ -0,0 +1,52 @@
+""" measures how long crl rotate takes to rebuild the CRLs of many CAs against a fake Vault server """
+from benchmarks.bench_apply import generate_manifests, parse_latency, run_pkictl
+from benchmarks.bench_rotate import timed
+from benchmarks.fake_vault import FakeVault, FakeVaultServer
+import argparse
+import os
+import tempfile
+
+# (intermediate CAs, revoked certificates per CA)
+DEFAULT_SCENARIOS = [(50, 100), (200, 1000)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cas', type=int, help='number of intermediate CAs, runs the default scenarios when not set')
+    parser.add_argument('--revoked', type=int, default=100, help='number of revoked certificates per CA')
+    parser.add_argument('--latency', action='append', default=['default=0.002', 'crl-rotate=0.05'], metavar='ENDPOINT=SECONDS',
+                        help="delay the responses of an endpoint, 'default' applies to every endpoint")
+    parser.add_argument('-c', '--concurrency', type=int, action='append', help='the concurrency levels to compare, 1 and 10 by default')
+    args = parser.parse_args()
+
+    scenarios   = [(args.cas, args.revoked)] if args.cas else DEFAULT_SCENARIOS
+    concurrency = args.concurrency or [1, 10]
+
+    print(f"{'CAs':>5} {'revoked':>8}  {'run':<28} {'wall (s)':>9} {'requests':>9}")
+    for cas, revoked in scenarios:
+        vault  = FakeVault(parse_latency(args.latency))
+        server = FakeVaultServer(vault).start()
+        os.environ.update({'VAULT_ADDR': server.url, 'VAULT_TOKEN': 'benchmark', 'VAULT_SKIP_VERIFY': 'false'})
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifests = os.path.join(tmpdir, 'manifests')
+            os.mkdir(manifests)
+            generate_manifests(manifests, cas, 2, 1)
+            run_pkictl(['apply', '-f', manifests, '--state-file', os.path.join(tmpdir, 'state.json')])
+
+            for i in range(cas):
+                vault.revoke(f"pki/intermediate-ca-{i}", revoked)
+
+            rotate = ['crl', 'rotate', '-f', manifests]
+            runs   = [(f"rotate -c {c}", rotate + ['-c', str(c)]) for c in concurrency]
+            # every CRL was just rebuilt, so the window skips all of them after reading each CRL once
+            runs.append((f"rotate -c {concurrency[-1]} --skip-recent 1h", rotate + ['-c', str(concurrency[-1]), '--skip-recent', '1h']))
+
+            for label, argv in runs:
+                print(f"{cas:>5} {revoked:>8}  {label:<28} {timed(vault, argv)}")
+
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
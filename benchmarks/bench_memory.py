@@ -0,0 +1,70 @@
+""" measures the peak RSS of apply with very large roles lists, running pkictl in a child process against a fake Vault server """
+from benchmarks.bench_apply import generate_manifests
+from benchmarks.fake_vault import FakeVault, FakeVaultServer
+from typing import List, Tuple
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# (intermediate CAs, hierarchy depth, roles per CA)
+DEFAULT_SCENARIOS = [(2, 1, 1000), (2, 1, 10000), (2, 1, 25000)]
+
+
+def directory_size(directory: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(directory))
+
+
+def run_pkictl(argv: List[str], env: dict) -> Tuple[float, float, int]:
+    """ returns the wall time, peak RSS in MB and exit status of a pkictl run in its own process """
+    start   = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'pkictl'] + argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    # wait4 returns the resource usage of this child alone, ru_maxrss is in kilobytes on Linux and bytes on macOS
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status)
+    elapsed = time.perf_counter() - start
+
+    rss = usage.ru_maxrss / 1024 if sys.platform != 'darwin' else usage.ru_maxrss / 1024 / 1024
+    return elapsed, rss, process.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cas', type=int, help='number of intermediate CAs, runs the default scenarios when not set')
+    parser.add_argument('--depth', type=int, default=1, help='number of levels of intermediate CAs')
+    parser.add_argument('--roles', type=int, default=10000, help='number of roles per intermediate CA')
+    parser.add_argument('--sequential', action='store_true', help='apply one operation at a time')
+    parser.add_argument('--apply-early', action='store_true', help='apply the KV engines and Root CAs while the manifests are parsed')
+    args = parser.parse_args()
+
+    scenarios = [(args.cas, args.depth, args.roles)] if args.cas else DEFAULT_SCENARIOS
+    extra     = ['--sequential'] if args.sequential else []
+    if args.apply_early:
+        extra.append('--apply-early')
+
+    print(f"{'CAs':>5} {'roles':>7} {'manifests (MB)':>15}  {'run':<10} {'wall (s)':>9} {'peak RSS (MB)':>14}")
+    for cas, depth, roles in scenarios:
+        vault  = FakeVault()
+        server = FakeVaultServer(vault).start()
+        env    = dict(os.environ, VAULT_ADDR=server.url, VAULT_TOKEN='benchmark', VAULT_SKIP_VERIFY='false')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifests = os.path.join(tmpdir, 'manifests')
+            os.mkdir(manifests)
+            generate_manifests(manifests, cas, depth, roles)
+            size = directory_size(manifests) / 1024 / 1024
+
+            # the re-apply finds nothing to change, so it measures parsing, validation and the state file alone
+            for label in ('apply', 're-apply'):
+                elapsed, rss, status = run_pkictl(['apply', '-f', manifests, '--state-file', os.path.join(tmpdir, 'state.json')] + extra, env)
+                line = f"{cas:>5} {cas * roles:>7} {size:>15.1f}  {label:<10} {elapsed:>9.2f} {rss:>14.1f}"
+                print(line if status == 0 else f"{line}  failed with status {status}")
+
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
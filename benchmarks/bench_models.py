@@ -0,0 +1,70 @@
+""" measures the time and memory spent building the request payloads of many intermediate CAs """
+from pkictl.models import IntermediateCA
+import argparse
+import sys
+import time
+import tracemalloc
+
+
+def intermediate_ca(i: int, roles: int) -> dict:
+    return {
+        'kind': 'IntermediateCA',
+        'metadata': {
+            'name': f"pki/intermediate-ca-{i}",
+            'description': f"Benchmark Intermediate CA {i}",
+            'issuer': 'pki/root-ca',
+            'kv_engine': 'kv/intermediate-ca'
+        },
+        'spec': {
+            'type': 'exported',
+            'key_type': 'rsa',
+            'key_bits': 2048,
+            'ttl': '8760h',
+            'subject': {'common_name': f"Benchmark Intermediate CA {i}", 'organization': 'pkictl'},
+            'crl': {'expiry': '72h'},
+            'roles': [{'name': f"role-{j}", 'config': {'max_ttl': '720h', 'server_flag': True, 'client_flag': False}} for j in range(roles)],
+            'policies': []
+        }
+    }
+
+
+def apply(ca: IntermediateCA) -> int:
+    """ reads every URL and body that applying an intermediate CA sends to Vault """
+    ca.csr = "-----BEGIN CERTIFICATE REQUEST-----"
+    bodies = (ca.backend_json, ca.spec_json, ca.sign_json, ca.ca_urls_json, ca.crl_config_json)
+    urls   = (ca.url, ca.issuer_sign_url, ca.set_signed_url, ca.config_url, ca.crl_config_url, ca.kv_engine_url)
+    return sum(len(b) for b in bodies) + len(urls) + len(ca.catype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cas', type=int, default=5000, help='number of intermediate CAs')
+    parser.add_argument('--roles', type=int, default=10, help='number of roles per intermediate CA')
+    args = parser.parse_args()
+
+    manifests = [intermediate_ca(i, args.roles) for i in range(args.cas)]
+
+    start = time.perf_counter()
+    cas   = [IntermediateCA("https://localhost:8200", m) for m in manifests]
+    for ca in cas:
+        apply(ca)
+    elapsed = time.perf_counter() - start
+
+    del cas
+    tracemalloc.start()
+    cas = [IntermediateCA("https://localhost:8200", m) for m in manifests]
+    retained, _ = tracemalloc.get_traced_memory()
+    for ca in cas:
+        apply(ca)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{args.cas} intermediate CAs with {args.roles} roles each")
+    print(f"time:     {elapsed * 1000:8.1f} ms  ({elapsed / args.cas * 1e6:.1f} us per CA)")
+    print(f"retained: {retained / args.cas:8.0f} B per CA")
+    print(f"peak:     {peak / args.cas:8.0f} B per CA")
+    print(f"object:   {sys.getsizeof(cas[0]):8d} B")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+""" measures how long rotate takes to scan and re-issue the CAs of a large hierarchy against a fake Vault server """
+from benchmarks.bench_apply import generate_manifests, parse_latency, run_pkictl
+from benchmarks.fake_vault import FakeVault, FakeVaultServer
+from typing import List, Optional
+import argparse
+import os
+import tempfile
+import time
+
+# (intermediate CAs, hierarchy depth)
+DEFAULT_SCENARIOS = [(100, 3), (500, 4)]
+
+
+def timed(vault: FakeVault, argv: List[str]) -> str:
+    before = vault.request_count
+    start  = time.perf_counter()
+    error: Optional[object] = None
+    try:
+        run_pkictl(argv)
+    except SystemExit as err:
+        error = err.code
+    line = f"{time.perf_counter() - start:>9.2f} {vault.request_count - before:>9}"
+    return line if error is None else f"{line}  failed: {error}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cas', type=int, help='number of intermediate CAs, runs the default scenarios when not set')
+    parser.add_argument('--depth', type=int, default=3, help='number of levels of intermediate CAs')
+    parser.add_argument('--expiring', type=float, default=0.1, metavar='FRACTION', help='the fraction of intermediate CAs that are about to expire')
+    parser.add_argument('--latency', action='append', default=['default=0.002'], metavar='ENDPOINT=SECONDS',
+                        help="delay the responses of an endpoint, 'default' applies to every endpoint")
+    parser.add_argument('-c', '--concurrency', type=int, default=10, help='the maximum number of requests to run at once')
+    args = parser.parse_args()
+
+    scenarios = [(args.cas, args.depth)] if args.cas else DEFAULT_SCENARIOS
+
+    print(f"{'CAs':>5} {'depth':>5} {'expiring':>8}  {'run':<22} {'wall (s)':>9} {'requests':>9}")
+    for cas, depth in scenarios:
+        vault  = FakeVault(parse_latency(args.latency))
+        server = FakeVaultServer(vault).start()
+        os.environ.update({'VAULT_ADDR': server.url, 'VAULT_TOKEN': 'benchmark', 'VAULT_SKIP_VERIFY': 'false'})
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifests = os.path.join(tmpdir, 'manifests')
+            os.mkdir(manifests)
+            generate_manifests(manifests, cas, depth, 1)
+            run_pkictl(['apply', '-f', manifests, '--state-file', os.path.join(tmpdir, 'state.json')])
+
+            # the CAs are spread evenly over the hierarchy, so some of the expiring ones take the CAs below them along
+            step = max(1, round(1 / args.expiring)) if args.expiring else 0
+            expiring = list(range(0, cas, step)) if step else []
+            for i in expiring:
+                vault.age_certificate(f"pki/intermediate-ca-{i}", 7)
+
+            rotate = ['rotate', '-f', manifests, '--cache-file', os.path.join(tmpdir, 'cache.json'), '-c', str(args.concurrency)]
+            runs   = [
+                ('scan (cold cache)', rotate + ['--dry-run']),
+                ('scan (warm cache)', rotate + ['--dry-run']),
+                ('rotate', rotate),
+                ('scan after rotate', rotate + ['--dry-run'])
+            ]
+            for label, argv in runs:
+                print(f"{cas:>5} {depth:>5} {len(expiring):>8}  {label:<22} {timed(vault, argv)}")
+
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+""" measures the startup cost of every subcommand by running pkictl in a fresh interpreter with -X importtime against a fake Vault server """
+from benchmarks.fake_vault import FakeVault, FakeVaultServer
+from typing import Dict, List, Set, Tuple
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MANIFEST = 'pkictl/tests/manifests/pki.yaml'
+
+# the third-party and standard library packages that are expensive enough to be worth loading lazily
+HEAVY_PACKAGES = ('requests', 'yaml', 'voluptuous', 'asyncio', 'cryptography', 'distutils')
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """ returns the (module, nesting level, cumulative microseconds) of every import reported by -X importtime """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), (len(name) - len(name.lstrip()) - 1) // 2, int(cumulative)))
+    return imports
+
+
+def run(argv: List[str], env: Dict[str, str]) -> Tuple[float, str]:
+    start  = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    return time.perf_counter() - start, result.stderr
+
+
+def measure(argv: List[str], env: Dict[str, str], baseline: Set[str], repeat: int) -> Tuple[float, float, int, List[str]]:
+    """ returns the median wall time, import time and module count of a command and the heavy packages it imported """
+    walls, import_times = [], []
+    for _ in range(repeat):
+        wall, stderr = run(argv, env)
+        imports = [i for i in parse_importtime(stderr) if i[0] not in baseline]
+
+        walls.append(wall)
+        import_times.append(sum(cumulative for _, level, cumulative in imports if level == 0) / 1e6)
+
+    names = {name for name, _, _ in imports}
+    heavy = [package for package in HEAVY_PACKAGES if package in names]
+    return statistics.median(walls), statistics.median(import_times), len(imports), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='the number of runs of every command, the median is reported')
+    args = parser.parse_args()
+
+    server = FakeVaultServer(FakeVault()).start()
+    env    = dict(os.environ, VAULT_ADDR=server.url, VAULT_TOKEN='bench', VAULT_SKIP_VERIFY='false')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        subjects = os.path.join(tmpdir, 'subjects.csv')
+        with open(subjects, 'w') as f:
+            f.write("common_name\nweb.example.com\n")
+
+        state_file = os.path.join(tmpdir, 'state.json')
+        commands   = [
+            ('--help', ['--help']),
+            ('apply --help', ['apply', '--help']),
+            ('init', ['init']),
+            ('apply', ['apply', '-f', MANIFEST, '--state-file', state_file]),
+            ('apply --sequential', ['apply', '-f', MANIFEST, '--state-file', state_file, '--refresh', '--sequential']),
+            ('plan', ['plan', '-f', MANIFEST]),
+            ('issue', ['issue', '--ca', 'pki/intermediate-ca-production', '-r', 'server', '-i', subjects, '-o', os.path.join(tmpdir, 'certs.jsonl')]),
+            ('export-bundles', ['export-bundles', '-f', MANIFEST, '-o', os.path.join(tmpdir, 'bundles')])
+        ]
+
+        # the modules every interpreter imports at startup are not attributed to pkictl
+        _, stderr = run(['-c', 'pass'], env)
+        baseline  = {name for name, _, _ in parse_importtime(stderr)}
+        python, _, _, _ = measure(['-c', 'pass'], env, set(), args.repeat)
+
+        print(f"{'command':<20} {'wall (ms)':>10} {'imports (ms)':>13} {'modules':>8}  heavy imports")
+        print(f"{'python -c pass':<20} {python * 1000:>10.1f} {0:>13.1f} {0:>8}")
+        for label, argv in commands:
+            wall, import_time, modules, heavy = measure(['-m', 'pkictl'] + argv, env, baseline, args.repeat)
+            print(f"{label:<20} {wall * 1000:>10.1f} {import_time * 1000:>13.1f} {modules:>8}  {', '.join(heavy) or '-'}")
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+""" measures how long tidy takes to clean the storage of many CAs, and how many tidies it runs at once, against a fake Vault server """
+from benchmarks.bench_apply import generate_manifests, parse_latency, run_pkictl
+from benchmarks.bench_rotate import timed
+from benchmarks.fake_vault import FakeVault, FakeVaultServer
+import argparse
+import os
+import tempfile
+
+# (intermediate CAs, expired certificates per CA)
+DEFAULT_SCENARIOS = [(20, 1000)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cas', type=int, help='number of intermediate CAs, runs the default scenarios when not set')
+    parser.add_argument('--expired', type=int, default=1000, help='number of expired certificates per CA')
+    parser.add_argument('--latency', action='append', default=['default=0.002'], metavar='ENDPOINT=SECONDS',
+                        help="delay the responses of an endpoint, 'default' applies to every endpoint")
+    parser.add_argument('--interval', type=float, default=0.1, help='how often tidy polls the progress of each tidy')
+    parser.add_argument('-c', '--concurrency', type=int, action='append', help='the numbers of tidies to run at once to compare, 1, 4 and 16 by default')
+    args = parser.parse_args()
+
+    scenarios   = [(args.cas, args.expired)] if args.cas else DEFAULT_SCENARIOS
+    concurrency = args.concurrency or [1, 4, 16]
+
+    print(f"{'CAs':>5} {'expired':>8}  {'run':<12} {'wall (s)':>9} {'requests':>9} {'peak tidies':>12}")
+    for cas, expired in scenarios:
+        vault  = FakeVault(parse_latency(args.latency))
+        server = FakeVaultServer(vault).start()
+        os.environ.update({'VAULT_ADDR': server.url, 'VAULT_TOKEN': 'benchmark', 'VAULT_SKIP_VERIFY': 'false'})
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifests = os.path.join(tmpdir, 'manifests')
+            os.mkdir(manifests)
+            generate_manifests(manifests, cas, 2, 1)
+            run_pkictl(['apply', '-f', manifests, '--state-file', os.path.join(tmpdir, 'state.json')])
+
+            for c in concurrency:
+                # every run tidies the same backlog of expired certificates
+                vault.tidies.clear()
+                for i in range(cas):
+                    vault.expire(f"pki/intermediate-ca-{i}", expired)
+
+                line = timed(vault, ['tidy', '-f', manifests, '-c', str(c), '--interval', str(args.interval)])
+                print(f"{cas:>5} {expired:>8}  {f'tidy -c {c}':<12} {line} {vault.peak_tidies():>12}")
+
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
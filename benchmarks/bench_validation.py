@@ -0,0 +1,79 @@
+""" compares the voluptuous role and policy schemas with the fast-path validators """
+from pkictl import resources, schemas
+from voluptuous import Schema
+import argparse
+import timeit
+
+
+def intermediate_ca(roles: int) -> dict:
+    return {
+        'kind': 'IntermediateCA',
+        'metadata': {
+            'name': 'pki/intermediate-ca',
+            'description': 'Benchmark Intermediate CA',
+            'issuer': 'pki/root-ca'
+        },
+        'spec': {
+            'type': 'internal',
+            'key_type': 'rsa',
+            'key_bits': 2048,
+            'ttl': '8760h',
+            'subject': {'common_name': 'Benchmark Intermediate CA'},
+            'roles': [{
+                'name': f"role-{i}",
+                'config': {
+                    'max_ttl': '720h',
+                    'ttl': '24h',
+                    'server_flag': True,
+                    'client_flag': False,
+                    'allow_subdomains': True,
+                    'allowed_domains': [f"svc-{i}-{j}.example.com" for j in range(10)]
+                }
+            } for i in range(roles)],
+            'policies': [{'name': f"policy-{i}", 'policy': 'path "*" { capabilities = ["read"] }'} for i in range(roles)]
+        }
+    }
+
+
+def legacy_schema() -> Schema:
+    """ returns the IntermediateCA schema as it was before the fast-path validators """
+    subschemas = {'roles': schemas.RolesSchema.schema, 'policies': schemas.PoliciesSchema.schema}
+
+    definition = dict(schemas.IntermediateCASchema.schema)
+    for key, value in definition.items():
+        if str(key) == 'spec':
+            definition[key] = {k: subschemas.get(str(k), v) for k, v in value.items()}
+    return Schema(definition)
+
+
+def report(label: str, seconds: float, baseline: float) -> None:
+    print(f"{label:<40} {seconds * 1000:9.2f} ms  {baseline / seconds:5.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--roles', type=int, default=500, help='number of roles and policies in the manifest')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    document = intermediate_ca(args.roles)
+    roles    = document['spec']['roles']
+    policies = document['spec']['policies']
+
+    def best(func) -> float:
+        return min(timeit.repeat(func, number=1, repeat=args.repeat))
+
+    voluptuous = best(lambda: (schemas.RolesSchema(roles), schemas.PoliciesSchema(policies)))
+    report("roles + policies: voluptuous", voluptuous, voluptuous)
+    report("roles + policies: fast path", best(lambda: (schemas.validate_roles(roles), schemas.validate_policies(policies))), voluptuous)
+
+    # previously every manifest was validated by get_validated_manifests and once more before it was applied
+    legacy = legacy_schema()
+    twice  = best(lambda: [legacy(document) for _ in range(2)])
+    report("IntermediateCA: validated twice", twice, twice)
+
+    report("IntermediateCA: single pass, fast path", best(lambda: resources.validate(document)), twice)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+""" a stateful in-process fake of the Vault endpoints that pkictl uses, with per-endpoint latency injection """
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple
+import base64
+import datetime
+import json
+import random
+import time
+
+# the endpoints that requests are counted and delayed by
+ENDPOINTS = (
+    'health', 'mounts', 'mount', 'ca', 'root-generate', 'config-urls', 'config-crl', 'config-ca', 'intermediate-generate',
+    'sign-intermediate', 'set-signed', 'roles', 'role', 'issue', 'policies', 'policy', 'kv', 'crl', 'crl-rotate',
+    'tidy', 'tidy-status'
+)
+
+
+# CA certificates are valid for this many days unless a test ages them
+CA_LIFETIME = 365
+
+# how long a tidy takes to remove each expired certificate from storage
+TIDY_SECONDS_PER_CERT = 0.0005
+
+
+def fake_pem(kind: str, name: str) -> str:
+    return f"-----BEGIN {kind}-----\n{name}\n-----END {kind}-----"
+
+
+def der(tag: int, content: bytes) -> bytes:
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, 'big') + content
+
+
+def fake_certificate(name: str, serial: int, days: float=CA_LIFETIME) -> str:
+    """ returns a PEM certificate with the structure of X.509 up to its validity, which is all pkictl reads of it """
+    now      = datetime.datetime.now(datetime.timezone.utc)
+    validity = [der(0x18, f"{t:%Y%m%d%H%M%S}Z".encode('ascii')) for t in (now, now + datetime.timedelta(days=days))]
+    subject  = der(0x30, der(0x0c, name.encode('utf-8')))
+
+    tbs = der(0x30, b''.join([
+        der(0xa0, der(0x02, b'\x02')),
+        der(0x02, serial.to_bytes(8, 'big')),
+        der(0x30, b''),
+        subject,
+        der(0x30, b''.join(validity)),
+        subject
+    ]))
+    body = base64.b64encode(der(0x30, tbs + der(0x30, b'') + der(0x03, b'\x00'))).decode('ascii')
+    return "-----BEGIN CERTIFICATE-----\n" + '\n'.join(body[i:i + 64] for i in range(0, len(body), 64)) + "\n-----END CERTIFICATE-----"
+
+
+def fake_crl(name: str, revoked: int, this_update: datetime.datetime) -> bytes:
+    """ returns a DER CRL with the structure of X.509 up to its revoked certificates, which is all pkictl reads of it """
+    times   = [der(0x18, f"{t:%Y%m%d%H%M%S}Z".encode('ascii')) for t in (this_update, this_update + datetime.timedelta(hours=72))]
+    entries = [der(0x30, der(0x02, serial.to_bytes(8, 'big')) + times[0]) for serial in range(1, revoked + 1)]
+
+    tbs = der(0x30, b''.join([
+        der(0x02, b'\x01'),
+        der(0x30, b''),
+        der(0x30, der(0x0c, name.encode('utf-8'))),
+        times[0],
+        times[1],
+        der(0x30, b''.join(entries)) if entries else b''
+    ]))
+    return der(0x30, tbs + der(0x30, b'') + der(0x03, b'\x00'))
+
+
+class FakeVault:
+    """ keeps the mounts, CAs, roles, policies and KV secrets written through the API in memory """
+
+    def __init__(self, latency: Optional[Dict[str, float]]=None, rate_limit: float=0.0):
+        self.latency      = latency or {}
+        self.rate_limit   = rate_limit
+        self.lock         = Lock()
+        self.requests     = Counter()
+        self.mounts: Dict[str, dict]           = {}
+        self.certificates: Dict[str, str]      = {}
+        self.crl_configs: Dict[str, dict]      = {}
+        self.crls: Dict[str, bytes]            = {}
+        self.revoked: Dict[str, int]           = Counter()
+        self.expired: Dict[str, int]           = Counter()
+        self.tidies: Dict[str, List[dict]]     = {}
+        self.roles: Dict[str, Dict[str, dict]] = {}
+        self.policies: Dict[str, str]          = {'default': 'path "*" {}', 'root': ''}
+        self.secrets: Dict[str, dict]          = {}
+        self.serial       = 0
+
+    def new_certificate(self, name: str) -> str:
+        # called by the handlers, which hold the lock
+        self.serial += 1
+        return fake_certificate(name, self.serial)
+
+    def age_certificate(self, mount: str, days: float) -> None:
+        """ replaces the certificate of a CA with one that expires in days """
+        self.certificates[mount] = fake_certificate(mount, 0, days)
+
+    def revoke(self, mount: str, count: int) -> None:
+        """ revokes count more certificates of a CA, which its next CRL rebuild lists """
+        with self.lock:
+            self.revoked[mount] += count
+
+    def expire(self, mount: str, count: int) -> None:
+        """ adds count expired certificates to the storage of a CA, which its next tidy removes """
+        with self.lock:
+            self.expired[mount] += count
+
+    def peak_tidies(self) -> int:
+        """ returns the largest number of tidies that were running at the same time """
+        events = sorted((t, step) for runs in self.tidies.values() for run in runs for t, step in ((run['start'], 1), (run['end'], -1)))
+        peak = running = 0
+        for _, step in events:
+            running += step
+            peak = max(peak, running)
+        return peak
+
+    @property
+    def request_count(self) -> int:
+        return sum(self.requests.values())
+
+    def find_mount(self, path: str) -> Tuple[Optional[str], str]:
+        """ splits a path into the longest matching mount and the rest of the path """
+        parts = path.split('/')
+        for i in range(len(parts), 0, -1):
+            mount = '/'.join(parts[:i])
+            if mount in self.mounts:
+                return mount, '/'.join(parts[i:])
+        return None, path
+
+    def route(self, method: str, path: str) -> Tuple[str, Optional[str], str]:
+        """ returns the endpoint, mount and remaining path of a request """
+        if path == 'sys/health':
+            return 'health', None, ''
+        if path == 'sys/mounts':
+            return 'mounts', None, ''
+        if path.startswith('sys/mounts/'):
+            return 'mount', None, path[len('sys/mounts/'):]
+        if path == 'sys/policies/acl':
+            return 'policies', None, ''
+        if path.startswith('sys/policies/acl/'):
+            return 'policy', None, path[len('sys/policies/acl/'):]
+
+        mount, rest = self.find_mount(path)
+        if mount is None:
+            return 'unknown', None, rest
+        if self.mounts[mount]['type'] == 'kv':
+            return 'kv', mount, rest
+
+        if rest in ('ca/pem', 'ca'):
+            return 'ca', mount, ''
+        if rest == 'root/generate/internal':
+            return 'root-generate', mount, ''
+        if rest == 'config/urls':
+            return 'config-urls', mount, ''
+        if rest == 'config/crl':
+            return 'config-crl', mount, ''
+        if rest == 'config/ca':
+            return 'config-ca', mount, ''
+        if rest == 'crl':
+            return 'crl', mount, ''
+        if rest == 'crl/rotate':
+            return 'crl-rotate', mount, ''
+        if rest == 'tidy':
+            return 'tidy', mount, ''
+        if rest == 'tidy-status':
+            return 'tidy-status', mount, ''
+        if rest.startswith('intermediate/generate/'):
+            return 'intermediate-generate', mount, rest.rsplit('/', 1)[1]
+        if rest == 'root/sign-intermediate':
+            return 'sign-intermediate', mount, ''
+        if rest == 'intermediate/set-signed':
+            return 'set-signed', mount, ''
+        if rest == 'roles':
+            return 'roles', mount, ''
+        if rest.startswith('roles/'):
+            return 'role', mount, rest[len('roles/'):]
+        if rest.startswith('issue/'):
+            return 'issue', mount, rest[len('issue/'):]
+        return 'unknown', mount, rest
+
+    def handle(self, method: str, path: str, body: dict) -> Tuple[int, object]:
+        """ returns the status code and body of the response to a request """
+        endpoint, mount, rest = self.route(method, path.strip('/')[len('v1/'):])
+
+        delay = self.latency.get(endpoint, self.latency.get('default', 0))
+        if delay:
+            time.sleep(delay)
+
+        # rejects a fraction of requests the way a Vault rate limit quota does
+        if self.rate_limit and endpoint != 'health' and random.random() < self.rate_limit:
+            with self.lock:
+                self.requests['rate-limited'] += 1
+            return 429, {'errors': [f'request path "{path}": rate limit quota exceeded']}
+
+        with self.lock:
+            self.requests[endpoint] += 1
+            handler = getattr(self, f"handle_{endpoint.replace('-', '_')}")
+            return handler(method, mount, rest, body)
+
+    def handle_unknown(self, method, mount, rest, body):
+        return 404, {'errors': []}
+
+    def handle_health(self, method, mount, rest, body):
+        return 200, {'initialized': True, 'sealed': False, 'standby': False, 'version': '1.11.0'}
+
+    def handle_mounts(self, method, mount, rest, body):
+        data = {f"{path}/": config for path, config in self.mounts.items()}
+        return 200, dict(data, data=data)
+
+    def handle_mount(self, method, mount, rest, body):
+        if rest in self.mounts:
+            return 400, {'errors': [f"existing mount at {rest}/"]}
+        self.mounts[rest] = {'type': body.get('type'), 'description': body.get('description', '')}
+        return 204, None
+
+    def handle_ca(self, method, mount, rest, body):
+        if mount not in self.certificates:
+            return 204, None
+        return 200, self.certificates[mount]
+
+    def handle_root_generate(self, method, mount, rest, body):
+        if mount in self.certificates:
+            return 204, None
+        self.certificates[mount] = self.new_certificate(body.get('common_name', mount))
+        return 200, {'data': {'certificate': self.certificates[mount]}}
+
+    def handle_config_urls(self, method, mount, rest, body):
+        return 204, None
+
+    def handle_config_crl(self, method, mount, rest, body):
+        if method == 'GET':
+            return 200, {'data': self.crl_configs.get(mount, {'expiry': '72h', 'disable': False})}
+        self.crl_configs[mount] = body
+        return 204, None
+
+    def handle_config_ca(self, method, mount, rest, body):
+        bundle = body.get('pem_bundle', '')
+        if 'PRIVATE KEY-----' not in bundle or '-----BEGIN CERTIFICATE-----' not in bundle:
+            return 400, {'errors': ['the PEM bundle must contain a private key and a certificate']}
+
+        certificate = bundle[bundle.index('-----BEGIN CERTIFICATE-----'):]
+        self.certificates[mount] = certificate.split('\n-----END CERTIFICATE-----')[0] + '\n-----END CERTIFICATE-----'
+        return 204, None
+
+    def handle_crl(self, method, mount, rest, body):
+        if mount not in self.certificates:
+            return 400, {'errors': ['no CA certificate']}
+        if mount not in self.crls:
+            self.crls[mount] = fake_crl(mount, self.revoked[mount], datetime.datetime.now(datetime.timezone.utc))
+        return 200, self.crls[mount]
+
+    def handle_crl_rotate(self, method, mount, rest, body):
+        if mount not in self.certificates:
+            return 400, {'errors': ['no CA certificate']}
+        self.crls[mount] = fake_crl(mount, self.revoked[mount], datetime.datetime.now(datetime.timezone.utc))
+        return 200, {'data': {'success': True}}
+
+    def handle_tidy(self, method, mount, rest, body):
+        now  = time.monotonic()
+        runs = self.tidies.setdefault(mount, [])
+        if runs and runs[-1]['end'] > now:
+            return 202, {'warnings': ['Tidy operation already in progress.']}
+
+        # the tidy runs in the background, taking longer the more certificates it removes and the longer it pauses after each
+        pause   = body.get('pause_duration', '0s')
+        pause   = float(pause[:-2]) / 1000 if pause.endswith('ms') else float(pause.rstrip('s'))
+        removed = self.expired[mount]
+        runs.append({'start': now, 'end': now + removed * (TIDY_SECONDS_PER_CERT + pause), 'removed': removed})
+        self.expired[mount] = 0
+        return 202, {'warnings': ['Tidy operation successfully started.']}
+
+    def handle_tidy_status(self, method, mount, rest, body):
+        if not self.tidies.get(mount):
+            return 200, {'data': {'state': 'Inactive', 'cert_store_deleted_count': 0, 'revoked_cert_deleted_count': 0}}
+
+        run      = self.tidies[mount][-1]
+        duration = run['end'] - run['start']
+        progress = min(1.0, (time.monotonic() - run['start']) / duration) if duration else 1.0
+        return 200, {'data': {
+            'state': 'Finished' if progress >= 1.0 else 'Running',
+            'cert_store_deleted_count': int(run['removed'] * progress),
+            'revoked_cert_deleted_count': 0
+        }}
+
+    def handle_intermediate_generate(self, method, mount, rest, body):
+        data = {'csr': fake_pem('CERTIFICATE REQUEST', body.get('common_name', mount))}
+        if rest == 'exported':
+            data['private_key'] = fake_pem('RSA PRIVATE KEY', mount)
+        return 200, {'data': data}
+
+    def handle_sign_intermediate(self, method, mount, rest, body):
+        if mount not in self.certificates:
+            return 400, {'errors': ['backend must be configured with a CA certificate/key']}
+
+        issuing_ca = self.certificates[mount]
+        return 200, {'data': {'certificate': self.new_certificate(body.get('common_name', '')), 'issuing_ca': issuing_ca, 'ca_chain': [issuing_ca]}}
+
+    def handle_set_signed(self, method, mount, rest, body):
+        self.certificates[mount] = body['certificate'].split('\n-----END CERTIFICATE-----')[0] + '\n-----END CERTIFICATE-----'
+        return 204, None
+
+    def handle_roles(self, method, mount, rest, body):
+        if not self.roles.get(mount):
+            return 404, {'errors': []}
+        return 200, {'data': {'keys': sorted(self.roles[mount])}}
+
+    def handle_role(self, method, mount, rest, body):
+        if method == 'GET':
+            if rest not in self.roles.get(mount, {}):
+                return 404, {'errors': []}
+            return 200, {'data': self.roles[mount][rest]}
+
+        self.roles.setdefault(mount, {})[rest] = body
+        return 204, None
+
+    def handle_issue(self, method, mount, rest, body):
+        if rest not in self.roles.get(mount, {}):
+            return 400, {'errors': [f"unknown role: {rest}"]}
+
+        self.serial += 1
+        return 200, {'data': {
+            'certificate': fake_pem('CERTIFICATE', body.get('common_name', '')),
+            'issuing_ca': self.certificates.get(mount, ''),
+            'private_key': fake_pem('RSA PRIVATE KEY', body.get('common_name', '')),
+            'private_key_type': 'rsa',
+            'serial_number': f"{self.serial:016x}"
+        }}
+
+    def handle_policies(self, method, mount, rest, body):
+        return 200, {'data': {'keys': sorted(self.policies)}}
+
+    def handle_policy(self, method, mount, rest, body):
+        if method == 'GET':
+            if rest not in self.policies:
+                return 404, {'errors': []}
+            return 200, {'data': {'name': rest, 'policy': self.policies[rest]}}
+
+        self.policies[rest] = body['policy']
+        return 204, None
+
+    def handle_kv(self, method, mount, rest, body):
+        key = f"{mount}/{rest}"
+        if method == 'GET':
+            if key not in self.secrets:
+                return 404, {'errors': []}
+            return 200, {'data': self.secrets[key]}
+
+        self.secrets[key] = body
+        return 204, None
+
+
+class FakeVaultHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw    = self.rfile.read(length) if length else b''
+
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+
+        status, payload = self.server.vault.handle(self.command, self.path, body)
+
+        if payload is None:
+            content, content_type = b'', 'application/json'
+        elif isinstance(payload, str):
+            content, content_type = payload.encode('utf-8'), 'application/pkix-cert'
+        elif isinstance(payload, bytes):
+            content, content_type = payload, 'application/pkix-crl'
+        else:
+            content, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_LIST = do_DELETE = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeVaultServer(ThreadingMixIn, HTTPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__(self, vault: FakeVault, port: int=0):
+        super().__init__(('127.0.0.1', port), FakeVaultHandler)
+        self.vault = vault
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> 'FakeVaultServer':
+        Thread(target=self.serve_forever, args=[0.01], daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,160 @@
+from .defaults import DEFAULT_CONCURRENCY
+from .models import RootCA, IntermediateCA, KeyValueEngine
+from . import utils
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import sys
+
+
+class ApplyError(Exception):
+    """ raised when a Vault operation fails during an asynchronous apply """
+
+
+class AsyncVaultClient:
+    """ asyncio interface to a VaultClient running at most `concurrency` blocking operations at once in a thread pool, cancelling one only abandons its result as the HTTP call in flight still completes """
+
+    def __init__(self, vault_client, concurrency=DEFAULT_CONCURRENCY):
+        self.client    = vault_client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor  = ThreadPoolExecutor(max_workers=concurrency)
+
+    @property
+    def baseurl(self):
+        return self.client.baseurl
+
+    def close(self):
+        """ drops the queued operations without waiting for the ones already running in the worker threads """
+        if sys.version_info >= (3, 9):
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            self.executor.shutdown(wait=False)
+
+    def call(self, operation, *args, **kwargs):
+        try:
+            return getattr(self.client, operation)(*args, **kwargs)
+        except SystemExit as err:
+            raise ApplyError(err.code)
+
+    async def run(self, operation, *args, **kwargs):
+        """ runs a blocking VaultClient operation in the worker pool """
+        loop = asyncio.get_event_loop()
+        async with self.semaphore:
+            return await loop.run_in_executor(self.executor, utils.bind_target(functools.partial(self.call, operation, *args, **kwargs)))
+
+    async def healthcheck(self):
+        return await self.run('healthcheck')
+
+    async def mount_kv_engine(self, kvengine):
+        return await self.run('mount_kv_engine', kvengine)
+
+    async def store_ca_private_key(self, ca):
+        return await self.run('store_ca_private_key', ca)
+
+    async def mount_pki_engine(self, ca):
+        return await self.run('mount_pki_engine', ca)
+
+    async def check_existing_ca(self, ca, quiet=False):
+        return await self.run('check_existing_ca', ca, quiet=quiet)
+
+    async def create_root_ca(self, ca):
+        return await self.run('create_root_ca', ca)
+
+    async def configure_ca_urls(self, ca):
+        return await self.run('configure_ca_urls', ca)
+
+    async def set_crl_configuration(self, ca):
+        return await self.run('set_crl_configuration', ca)
+
+    async def create_intermediate_ca(self, ca):
+        return await self.run('create_intermediate_ca', ca)
+
+    async def sign_intermediate_ca(self, ca):
+        return await self.run('sign_intermediate_ca', ca)
+
+    async def set_intermediate_ca(self, ca):
+        return await self.run('set_intermediate_ca', ca)
+
+    async def configure_ca_roles(self, ca):
+        return await self.run('configure_ca_roles', ca)
+
+    async def configure_ca_policies(self, ca):
+        return await self.run('configure_ca_policies', ca)
+
+    async def tidy(self, name, safety_buffer, pause_duration=None):
+        return await self.run('tidy', name, safety_buffer, pause_duration)
+
+    async def read_tidy_status(self, name):
+        return await self.run('read_tidy_status', name)
+
+
+async def run_concurrently(coroutines):
+    """ runs coroutines concurrently, cancelling the ones still in flight on the first failure """
+    tasks = [asyncio.ensure_future(c) for c in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def apply_kv_engine(client, kve):
+    kvengine = KeyValueEngine(client.baseurl, kve)
+    await client.mount_kv_engine(kvengine)
+
+
+async def apply_root_ca(client, ca):
+    root_ca = RootCA(client.baseurl, ca)
+
+    await client.mount_pki_engine(root_ca)
+    await client.create_root_ca(root_ca)
+    if not await client.check_existing_ca(root_ca, quiet=True):
+        await client.configure_ca_urls(root_ca)
+
+
+async def apply_intermediate_ca(client, ca):
+    intermediate_ca = IntermediateCA(client.baseurl, ca)
+
+    await client.mount_pki_engine(intermediate_ca)
+
+    if not await client.check_existing_ca(intermediate_ca):
+        await client.create_intermediate_ca(intermediate_ca)
+        await client.sign_intermediate_ca(intermediate_ca)
+        await client.set_intermediate_ca(intermediate_ca)
+
+        steps = [client.configure_ca_urls(intermediate_ca), client.set_crl_configuration(intermediate_ca)]
+        if intermediate_ca.store_private_key:
+            steps.append(client.store_ca_private_key(intermediate_ca))
+        await run_concurrently(steps)
+
+    await run_concurrently([client.configure_ca_roles(intermediate_ca), client.configure_ca_policies(intermediate_ca)])
+
+
+async def apply_manifests(client, roots, levels, kv_engines):
+    """ applies the validated manifests, running independent operations concurrently """
+    # KV engines and Root CAs do not depend on each other
+    steps = [apply_kv_engine(client, kve) for kve in kv_engines]
+    steps.extend(apply_root_ca(client, ca) for ca in roots)
+    await run_concurrently(steps)
+
+    # the intermediate CAs within a level are independent subtrees of the hierarchy
+    for level in levels:
+        await run_concurrently([apply_intermediate_ca(client, ca) for ca in level])
+
+
+def run_apply(vault_client, roots, levels, kv_engines, concurrency=DEFAULT_CONCURRENCY):
+    """ runs an asynchronous apply to completion, exiting on the first fatal error """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    client = AsyncVaultClient(vault_client, concurrency)
+    try:
+        loop.run_until_complete(apply_manifests(client, roots, levels, kv_engines))
+    except ApplyError as err:
+        sys.exit(err.args[0])
+    finally:
+        client.close()
+        loop.close()
+        asyncio.set_event_loop(None)
@@ -0,0 +1,98 @@
+from .defaults import DEFAULT_BUNDLE_FILE, DEFAULT_OUT_DIR
+from . import utils
+from typing import Dict, List, Optional, Tuple
+import os
+
+
+def get_issuers(roots: List[dict], levels: List[List[dict]]) -> Dict[str, Optional[str]]:
+    """ maps every CA to its issuer, Root CAs first and then the intermediate CAs level by level """
+    issuers: Dict[str, Optional[str]] = {ca['metadata']['name']: None for ca in roots}
+    for level in levels:
+        for ca in level:
+            issuers[ca['metadata']['name']] = ca['metadata']['issuer']
+    return issuers
+
+
+def build_chains(certificates: Dict[str, str], issuers: Dict[str, Optional[str]]) -> Dict[str, List[str]]:
+    """ returns the certificates of every CA followed by those of its issuers up to the Root CA """
+    chains: Dict[str, List[str]] = {}
+
+    # the issuers come before the CAs they issued, so their chains are only built once
+    for name, issuer in issuers.items():
+        chain = [certificates[name]]
+        if issuer is not None:
+            chain.extend(chains[issuer])
+        chains[name] = chain
+    return chains
+
+
+def build_trust_bundle(chains: Dict[str, List[str]]) -> List[str]:
+    """ returns every certificate once, with each issuer ahead of the CAs it issued """
+    bundle: Dict[str, None] = {}
+    for chain in chains.values():
+        for certificate in reversed(chain):
+            bundle.setdefault(certificate, None)
+    return list(bundle)
+
+
+def to_pem(certificates: List[str]) -> str:
+    return '\n'.join(certificates) + '\n'
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    """ atomically writes a certificate file unless it already has the content, returning whether it was written """
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    utils.write_atomic(path, content, mode=0o644)
+    return True
+
+
+def write_bundles(out_dir: str, chains: Dict[str, List[str]], bundle: List[str], bundle_file: str=DEFAULT_BUNDLE_FILE) -> Tuple[int, int]:
+    """ writes a chain file per CA and the trust bundle to out_dir, returning the number of files written and unchanged """
+    files = {os.path.join(out_dir, f"{name}.pem"): to_pem(chain) for name, chain in chains.items()}
+    files[os.path.join(out_dir, bundle_file)] = to_pem(bundle)
+
+    written = 0
+    for path, content in files.items():
+        try:
+            written += write_if_changed(path, content)
+        except OSError as err:
+            utils.exit_with_message(f"Failed to write {path}: {err.strerror}")
+    return written, len(files) - written
+
+
+def export_bundles(vault_client, roots: List[dict], intermediates: List[dict], out_dir: str=DEFAULT_OUT_DIR, bundle_file: str=DEFAULT_BUNDLE_FILE, kv_path: Optional[str]=None) -> Dict[str, List[str]]:
+    """ fetches the certificate of every CA concurrently and exports their chains and the combined trust bundle """
+    levels  = utils.get_intermediate_ca_levels(intermediates, roots)
+    issuers = get_issuers(roots, levels)
+
+    # every CA is fetched once, however many chains its certificate appears in
+    names   = list(issuers)
+    fetched = vault_client.map_concurrently(vault_client.read_ca_certificate, names)
+    missing = [name for name, certificate in zip(names, fetched) if certificate is None]
+
+    if missing:
+        utils.exit_with_message(f"CAs have not been generated yet: {', '.join(missing)}")
+
+    certificates = {name: certificate.strip() for name, certificate in zip(names, fetched)}
+    chains       = build_chains(certificates, issuers)
+    bundle       = build_trust_bundle(chains)
+
+    written, unchanged = write_bundles(out_dir, chains, bundle, bundle_file)
+    utils.output_message(f"Exported the chains of {len(chains)} CAs and a trust bundle of {len(bundle)} certificates to {out_dir} ({written} written, {unchanged} unchanged)")
+
+    if kv_path:
+        vault_client.write_secret(kv_path, {
+            'trust_bundle': to_pem(bundle),
+            'chains': {name: to_pem(chain) for name, chain in chains.items()}
+        })
+    return chains
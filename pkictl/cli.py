@@ -1,3 +1,7 @@
+from .defaults import (DEFAULT_BUNDLE_FILE, DEFAULT_CERT_CACHE_FILE, DEFAULT_CONCURRENCY, DEFAULT_INTERVAL, DEFAULT_ISSUE_CONCURRENCY,
+                       DEFAULT_MAX_RETRIES, DEFAULT_OUT_DIR, DEFAULT_POOL_SIZE, DEFAULT_ROTATE_THRESHOLD, DEFAULT_SAFETY_BUFFER, DEFAULT_STATE_FILE,
+                       DEFAULT_TIDY_CONCURRENCY, DEFAULT_TIDY_INTERVAL)
+from .events import FORMATS
 import argparse
 
 
@@ -13,8 +17,30 @@ def cli():
 
     parser.add_argument('-d', '--debug', dest='debugging',
         action='store_true', default=False, help='enable debug output')
+    parser.add_argument('--log-format', dest='log_format', type=str, choices=FORMATS, default='human',
+        action='store', help='output messages for people to read or as JSON lines')
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', dest='record', type=str, metavar='FILE', default=None,
+        action='store', help='record the exchanges with Vault to a cassette file, with tokens and private keys redacted')
+    cassette.add_argument('--replay', dest='replay', type=str, metavar='FILE', default=None,
+        action='store', help='answer the requests to Vault from a cassette file instead of a Vault server')
+    parser.add_argument('--replay-latency', dest='replay_latency', action='store_true', default=False,
+        help='take as long to answer each replayed request as the recorded exchange took')
+    parser.add_argument('--har', dest='har', type=str, metavar='FILE', default=None,
+        action='store', help='write the recorded or replayed exchanges to an HTTP Archive file with their timings')
     parser.add_argument('-V', '--version', action='version', version='Vault-PKI 0.1')
 
+    # the options of the Vault client shared by the subcommands that talk to an unsealed Vault server
+    client_options = argparse.ArgumentParser(add_help=False)
+    client_options.add_argument('-u', '--url', dest='baseurl', type=str, metavar='URL',
+        action='store', required=False, help='the URL of the Vault server')
+    client_options.add_argument('--max-retries', dest='max_retries', type=int, metavar='N', default=DEFAULT_MAX_RETRIES,
+        action='store', required=False, help='the number of times to retry a request that Vault rate limited or could not serve')
+    client_options.add_argument('--metrics-file', dest='metrics_file', type=str, metavar='FILE', default=None,
+        action='store', required=False, help='write request timings per operation to a JSON or Prometheus (.prom) file')
+    client_options.add_argument('--tls-skip-verify', nargs='?', dest='tls_skip_verify',
+        const=True, default=None, help="disable verification of the Vault server's SSL certificate")
+
     subparsers = parser.add_subparsers(title='subcommands', dest='subcommand', metavar='')
 
     init = subparsers.add_parser(
@@ -30,15 +56,176 @@ def cli():
 
     apply = subparsers.add_parser(
         'apply',
+        parents=[client_options],
         help="Creates PKI secrets from a YAML file",
         formatter_class=custom_formatter
     )
 
-    apply.add_argument('-u', '--url', dest='baseurl', type=str, metavar='URL',
-        action='store', required=False, help='the URL of the Vault server')
-    apply.add_argument('-f', '--file', dest='file', type=str,
+    source = apply.add_mutually_exclusive_group(required=True)
+    source.add_argument('-f', '--file', dest='file', type=str,
+        action='store', help='the path to the configuration manifest(s)')
+    source.add_argument('--plan', dest='plan', type=str, metavar='FILE',
+        action='store', help='apply the changes saved by the plan subcommand')
+    apply.add_argument('--targets', dest='targets', type=str, metavar='FILE', default=None,
+        action='store', required=False, help='a YAML file listing the Vault clusters to apply the manifests to concurrently')
+    apply.add_argument('--pool-size', dest='pool_size', type=int, metavar='N', default=DEFAULT_POOL_SIZE,
+        action='store', required=False, help='the number of keep-alive connections to the Vault server')
+    apply.add_argument('-c', '--concurrency', dest='concurrency', type=int, metavar='N', default=DEFAULT_CONCURRENCY,
+        action='store', required=False, help='the maximum number of Vault operations to run at once')
+    apply.add_argument('--sequential', dest='sequential', action='store_true', default=False,
+        help='apply the manifests one operation at a time')
+    apply.add_argument('--keygen-workers', dest='keygen_workers', type=int, metavar='N', default=None,
+        action='store', required=False, help='the number of processes generating the keys of local intermediate CAs, one per CPU by default')
+    apply.add_argument('--overwrite', dest='overwrite', action='store_true', default=False,
+        help='rewrite roles and policies even when they match the ones in Vault')
+    apply.add_argument('--state-file', dest='state_file', type=str, metavar='FILE', default=DEFAULT_STATE_FILE,
+        action='store', required=False, help='the file recording the resources that have been applied')
+    apply.add_argument('--refresh', dest='refresh', action='store_true', default=False,
+        help='ignore the state file and reprocess every resource')
+    apply.add_argument('--prune', dest='prune', action='store_true', default=False,
+        help='remove resources that are no longer in the manifests from the state file')
+    apply.add_argument('--apply-early', dest='apply_early', action='store_true', default=False,
+        help='apply changed KV engines and Root CAs while the remaining manifests are parsed, before they are all validated')
+
+    watch = subparsers.add_parser(
+        'watch',
+        parents=[client_options],
+        help="Applies the YAML manifests and re-applies them whenever they change",
+        formatter_class=custom_formatter
+    )
+
+    watch.add_argument('-f', '--file', dest='file', type=str,
         action='store', required=True, help='the path to the configuration manifest(s)')
-    apply.add_argument('--tls-skip-verify', nargs='?', dest='tls_skip_verify',
-        const=True, default=None, help="disable verification of the Vault server's SSL certificate")
+    watch.add_argument('--poll', dest='poll', action='store_true', default=False,
+        help='poll the manifests for changes instead of using inotify, e.g. on network filesystems')
+    watch.add_argument('--interval', dest='interval', type=float, metavar='SECONDS', default=DEFAULT_INTERVAL,
+        action='store', required=False, help='how often to poll the manifests for changes')
+    watch.add_argument('--pool-size', dest='pool_size', type=int, metavar='N', default=DEFAULT_POOL_SIZE,
+        action='store', required=False, help='the number of keep-alive connections to the Vault server')
+    watch.add_argument('-c', '--concurrency', dest='concurrency', type=int, metavar='N', default=DEFAULT_CONCURRENCY,
+        action='store', required=False, help='the maximum number of Vault operations to run at once')
+    watch.add_argument('--sequential', dest='sequential', action='store_true', default=False,
+        help='apply the manifests one operation at a time')
+    watch.add_argument('--keygen-workers', dest='keygen_workers', type=int, metavar='N', default=None,
+        action='store', required=False, help='the number of processes generating the keys of local intermediate CAs, one per CPU by default')
+    watch.add_argument('--overwrite', dest='overwrite', action='store_true', default=False,
+        help='rewrite roles and policies even when they match the ones in Vault')
+    watch.add_argument('--state-file', dest='state_file', type=str, metavar='FILE', default=DEFAULT_STATE_FILE,
+        action='store', required=False, help='the file recording the resources that have been applied')
+    watch.add_argument('--refresh', dest='refresh', action='store_true', default=False,
+        help='ignore the state file and reprocess every resource on the first apply')
+    watch.add_argument('--prune', dest='prune', action='store_true', default=False,
+        help='remove resources that are no longer in the manifests from the state file')
+
+    plan = subparsers.add_parser(
+        'plan',
+        parents=[client_options],
+        help="Shows the changes apply would make to the Vault server",
+        formatter_class=custom_formatter
+    )
+
+    plan.add_argument('-f', '--file', dest='file', type=str,
+        action='store', required=True, help='the path to the configuration manifest(s)')
+    plan.add_argument('-o', '--out', dest='out', type=str, metavar='FILE',
+        action='store', required=False, help='save the plan to a file for use with apply --plan')
+
+    issue = subparsers.add_parser(
+        'issue',
+        parents=[client_options],
+        help="Issues certificates in bulk from a role of an intermediate CA",
+        formatter_class=custom_formatter
+    )
+
+    issue.add_argument('--ca', dest='ca', type=str, metavar='NAME',
+        action='store', required=True, help='the name of the intermediate CA')
+    issue.add_argument('-r', '--role', dest='role', type=str, metavar='ROLE',
+        action='store', required=True, help='the role to issue the certificates from')
+    issue.add_argument('-i', '--input', dest='input', type=str, metavar='FILE',
+        action='store', required=True, help='a CSV or JSONL file of subjects to issue certificates for')
+    issue.add_argument('-o', '--out', dest='out', type=str, metavar='FILE',
+        action='store', required=True, help='the JSONL file to append the issued certificates to')
+    issue.add_argument('--format', dest='format', type=str, choices=['csv', 'jsonl'], default=None,
+        action='store', required=False, help='the format of the input file, detected from its extension by default')
+    issue.add_argument('-c', '--concurrency', dest='concurrency', type=int, metavar='N', default=DEFAULT_ISSUE_CONCURRENCY,
+        action='store', required=False, help='the maximum number of certificates to issue at once')
+
+    export_bundles = subparsers.add_parser(
+        'export-bundles',
+        parents=[client_options],
+        help="Exports the certificate chains of the CAs and a combined trust bundle",
+        formatter_class=custom_formatter
+    )
+
+    export_bundles.add_argument('-f', '--file', dest='file', type=str,
+        action='store', required=True, help='the path to the configuration manifest(s)')
+    export_bundles.add_argument('-o', '--out-dir', dest='out_dir', type=str, metavar='DIR', default=DEFAULT_OUT_DIR,
+        action='store', required=False, help='the directory to write a chain file per CA and the trust bundle to')
+    export_bundles.add_argument('--bundle', dest='bundle', type=str, metavar='FILE', default=DEFAULT_BUNDLE_FILE,
+        action='store', required=False, help='the name of the trust bundle file in the output directory')
+    export_bundles.add_argument('--kv-path', dest='kv_path', type=str, metavar='PATH', default=None,
+        action='store', required=False, help='also publish the chains and the trust bundle to this path of a KV engine')
+    export_bundles.add_argument('-c', '--concurrency', dest='concurrency', type=int, metavar='N', default=DEFAULT_POOL_SIZE,
+        action='store', required=False, help='the maximum number of CA certificates to fetch at once')
+
+    rotate = subparsers.add_parser(
+        'rotate',
+        parents=[client_options],
+        help="Re-issues the intermediate CAs that are about to expire",
+        formatter_class=custom_formatter
+    )
+
+    rotate.add_argument('-f', '--file', dest='file', type=str,
+        action='store', required=True, help='the path to the configuration manifest(s)')
+    rotate.add_argument('--threshold', dest='threshold', type=int, metavar='DAYS', default=DEFAULT_ROTATE_THRESHOLD,
+        action='store', required=False, help='rotate the intermediate CAs that expire within this many days')
+    rotate.add_argument('--dry-run', dest='dry_run', action='store_true', default=False,
+        help='only report which intermediate CAs would be rotated')
+    rotate.add_argument('--cache-file', dest='cache_file', type=str, metavar='FILE', default=DEFAULT_CERT_CACHE_FILE,
+        action='store', required=False, help='the file that keeps the validity of the certificates already parsed')
+    rotate.add_argument('-c', '--concurrency', dest='concurrency', type=int, metavar='N', default=DEFAULT_CONCURRENCY,
+        action='store', required=False, help='the maximum number of CA certificates to fetch or CAs to rotate at once')
+    rotate.add_argument('--keygen-workers', dest='keygen_workers', type=int, metavar='N', default=None,
+        action='store', required=False, help='the number of processes generating the keys of local intermediate CAs, one per CPU by default')
+
+    crl = subparsers.add_parser(
+        'crl',
+        help="Manages the certificate revocation lists of the CAs",
+        formatter_class=custom_formatter
+    )
+
+    crl_subparsers = crl.add_subparsers(title='subcommands', dest='crl_command', metavar='COMMAND')
+    crl_subparsers.required = True
+
+    crl_rotate = crl_subparsers.add_parser(
+        'rotate',
+        parents=[client_options],
+        help="Rebuilds the CRLs of the CAs concurrently",
+        formatter_class=custom_formatter
+    )
+
+    crl_rotate.add_argument('-f', '--file', dest='file', type=str,
+        action='store', required=True, help='the path to the configuration manifest(s)')
+    crl_rotate.add_argument('--skip-recent', dest='skip_recent', type=str, metavar='DURATION', default=None,
+        action='store', required=False, help="skip the CAs whose CRL was rebuilt within this duration, e.g. '30m' or '1h'")
+    crl_rotate.add_argument('-c', '--concurrency', dest='concurrency', type=int, metavar='N', default=DEFAULT_CONCURRENCY,
+        action='store', required=False, help='the maximum number of CRLs to rebuild at once')
+
+    tidy = subparsers.add_parser(
+        'tidy',
+        parents=[client_options],
+        help="Removes the expired certificates of the CAs from storage",
+        formatter_class=custom_formatter
+    )
+
+    tidy.add_argument('-f', '--file', dest='file', type=str,
+        action='store', required=True, help='the path to the configuration manifest(s)')
+    tidy.add_argument('-c', '--concurrency', dest='concurrency', type=int, metavar='N', default=DEFAULT_TIDY_CONCURRENCY,
+        action='store', required=False, help='the maximum number of CAs to tidy at once')
+    tidy.add_argument('--safety-buffer', dest='safety_buffer', type=str, metavar='DURATION', default=DEFAULT_SAFETY_BUFFER,
+        action='store', required=False, help='only remove the certificates that expired longer ago than this')
+    tidy.add_argument('--pause', dest='pause', type=str, metavar='DURATION', default=None,
+        action='store', required=False, help="make Vault pause this long after each certificate it removes, e.g. '10ms', to lighten the load")
+    tidy.add_argument('--interval', dest='interval', type=float, metavar='SECONDS', default=DEFAULT_TIDY_INTERVAL,
+        action='store', required=False, help='how often to poll the progress of each tidy')
 
     return parser
@@ -0,0 +1,109 @@
+from .der import INTEGER, SEQUENCE, parse_time, read_element
+from . import utils
+from collections import Counter
+from typing import Iterator, List, Optional, Tuple
+import datetime
+import time
+
+REBUILT = 'rebuilt'
+SKIPPED = 'skipped'
+FAILED  = 'failed'
+
+
+def parse_crl(der: bytes) -> Tuple[datetime.datetime, int]:
+    """ returns when a DER encoded CRL was issued and the number of certificates it revokes """
+    try:
+        # CertificateList ::= SEQUENCE { tbsCertList SEQUENCE { version OPTIONAL, signature, issuer, thisUpdate, ... } }
+        _, offset, _ = read_element(der, 0)
+        tag, offset, tbs_end = read_element(der, offset)
+        if tag != SEQUENCE:
+            raise ValueError("the CRL does not start with a TBSCertList")
+
+        tag, _, end = read_element(der, offset)
+        if tag == INTEGER:
+            offset = end
+
+        # the signature algorithm and issuer come before thisUpdate
+        for _ in range(2):
+            _, _, offset = read_element(der, offset)
+
+        tag, start, offset = read_element(der, offset)
+        this_update = parse_time(tag, der[start:offset])
+
+        # nextUpdate is a time and the extensions are tagged [0], so the only sequence left is the list of revoked certificates
+        revoked = 0
+        while offset < tbs_end:
+            tag, start, offset = read_element(der, offset)
+            if tag != SEQUENCE:
+                continue
+            while start < offset:
+                _, _, start = read_element(der, start)
+                revoked += 1
+    except (IndexError, ValueError, UnicodeDecodeError) as err:
+        raise ValueError(f"failed to parse CRL: {err}")
+    return this_update, revoked
+
+
+def format_age(seconds: float) -> str:
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.0f}h"
+
+
+def rebuild_crl(vault_client, name: str, skip_recent: Optional[int]=None) -> Tuple[str, str]:
+    """ rebuilds the CRL of a CA unless it was rebuilt less than skip_recent seconds ago, returning a message and the outcome """
+    if skip_recent:
+        crl = vault_client.read_crl(name)
+        try:
+            this_update = parse_crl(crl)[0] if crl else None
+        except ValueError:
+            # a CRL that cannot be read is rebuilt, which replaces it
+            this_update = None
+
+        if this_update is not None:
+            age = (datetime.datetime.now(datetime.timezone.utc) - this_update).total_seconds()
+            if age < skip_recent:
+                return f"Skipped the CRL of CA '{name}', which was rebuilt {format_age(max(age, 0))} ago", SKIPPED
+
+    start = time.perf_counter()
+    if not vault_client.rotate_crl(name):
+        return f"Failed to rebuild the CRL of CA: {name}", FAILED
+    elapsed = time.perf_counter() - start
+
+    # the size is that of the CRL Vault serves, which is the one the rebuild wrote
+    crl = vault_client.read_crl(name)
+    if crl is None:
+        details = "no CRL returned"
+    else:
+        try:
+            details = f"{len(crl)} bytes, {parse_crl(crl)[1]} revoked certificates"
+        except ValueError:
+            details = f"{len(crl)} bytes"
+    return f"Rebuilt the CRL of CA '{name}' in {elapsed:.2f}s ({details})", REBUILT
+
+
+def rebuild_crls(vault_client, roots: List[dict], intermediates: List[dict], skip_recent: Optional[int]=None) -> Counter:
+    """ rebuilds the CRLs of the CAs concurrently, outputting each rebuild as it completes, and returns the number of each outcome """
+    names = []
+    for ca in roots + intermediates:
+        name = ca['metadata']['name']
+        if ca['spec'].get('crl', {}).get('disable'):
+            utils.output_message(f"Skipped the CRL of CA '{name}', which is disabled")
+            continue
+        names.append(name)
+
+    outcomes: Counter = Counter()
+
+    def counted(results: Iterator[Tuple[str, str]]) -> Iterator[Tuple[str, bool]]:
+        for msg, outcome in results:
+            outcomes[outcome] += 1
+            yield msg, outcome != FAILED
+
+    start   = time.perf_counter()
+    results = vault_client.imap_concurrently(lambda name: rebuild_crl(vault_client, name, skip_recent), names)
+    vault_client.report_results(counted(results), "Failed to rebuild the CRLs of {count} CAs")
+
+    utils.output_message(f"Rebuilt {outcomes[REBUILT]} CRLs in {time.perf_counter() - start:.2f}s, skipped {outcomes[SKIPPED]} rebuilt recently")
+    return outcomes
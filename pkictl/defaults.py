@@ -0,0 +1,15 @@
+# the defaults of the command-line options, kept apart so that parsing the arguments does not import the modules that use them
+
+DEFAULT_POOL_SIZE         = 10
+DEFAULT_CONCURRENCY       = 10
+DEFAULT_ISSUE_CONCURRENCY = 10
+DEFAULT_MAX_RETRIES       = 5
+DEFAULT_STATE_FILE        = '.pkictl-state.json'
+DEFAULT_INTERVAL          = 1.0
+DEFAULT_OUT_DIR           = 'bundles'
+DEFAULT_BUNDLE_FILE       = 'trust-bundle.pem'
+DEFAULT_ROTATE_THRESHOLD  = 30
+DEFAULT_CERT_CACHE_FILE   = '.pkictl-cert-cache.json'
+DEFAULT_TIDY_CONCURRENCY  = 2
+DEFAULT_TIDY_INTERVAL     = 5.0
+DEFAULT_SAFETY_BUFFER     = '72h'
@@ -0,0 +1,39 @@
+# the few DER elements pkictl reads out of certificates and CRLs, without a dependency on an ASN.1 library
+
+from typing import Tuple
+import datetime
+
+INTEGER          = 0x02
+UTC_TIME         = 0x17
+GENERALIZED_TIME = 0x18
+SEQUENCE         = 0x30
+VERSION          = 0xa0
+
+
+def read_element(der: bytes, offset: int) -> Tuple[int, int, int]:
+    """ returns the tag of the DER element at offset and the start and end of its contents """
+    tag    = der[offset]
+    length = der[offset + 1]
+    offset += 2
+
+    # lengths over 127 bytes are encoded in the number of bytes given by the low bits
+    if length & 0x80:
+        size   = length & 0x7f
+        length = int.from_bytes(der[offset:offset + size], 'big')
+        offset += size
+
+    if offset + length > len(der):
+        raise ValueError("truncated DER element")
+    return tag, offset, offset + length
+
+
+def parse_time(tag: int, value: bytes) -> datetime.datetime:
+    """ decodes the contents of a UTCTime or GeneralizedTime element """
+    text = value.decode('ascii')
+    if tag == UTC_TIME:
+        # two digit years from 50 are in the twentieth century (RFC 5280, 4.1.2.5.1)
+        year = int(text[:2])
+        text = f"{1900 + year if year >= 50 else 2000 + year}{text[2:]}"
+    elif tag != GENERALIZED_TIME:
+        raise ValueError(f"unexpected time tag {tag:#x}")
+    return datetime.datetime.strptime(text, '%Y%m%d%H%M%SZ').replace(tzinfo=datetime.timezone.utc)
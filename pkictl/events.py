@@ -0,0 +1,164 @@
+from typing import Callable, Dict, List, Optional, TextIO, Union
+import datetime
+import hashlib
+import json
+import queue
+import sys
+import threading
+
+DEBUG = 10
+INFO  = 20
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', ERROR: 'error'}
+
+FORMATS = ('human', 'json')
+
+# response bodies are cut to this many characters in debug output, as a PEM chain runs to several kilobytes
+BODY_LIMIT = 256
+
+# a message is either text or a function that returns it, which is only called if the event is written
+Message = Union[str, Callable[[], str]]
+
+
+class Event:
+    """ a message output by pkictl, with its level, the Vault cluster it concerns and any structured fields """
+
+    __slots__ = ('level', 'message', 'target', 'time', 'fields')
+
+    def __init__(self, level: int, message: Message, target: Optional[str]=None, fields: Optional[dict]=None):
+        self.level   = level
+        self.message = message
+        self.target  = target
+        self.time    = datetime.datetime.now(datetime.timezone.utc)
+        self.fields  = fields or {}
+
+    @property
+    def text(self) -> str:
+        if callable(self.message):
+            try:
+                self.message = self.message()
+            except Exception as err:
+                self.message = f"failed to format message: {err!r}"
+        return self.message
+
+
+def format_human(event: Event) -> str:
+    message = ["[-]" if event.level >= ERROR else "[*]", 'pkictl' if event.target is None else f"pkictl[{event.target}]", '-', event.text]
+    if event.level >= ERROR:
+        message.insert(3, "Error:")
+    return ' '.join(message)
+
+
+def format_json(event: Event) -> str:
+    record = {
+        'time': event.time.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        'level': LEVEL_NAMES.get(event.level, str(event.level)),
+        'message': event.text
+    }
+    if event.target is not None:
+        record['target'] = event.target
+    record.update(event.fields)
+    return json.dumps(record, default=str)
+
+
+FORMATTERS: Dict[str, Callable[[Event], str]] = {
+    'human': format_human,
+    'json': format_json
+}
+
+
+def summarize_body(text: str, limit: int=BODY_LIMIT) -> str:
+    """ shortens a long response body for debug output, keeping a digest of the whole body to tell them apart """
+    if len(text) <= limit:
+        return text
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+    return f"{text[:limit]}... ({len(text)} characters, sha256:{digest})"
+
+
+class EventLog:
+    """ writes events to standard output, either as they are emitted or in batches from a background thread """
+
+    def __init__(self, stream: Optional[TextIO]=None, fmt: str='human', level: int=DEBUG):
+        self.stream = stream
+        self.level  = level
+        self.format = FORMATTERS[fmt]
+        self.queue: Optional[queue.Queue] = None
+        self.writer: Optional[threading.Thread] = None
+        self.failed = False
+
+    def configure(self, fmt: Optional[str]=None, level: Optional[int]=None) -> None:
+        if fmt is not None:
+            self.format = FORMATTERS[fmt]
+        if level is not None:
+            self.level = level
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def emit(self, level: int, message: Message, target: Optional[str]=None, fields: Optional[dict]=None) -> None:
+        if level < self.level:
+            return
+
+        event = Event(level, message, target, fields)
+        if self.queue is not None:
+            self.queue.put(event)
+        else:
+            self.write([event])
+
+    def write(self, events: List[Event]) -> None:
+        # the stream is looked up on every write so that a redirected sys.stdout is honored
+        stream = self.stream or sys.stdout
+        stream.write(''.join(self.format(event) + '\n' for event in events))
+        stream.flush()
+
+    def start(self) -> None:
+        """ hands the events to a background thread, so that threads applying resources never wait on the console """
+        if self.writer is not None:
+            return
+
+        self.queue  = queue.Queue()
+        self.writer = threading.Thread(target=self.run, args=(self.queue,), name='pkictl-events', daemon=True)
+        self.writer.start()
+
+    def run(self, events: queue.Queue) -> None:
+        while True:
+            batch = [events.get()]
+
+            # everything emitted while the previous batch was written goes out in a single write
+            while True:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.write([event for event in batch if event is not None])
+            except Exception as err:
+                # the writer keeps draining the queue so that nothing waits on it, the first failure is reported once
+                if not self.failed:
+                    self.failed = True
+                    sys.stderr.write(f"[-] pkictl - Error: failed to write messages: {err!r}\n")
+            finally:
+                for _ in batch:
+                    events.task_done()
+
+            if None in batch:
+                return
+
+    def flush(self) -> None:
+        """ blocks until every event emitted so far has been written """
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self) -> None:
+        """ writes the remaining events and stops the background thread """
+        if self.writer is None or self.queue is None:
+            return
+
+        self.queue.put(None)
+        self.writer.join()
+        self.queue, self.writer = None, None
+
+
+log = EventLog()
@@ -0,0 +1,220 @@
+from .defaults import DEFAULT_ISSUE_CONCURRENCY as DEFAULT_CONCURRENCY
+from . import utils
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import csv
+import json
+import os
+import random
+import time
+
+# the number of latencies kept to estimate percentiles, so memory stays bounded on large batches
+LATENCY_SAMPLE_SIZE = 10000
+
+# the parameters of the Vault issue endpoint that may be set per certificate
+SUBJECT_FIELDS = ('common_name', 'alt_names', 'ip_sans', 'uri_sans', 'other_sans', 'ttl', 'format', 'exclude_cn_from_sans')
+LIST_FIELDS    = ('alt_names', 'ip_sans', 'uri_sans', 'other_sans')
+
+
+def get_input_format(path: str) -> str:
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def to_params(subject: dict) -> dict:
+    """ converts a subject read from the input file to the parameters of an issue request, raises ValueError if it is invalid """
+    params = {}
+    for key, value in subject.items():
+        if key not in SUBJECT_FIELDS:
+            raise ValueError(f"unsupported field '{key}'")
+        if value in (None, ''):
+            continue
+        if key in LIST_FIELDS and isinstance(value, list):
+            value = ','.join(value)
+        params[key] = value
+
+    if not params.get('common_name'):
+        raise ValueError("common_name not defined")
+    return params
+
+
+def parse_subject(text: str) -> dict:
+    try:
+        subject = json.loads(text)
+    except ValueError:
+        raise ValueError("invalid JSON")
+    if not isinstance(subject, dict):
+        raise ValueError("expected an object")
+    return to_params(subject)
+
+
+def read_subjects(path: str, fmt: Optional[str]=None) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """ lazily yields the line number and issue parameters of every subject in a CSV or JSONL file, or why the line is invalid """
+    fmt = fmt or get_input_format(path)
+
+    try:
+        with open(path, 'r', newline='') as f:
+            if fmt == 'csv':
+                reader = csv.DictReader(f)
+                for row in reader:
+                    try:
+                        yield reader.line_num, to_params(row), None
+                    except ValueError as err:
+                        yield reader.line_num, None, str(err)
+            else:
+                for line, text in enumerate(f, 1):
+                    if not text.strip():
+                        continue
+                    try:
+                        yield line, parse_subject(text), None
+                    except ValueError as err:
+                        yield line, None, str(err)
+    except FileNotFoundError:
+        utils.exit_with_message(f"input file does not exist: {path}")
+
+
+def read_completed(path: str) -> Set[int]:
+    """ returns the input lines that were issued successfully by a previous run writing to the same file """
+    completed: Set[int] = set()
+    try:
+        with open(path, 'r') as f:
+            for text in f:
+                try:
+                    result = json.loads(text)
+                except ValueError:
+                    # the last line may have been cut short if the previous run was killed
+                    continue
+                if 'error' not in result:
+                    completed.add(result['line'])
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+class LatencyStats:
+    """ tracks request latencies using a fixed-size uniform sample """
+
+    def __init__(self, size: int=LATENCY_SAMPLE_SIZE):
+        self.size    = size
+        self.count   = 0
+        self.maximum = 0.0
+        self.samples: List[float] = []
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.maximum = max(self.maximum, seconds)
+
+        if len(self.samples) < self.size:
+            self.samples.append(seconds)
+        else:
+            i = random.randrange(self.count)
+            if i < self.size:
+                self.samples[i] = seconds
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class IssueSummary:
+    def __init__(self):
+        self.issued    = 0
+        self.failed    = 0
+        self.skipped   = 0
+        self.elapsed   = 0.0
+        self.latencies = LatencyStats()
+
+    @property
+    def throughput(self) -> float:
+        return self.issued / self.elapsed if self.elapsed else 0.0
+
+    def lines(self) -> List[str]:
+        ms = {p: self.latencies.percentile(p) * 1000 for p in (50, 95, 99)}
+        return [
+            f"Issued {self.issued} certificates, {self.failed} failed, {self.skipped} already issued",
+            f"Throughput: {self.throughput:.1f} certificates/s over {self.elapsed:.1f}s",
+            f"Latency: p50 {ms[50]:.0f}ms, p95 {ms[95]:.0f}ms, p99 {ms[99]:.0f}ms, max {self.latencies.maximum * 1000:.0f}ms"
+        ]
+
+
+def open_results(path: str):
+    """ opens the results file for appending, readable only by the owner as it holds private keys """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+
+    # a run that was killed may have left a partial line behind, which must not be merged with the next result
+    size = os.fstat(fd).st_size
+    if size and os.pread(fd, 1, size - 1) != b'\n':
+        os.write(fd, b'\n')
+    return os.fdopen(fd, 'a')
+
+
+def issue_certificates(vault_client, ca_name: str, role: str, input_path: str, output_path: str,
+                       concurrency: int=DEFAULT_CONCURRENCY, fmt: Optional[str]=None) -> IssueSummary:
+    """ issues a certificate for every subject in the input file, streaming the results to the output file """
+    summary   = IssueSummary()
+    completed = read_completed(output_path)
+
+    def issue(line: int, params: dict) -> Tuple[int, dict, Optional[dict], Optional[str], float]:
+        start = time.perf_counter()
+        try:
+            data, error = vault_client.issue_certificate(ca_name, role, params)
+        except (SystemExit, Exception) as err:
+            # an error ending one request must not stop the certificates issued by the others from being written
+            data, error = None, utils.error_message(err)
+        return line, params, data, error, time.perf_counter() - start
+
+    def record(future, results) -> None:
+        line, params, data, error, latency = future.result()
+        summary.latencies.record(latency)
+
+        result: Dict[str, object] = {'line': line, 'common_name': params['common_name']}
+        if error is None:
+            summary.issued += 1
+            result.update(data)
+        else:
+            summary.failed += 1
+            result['error'] = error
+            utils.output_message(f"Failed to issue certificate for '{params['common_name']}' on line {line}: {error}", err=True)
+
+        results.write(json.dumps(result) + '\n')
+        results.flush()
+
+    def invalid(line: int, error: str, results) -> None:
+        # an invalid line is reported like a failed request, so the certificates already requested are still written
+        summary.failed += 1
+        utils.output_message(f"Failed to read the subject on line {line} of {input_path}: {error}", err=True)
+
+        results.write(json.dumps({'line': line, 'error': error}) + '\n')
+        results.flush()
+
+    start = time.perf_counter()
+    try:
+        with open_results(output_path) as results, ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending: Set = set()
+
+            try:
+                for line, params, error in read_subjects(input_path, fmt):
+                    if line in completed:
+                        summary.skipped += 1
+                        continue
+                    if params is None:
+                        invalid(line, str(error), results)
+                        continue
+
+                    # only `concurrency` requests are in flight, so the batch is never held in memory
+                    if len(pending) >= concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            record(future, results)
+
+                    pending.add(executor.submit(issue, line, params))
+            finally:
+                # the private keys of the certificates Vault has issued exist nowhere else, so they are written whatever stopped the run
+                for future in wait(pending).done:
+                    record(future, results)
+    except OSError:
+        utils.exit_with_message(f"Failed to write the issued certificates to {output_path}")
+
+    summary.elapsed = time.perf_counter() - start
+    return summary
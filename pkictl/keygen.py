@@ -0,0 +1,121 @@
+from . import utils
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import multiprocessing
+import os
+import sys
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    from cryptography.x509.oid import NameOID
+except ImportError:  # the local-keygen extra is not installed
+    x509 = None  # type: ignore
+
+# the curves Vault accepts for EC keys, by key_bits
+EC_CURVES = {
+    224: 'SECP224R1',
+    256: 'SECP256R1',
+    384: 'SECP384R1',
+    521: 'SECP521R1'
+}
+
+SUBJECT_ATTRIBUTES = (
+    ('common_name', 'COMMON_NAME'),
+    ('country', 'COUNTRY_NAME'),
+    ('province', 'STATE_OR_PROVINCE_NAME'),
+    ('locality', 'LOCALITY_NAME'),
+    ('organization', 'ORGANIZATION_NAME'),
+    ('ou', 'ORGANIZATIONAL_UNIT_NAME')
+)
+
+
+def is_available() -> bool:
+    return x509 is not None
+
+
+def generate_key_and_csr(key_type: str, key_bits: int, subject: dict) -> Tuple[str, str]:
+    """ returns a new PEM encoded private key and a CSR for an intermediate CA signed with it """
+    key: Any
+    if key_type == 'ec':
+        if key_bits not in EC_CURVES:
+            raise ValueError(f"unsupported key_bits for an EC key: {key_bits}")
+        key = ec.generate_private_key(getattr(ec, EC_CURVES[key_bits])(), default_backend())
+    else:
+        key = rsa.generate_private_key(public_exponent=65537, key_size=key_bits, backend=default_backend())
+
+    name = x509.Name([
+        x509.NameAttribute(getattr(NameOID, oid), subject[field]) for field, oid in SUBJECT_ATTRIBUTES if subject.get(field)
+    ])
+
+    csr = x509.CertificateSigningRequestBuilder().subject_name(name).add_extension(
+        x509.BasicConstraints(ca=True, path_length=None), critical=True
+    ).sign(key, hashes.SHA256(), default_backend())
+
+    key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption())
+    csr_pem = csr.public_bytes(serialization.Encoding.PEM)
+    return key_pem.decode('utf-8').strip(), csr_pem.decode('utf-8').strip()
+
+
+def generate_for_manifest(manifest: dict) -> Tuple[str, str]:
+    spec = manifest['spec']
+    return generate_key_and_csr(spec['key_type'], spec['key_bits'], dict(spec['subject']))
+
+
+class KeyGenerator:
+    """ generates the key pairs of intermediate CAs of type local in a pool of worker processes, off the Vault server """
+
+    def __init__(self, workers: Optional[int]=None):
+        self.workers  = workers or os.cpu_count() or 1
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.futures: Dict[str, Future] = {}
+
+    @staticmethod
+    def check_available() -> None:
+        if not is_available():
+            utils.exit_with_message("intermediate CAs of type local require the cryptography package: pip install pkictl[local-keygen]")
+
+    def start(self, manifests: List[dict]) -> 'KeyGenerator':
+        """ starts generating the keys of the given CAs in the background, so that they are ready when the CAs are created """
+        if not manifests:
+            return self
+
+        self.check_available()
+        if self.executor is None:
+            workers = min(self.workers, len(manifests))
+
+            # the HTTP pool and event log threads are already running, so the workers are spawned rather than forked
+            if sys.version_info >= (3, 7):
+                self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self.executor = ProcessPoolExecutor(max_workers=workers)
+
+        for manifest in manifests:
+            name = manifest['metadata']['name']
+            if name not in self.futures:
+                self.futures[name] = self.executor.submit(generate_for_manifest, manifest)
+        return self
+
+    def result(self, manifest: dict) -> Tuple[str, str]:
+        """ returns the private key and CSR of a CA, generating them in this process if they were not started """
+        name = manifest['metadata']['name']
+        try:
+            if name in self.futures:
+                return self.futures.pop(name).result()
+
+            self.check_available()
+            return generate_for_manifest(manifest)
+        except ValueError as err:
+            return utils.exit_with_message(f"Failed to generate a key pair for intermediate CA '{name}': {err}")
+
+    def close(self) -> None:
+        """ stops the worker processes, discarding the keys that were never used """
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
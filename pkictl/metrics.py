@@ -0,0 +1,238 @@
+from . import utils
+from requests.adapters import HTTPAdapter
+from threading import Lock, local
+from typing import Dict, List, Optional
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import functools
+import json
+import time
+
+# the upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# requests measures the time until the response headers were parsed, the body is only read afterwards
+PHASES = ('connect', 'headers', 'total')
+
+# the VaultClient operation that the current thread is running, used to tag its requests
+_current = local()
+
+
+def current_operation() -> Optional[str]:
+    return getattr(_current, 'operation', None)
+
+
+def operation(func):
+    """ tags the Vault requests made by a VaultClient method with its name when metrics are enabled """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        # nested operations keep the tag of the outermost one
+        if self.metrics is None or current_operation() is not None:
+            return func(self, *args, **kwargs)
+
+        _current.operation = name
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            _current.operation = None
+    return wrapper
+
+
+def tagged(func, name: Optional[str]):
+    """ wraps func to run under the operation tag `name`, for handing work to other threads """
+    if name is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _current.operation = name
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.operation = None
+    return wrapper
+
+
+class TimedConnectionMixin:
+    """ records how long the TCP connect and TLS handshake of a new connection took """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _current.connect = getattr(_current, 'connect', 0.0) + time.perf_counter() - start
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """ an HTTPAdapter whose connections record their connect time """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count  = 0
+        self.sum    = 0.0
+        self.max    = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum   += value
+        self.max    = max(self.max, value)
+
+    def cumulative(self) -> List[int]:
+        total, counts = 0, []
+        for n in self.counts:
+            total += n
+            counts.append(total)
+        return counts
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': {format_bound(b): n for b, n in zip(BUCKETS, self.cumulative())}
+        }
+
+
+class OperationMetrics:
+    def __init__(self):
+        self.requests       = 0
+        self.errors         = 0
+        self.retries        = 0
+        self.bytes_sent     = 0
+        self.bytes_received = 0
+        self.latency        = {phase: Histogram() for phase in PHASES}
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency': {phase: h.to_dict() for phase, h in self.latency.items()}
+        }
+
+
+def format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Metrics:
+    """ collects the timing, size and outcome of every request to the Vault server, per operation """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.operations: Dict[str, OperationMetrics] = {}
+
+    def get(self, name: Optional[str]) -> OperationMetrics:
+        name = name or 'request'
+        if name not in self.operations:
+            self.operations[name] = OperationMetrics()
+        return self.operations[name]
+
+    def start_request(self) -> float:
+        _current.connect = 0.0
+        return time.perf_counter()
+
+    def record_request(self, start: float, response=None, bytes_sent: int=0) -> None:
+        total   = time.perf_counter() - start
+        connect = getattr(_current, 'connect', 0.0)
+
+        with self.lock:
+            m = self.get(current_operation())
+            m.requests   += 1
+            m.bytes_sent += bytes_sent
+            m.latency['total'].observe(total)
+            m.latency['connect'].observe(connect)
+
+            if response is None:
+                m.errors += 1
+                return
+
+            m.latency['headers'].observe(response.elapsed.total_seconds())
+            m.bytes_received += len(response.content or b'')
+            if response.status_code >= 400:
+                m.errors += 1
+
+    def record_retry(self) -> None:
+        with self.lock:
+            self.get(current_operation()).retries += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {'operations': {name: m.to_dict() for name, m in sorted(self.operations.items())}}
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, description: str) -> None:
+            lines.append(f"# HELP pkictl_vault_{name} {description}")
+            lines.append(f"# TYPE pkictl_vault_{name} {kind}")
+
+        with self.lock:
+            operations = sorted(self.operations.items())
+
+            counters = [
+                ('requests_total', 'requests', 'Requests sent to the Vault server.'),
+                ('request_errors_total', 'errors', 'Requests that failed or returned an error status.'),
+                ('request_retries_total', 'retries', 'Requests that were retried.'),
+                ('request_bytes_total', 'bytes_sent', 'Bytes sent in request bodies.'),
+                ('response_bytes_total', 'bytes_received', 'Bytes received in response bodies.'),
+            ]
+            for name, attribute, description in counters:
+                metric(name, 'counter', description)
+                lines.extend(f'pkictl_vault_{name}{{operation="{op}"}} {getattr(m, attribute)}' for op, m in operations)
+
+            metric('request_duration_seconds', 'histogram', 'Latency of requests to the Vault server by phase.')
+            for op, m in operations:
+                for phase, h in m.latency.items():
+                    labels = f'operation="{op}",phase="{phase}"'
+                    for bound, n in zip(BUCKETS, h.cumulative()):
+                        lines.append(f'pkictl_vault_request_duration_seconds_bucket{{{labels},le="{format_bound(bound)}"}} {n}')
+                    lines.append(f'pkictl_vault_request_duration_seconds_sum{{{labels}}} {h.sum}')
+                    lines.append(f'pkictl_vault_request_duration_seconds_count{{{labels}}} {h.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        """ writes the metrics as Prometheus text if the file ends in .prom or .txt and as JSON otherwise """
+        if path.endswith(('.prom', '.txt')):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2) + '\n'
+
+        # the file may be collected while pkictl runs again, such as by the textfile collector of the node exporter
+        try:
+            utils.write_atomic(path, content, mode=0o644)
+        except Exception:
+            utils.exit_with_message(f"Failed to write the metrics to {path}")
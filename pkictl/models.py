@@ -1,16 +1,42 @@
+from functools import lru_cache
 from urllib.parse import urljoin
+import json
+
+
+@lru_cache(maxsize=None)
+def api_root(baseurl):
+    """ returns the root URL of the Vault server that absolute API paths are appended to """
+    return urljoin(baseurl, '/')
+
+
+def serialize(body):
+    """ serializes a request body once so that it can be sent as is """
+    return json.dumps(body).encode('utf-8')
 
 
 class CertificateAuthority:
+    __slots__ = ('baseurl', 'dict', 'name', 'description', 'spec', 'ttl', 'config_url', 'spec_json', 'backend_json', 'ca_urls_json')
+
     def __init__(self, baseurl, manifest):
         self.baseurl = baseurl
         self.dict = manifest
         self.name = manifest['metadata']['name']
         self.description = manifest['metadata']['description']
 
-    @property
-    def spec(self):
-        spec = self.dict['spec'].copy()
+        # the request payloads and URLs never change, so they are computed once
+        self.spec = self.build_spec(manifest['spec'])
+        self.ttl = self.spec['ttl']
+
+        root = api_root(baseurl)
+        self.config_url = f"{root}v1/{self.name}/config/urls"
+
+        self.spec_json = serialize(self.spec)
+        self.backend_json = serialize(self.backend)
+        self.ca_urls_json = serialize(self.ca_urls)
+
+    @staticmethod
+    def build_spec(manifest_spec):
+        spec = dict(manifest_spec)
 
         subject = spec.get('subject')
         if subject:
@@ -22,14 +48,6 @@ class CertificateAuthority:
     def backend(self):
         return {'type': 'pki', 'description': self.description, 'config': {'max_lease_ttl': self.ttl}}
 
-    @property
-    def ttl(self):
-        return self.spec['ttl']
-
-    @property
-    def config_url(self):
-        return urljoin(self.baseurl, f"/v1/{self.name}/config/urls")
-
     @property
     def ca_urls(self):
         return {
@@ -39,48 +57,50 @@ class CertificateAuthority:
 
 
 class RootCA(CertificateAuthority):
+    __slots__ = ('url',)
+
     def __init__(self, baseurl, manifest):
         super().__init__(baseurl, manifest)
-
-    @property
-    def url(self):
-        return urljoin(self.baseurl, f"/v1/{self.name}/root/generate/internal")
+        self.url = f"{api_root(baseurl)}v1/{self.name}/root/generate/internal"
 
 
 class IntermediateCA(CertificateAuthority):
+    __slots__ = (
+        'issuer', 'kv_engine', 'catype', 'store_private_key', 'url', 'crl_config_url', 'issuer_sign_url', 'set_signed_url',
+        'import_url', 'kv_engine_url', 'crl_config_json', 'csr', 'cert', '_private_key'
+    )
+
     def __init__(self, baseurl, manifest):
         super().__init__(baseurl, manifest)
-        self._csr = None
+        self.csr = None
+        self.cert = None
         self._private_key = None
-        self._cert = None
 
-    @property
-    def issuer(self):
-        return self.dict['metadata']['issuer']
+        metadata = manifest['metadata']
+        self.issuer = metadata['issuer']
+        self.kv_engine = metadata.get('kv_engine')
+        self.catype = self.spec['type']
 
-    @property
-    def kv_engine(self):
-        return self.dict['metadata']['kv_engine']
+        # the private key of an exported CA is always stored, and that of a local CA only if it has a KV engine
+        self.store_private_key = self.catype == 'exported' or (self.catype == 'local' and self.kv_engine is not None)
 
-    @property
-    def catype(self):
-        return self.spec['type']
+        root = api_root(baseurl)
 
-    @property
-    def csr(self):
-        return self._csr
+        self.url = f"{root}v1/{self.name}/intermediate/generate/{self.catype}"
+        self.crl_config_url = f"{root}v1/{self.name}/config/crl"
+        self.issuer_sign_url = f"{root}v1/{self.issuer}/root/sign-intermediate"
+        self.set_signed_url = f"{root}v1/{self.name}/intermediate/set-signed"
+        self.import_url = f"{root}v1/{self.name}/config/ca"
+        self.kv_engine_url = f"{root}v1/{self.kv_engine}/{self.name}" if self.kv_engine else None
 
-    @csr.setter
-    def csr(self, value):
-        self._csr = value
-
-    @property
-    def cert(self):
-        return self._cert
+        self.crl_config_json = serialize(self.crl_config)
 
-    @cert.setter
-    def cert(self, value):
-        self._cert = value
+    @staticmethod
+    def build_spec(manifest_spec):
+        spec = CertificateAuthority.build_spec(manifest_spec)
+        for key in ('crl', 'roles', 'policies'):
+            spec.pop(key, None)
+        return spec
 
     @property
     def private_key(self):
@@ -91,40 +111,9 @@ class IntermediateCA(CertificateAuthority):
         self._private_key = value
 
     @property
-    def url(self):
-        return urljoin(self.baseurl, f"/v1/{self.name}/intermediate/generate/{self.catype}")
-
-    @property
-    def crl_config_url(self):
-        return urljoin(self.baseurl, f"/v1/{self.name}/config/crl")
-
-    @property
-    def issuer_sign_url(self):
-        return urljoin(self.baseurl, f"/v1/{self.issuer}/root/sign-intermediate")
-
-    @property
-    def set_signed_url(self):
-        return urljoin(self.baseurl, f"/v1/{self.name}/intermediate/set-signed")
-
-    @property
-    def kv_engine_url(self):
-        return urljoin(self.baseurl, f"/v1/{self.kv_engine}/{self.name}")
-
-    @property
-    def spec(self):
-        spec = self.dict['spec'].copy()
-
-        subject = spec.get('subject')
-        if subject:
-            spec.pop('subject')
-            spec.update(subject)
-        if spec.get('crl'):
-            spec.pop('crl')
-        if spec.get('roles'):
-            spec.pop('roles')
-        if spec.get('policies'):
-            spec.pop('policies')
-        return spec
+    def sign_json(self):
+        """ the body of the signing request, the CSR appended to the serialized spec """
+        return self.spec_json[:-1] + b', "csr": ' + serialize(self.csr) + b'}'
 
     @property
     def crl_config(self):
@@ -140,20 +129,17 @@ class IntermediateCA(CertificateAuthority):
 
 
 class KeyValueEngine:
+    __slots__ = ('baseurl', 'dict', 'name', 'spec', 'url', 'spec_json')
+
     def __init__(self, baseurl, manifest):
         self.baseurl = baseurl
         self.dict = manifest
         self.name = manifest['metadata']['name']
 
-    @property
-    def spec(self):
-        spec = self.dict['spec'].copy()
-        spec.update({
-            'type': self.dict['kind'].lower(),
-            'description': self.dict['metadata']['description']
+        self.spec = dict(manifest['spec'])
+        self.spec.update({
+            'type': manifest['kind'].lower(),
+            'description': manifest['metadata']['description']
         })
-        return spec
-
-    @property
-    def url(self):
-        return urljoin(self.baseurl, f"v1/sys/mounts/{self.name}")
+        self.url = urljoin(self.baseurl, f"v1/sys/mounts/{self.name}")
+        self.spec_json = serialize(self.spec)
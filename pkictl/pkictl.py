@@ -1,11 +1,13 @@
 from .models import RootCA, IntermediateCA, KeyValueEngine
-from .vault import VaultClient
+from .state import VaultState
 from .cli import cli
-from . import schemas, utils
-from distutils.util import strtobool
-import os.path
-import requests
+from .defaults import DEFAULT_MAX_RETRIES, DEFAULT_POOL_SIZE
+from . import events, utils
 import sys
+import time
+
+# the modules that depend on requests, PyYAML schemas, asyncio or cryptography are imported by the subcommands that use them,
+# so that parsing the arguments and short runs do not pay for the rest
 
 
 def main():
@@ -16,19 +18,62 @@ def main():
         parser.print_help()
         sys.exit()
 
-    if args.baseurl is None:
+    if args.har and not (args.record or args.replay):
+        parser.error("--har requires --record or --replay")
+
+    events.log.configure(fmt=args.log_format, level=events.DEBUG if args.debugging else events.INFO)
+
+    try:
+        run(args)
+    except SystemExit as err:
+        # a fatal error is written as an event like the other messages, so that JSON output stays machine-readable
+        if args.log_format == 'json' and isinstance(err.code, str):
+            events.log.emit(events.ERROR, utils.error_message(err))
+            sys.exit(1)
+        raise
+
+
+def run(args):
+    """ runs the subcommand, writing the metrics, recorded exchanges and messages even when it fails """
+    # each target in a targets file has its own URL
+    if args.baseurl is None and not getattr(args, 'targets', None):
         args.baseurl = utils.get_from_environment('VAULT_ADDR')
 
     if args.tls_skip_verify is None:
-        args.tls_skip_verify = strtobool(utils.get_from_environment('VAULT_SKIP_VERIFY'))
+        args.tls_skip_verify = utils.strtobool(utils.get_from_environment('VAULT_SKIP_VERIFY'))
 
     verify_ssl = True
     if args.tls_skip_verify:
         verify_ssl = False
-        requests.packages.urllib3.disable_warnings()
+        disable_tls_warnings()
+
+    metrics = None
+    if getattr(args, 'metrics_file', None):
+        from .metrics import Metrics
+        metrics = Metrics()
 
+    transport = None
+    if args.record or args.replay:
+        from .transport import Cassette, Transport
+        transport = Transport(Cassette.load(args.replay) if args.replay else None, latency=args.replay_latency)
+
+    # messages are written by a background thread, and all of them before an error ends the run
+    events.log.start()
+    try:
+        run_subcommand(args, verify_ssl, metrics, transport)
+    finally:
+        # the metrics and the recorded exchanges are written even when the run fails, as that is when they are most useful
+        if metrics is not None:
+            metrics.write(args.metrics_file)
+        if transport is not None:
+            transport.close(args.record, args.har)
+        events.log.close()
+
+
+def run_subcommand(args, verify_ssl, metrics=None, transport=None):
+    """ runs the subcommand with a Vault client that reports to metrics and sends its requests through transport if they are set """
     if args.subcommand == 'init':
-        vault_client = VaultClient(baseurl=args.baseurl, verify_ssl=verify_ssl)
+        vault_client = make_client(args, verify_ssl, transport=transport, authenticated=False)
 
         initialized, sealed = vault_client.healthcheck()
 
@@ -38,64 +83,392 @@ def main():
         if sealed:
             vault_client.unseal_server()
 
-    elif args.subcommand == 'apply':
-        # authentication token is required to talk to Vault
-        vault_token = utils.get_from_environment('VAULT_TOKEN')
+    elif args.subcommand == 'apply' and args.targets:
+        apply_targets(args, verify_ssl, metrics, transport)
 
-        vault_client = VaultClient(baseurl=args.baseurl, token=vault_token, debugging=args.debugging, verify_ssl=verify_ssl)
+    elif args.subcommand == 'apply':
+        vault_client = make_client(args, verify_ssl, metrics, transport, pool_size=args.pool_size)
 
-        path = os.path.abspath(os.path.expanduser(args.file))
+        if args.plan:
+            from . import plan
 
-        manifest_files = []
-        documents      = []
+            execution_plan = plan.read_plan_file(args.plan)
 
-        if os.path.isdir(path):
-            manifest_files.extend(utils.get_manifest_files(path))
+            check_vault_server(vault_client)
+            plan.apply_plan(vault_client, execution_plan)
         else:
-            manifest_files.append(path)
+            from .statefile import StateFile
 
-        for filepath in manifest_files:
-            documents.extend(utils.read_manifest_file(filepath))
+            statefile = StateFile.load(args.state_file, args.baseurl)
+            if args.refresh:
+                statefile.clear()
 
-        _, sealed = vault_client.healthcheck()
-        if sealed:
+            if args.apply_early:
+                # KV engines and Root CAs are written before the remaining manifests are parsed and checked
+                roots, intermediates, kv_engines, applied = apply_early(vault_client, args, statefile)
+            else:
+                # every manifest is parsed and validated before anything is written to Vault
+                roots, intermediates, kv_engines = utils.get_validated_manifests(utils.iter_manifests(args.file))
+                applied = 0
+
+            apply_documents(vault_client, args, statefile, roots, intermediates, kv_engines, applied=applied)
+
+        vault_client.close()
+
+    elif args.subcommand == 'watch':
+        from .statefile import StateFile
+        from . import watch
+
+        vault_client = make_client(args, verify_ssl, metrics, transport, pool_size=args.pool_size)
+
+        statefile = StateFile.load(args.state_file, args.baseurl)
+        if args.refresh:
+            statefile.clear()
+
+        check_vault_server(vault_client)
+        vault_client.warm_connections()
+
+        def apply_changes(roots, intermediates, kv_engines):
+            # the connections stay open between changes
+            apply_documents(vault_client, args, statefile, roots, intermediates, kv_engines, cascade=True, warm=False)
+
+        watcher = watch.create_watcher(args.file, poll=args.poll, interval=args.interval)
+        watch.watch_manifests(args.file, watcher, apply_changes)
+
+        vault_client.close()
+
+    elif args.subcommand == 'plan':
+        from . import plan
+
+        vault_client = make_client(args, verify_ssl, metrics, transport)
+
+        roots, intermediates, kv_engines = utils.get_validated_manifests(utils.iter_manifests(args.file))
+        levels = utils.get_intermediate_ca_levels(intermediates, roots)
+
+        check_vault_server(vault_client)
+
+        state          = VaultState.read(vault_client, roots, intermediates)
+        execution_plan = plan.build_plan(state, args.baseurl, roots, levels, kv_engines)
+
+        plan.print_plan(execution_plan)
+        if args.out:
+            plan.write_plan_file(execution_plan, args.out)
+
+        vault_client.close()
+
+    elif args.subcommand == 'issue':
+        from . import issue
+
+        vault_client = make_client(args, verify_ssl, metrics, transport, pool_size=args.concurrency)
+
+        check_vault_server(vault_client)
+        vault_client.warm_connections()
+
+        summary = issue.issue_certificates(vault_client, args.ca, args.role, args.input, args.out, concurrency=args.concurrency, fmt=args.format)
+        for line in summary.lines():
+            utils.output_message(line)
+
+        vault_client.close()
+        if summary.failed:
             sys.exit(1)
 
-        roots, intermediates, kv_engines = utils.get_validated_manifests(documents)
+    elif args.subcommand == 'export-bundles':
+        from . import bundles
+
+        vault_client = make_client(args, verify_ssl, metrics, transport, pool_size=args.concurrency)
+
+        roots, intermediates, _ = utils.get_validated_manifests(utils.iter_manifests(args.file))
+
+        check_vault_server(vault_client)
+
+        bundles.export_bundles(vault_client, roots, intermediates, args.out_dir, args.bundle, args.kv_path)
+
+        vault_client.close()
+
+    elif args.subcommand == 'rotate':
+        from . import rotate
+
+        vault_client = make_client(args, verify_ssl, metrics, transport, pool_size=args.concurrency)
+
+        roots, intermediates, _ = utils.get_validated_manifests(utils.iter_manifests(args.file))
+
+        check_vault_server(vault_client)
+        vault_client.warm_connections()
+
+        rotate.rotate_cas(vault_client, roots, intermediates, args.threshold, args.cache_file, args.dry_run, args.keygen_workers)
+
+        vault_client.close()
+
+    elif args.subcommand == 'crl' and args.crl_command == 'rotate':
+        from . import crl
+
+        try:
+            skip_recent = utils.duration_to_seconds(args.skip_recent)
+        except ValueError:
+            utils.exit_with_message(f"Invalid duration for --skip-recent: {args.skip_recent}")
+
+        vault_client = make_client(args, verify_ssl, metrics, transport, pool_size=args.concurrency)
+
+        roots, intermediates, _ = utils.get_validated_manifests(utils.iter_manifests(args.file))
+
+        check_vault_server(vault_client)
+        vault_client.warm_connections()
+
+        crl.rebuild_crls(vault_client, roots, intermediates, skip_recent)
+
+        vault_client.close()
+
+    elif args.subcommand == 'tidy':
+        from . import tidy
+
+        vault_client = make_client(args, verify_ssl, metrics, transport, pool_size=args.concurrency)
+
+        roots, intermediates, _ = utils.get_validated_manifests(utils.iter_manifests(args.file))
+
+        check_vault_server(vault_client)
+
+        tidy.tidy_cas(vault_client, roots, intermediates, args.concurrency, args.safety_buffer, args.pause, args.interval)
+
+        vault_client.close()
+
+
+def make_client(args, verify_ssl, metrics=None, transport=None, pool_size=DEFAULT_POOL_SIZE, baseurl=None, token=None, authenticated=True):
+    """ creates the Vault client of a subcommand from its arguments, with the token in VAULT_TOKEN unless one is given """
+    from .vault import VaultClient
+
+    # authentication token is required to talk to Vault, except to initialize it
+    if token is None and authenticated:
+        token = utils.get_from_environment('VAULT_TOKEN')
+
+    return VaultClient(baseurl=baseurl or args.baseurl, token=token, debugging=args.debugging, verify_ssl=verify_ssl, pool_size=pool_size,
+                       metrics=metrics, max_retries=getattr(args, 'max_retries', DEFAULT_MAX_RETRIES), transport=transport)
+
+
+def apply_targets(args, verify_ssl=True, metrics=None, transport=None):
+    """ applies the manifests to every Vault cluster in the targets file concurrently, keeping their failures apart """
+    from .statefile import StateFile
+    from .targets import TargetResult, print_report, read_targets
+    from concurrent.futures import ThreadPoolExecutor
+
+    if args.plan:
+        utils.exit_with_message("--plan cannot be used with --targets, as a plan is made against a single Vault server")
+    if args.baseurl:
+        utils.exit_with_message("--url cannot be used with --targets, as every target defines its own URL")
+
+    results = [TargetResult(target) for target in read_targets(args.targets, verify_ssl)]
+
+    # the manifests are parsed and validated once for all targets
+    roots, intermediates, kv_engines = utils.get_validated_manifests(utils.iter_manifests(args.file))
+    utils.get_intermediate_ca_levels(intermediates, roots)
+
+    if any(result.target.verify_ssl is False for result in results):
+        disable_tls_warnings()
+
+    # every target updates its own entries of the same state file
+    statefile  = StateFile.load(args.state_file, results[0].target.url)
+    statefiles = [statefile.for_server(result.target.url) for result in results]
+    if args.refresh:
+        for target_statefile in statefiles:
+            target_statefile.clear()
+
+    def apply(result, target_statefile):
+        target = result.target
+        start  = time.perf_counter()
+
+        with utils.output_target(target.name):
+            vault_client = make_client(args, target.verify_ssl, metrics, transport, pool_size=args.pool_size, baseurl=target.url, token=target.token)
+            try:
+                result.applied = apply_documents(vault_client, args, target_statefile, roots, intermediates, kv_engines)
+            except (SystemExit, Exception) as err:
+                result.error = utils.error_message(err)
+            finally:
+                vault_client.close()
+
+        result.elapsed = time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=len(results)) as executor:
+        list(executor.map(apply, results, statefiles))
+
+    print_report(results)
+    if any(result.failed for result in results):
+        sys.exit(1)
+
+
+def apply_early(vault_client, args, statefile):
+    """ validates the manifests as they are parsed, applying changed KV engines and Root CAs straight away, even if a later manifest is invalid """
+    from concurrent.futures import ThreadPoolExecutor
+    from .statefile import content_hash
+
+    roots, intermediates, kv_engines = [], [], []
+    groups   = {'RootCA': roots, 'IntermediateCA': intermediates, 'KV': kv_engines}
+    pending  = []
+    applied  = 0
+    executor = None
+
+    def apply(manifest, key, digest):
+        name = manifest['metadata']['name']
+
+        if manifest['kind'] == 'KV':
+            apply_kv_engine(vault_client, vault_client.baseurl, manifest)
+        else:
+            # the certificate of an existing Root CA is read so that only new CAs have their URLs configured
+            if vault_client.state.has_mount(name):
+                certificate = vault_client.read_ca_certificate(name)
+                if certificate:
+                    vault_client.state.certificates[name] = certificate
+            apply_root_ca(vault_client, vault_client.baseurl, manifest)
+
+        statefile.update({key: digest})
+
+    try:
+        for manifest in utils.iter_validated_manifests(utils.iter_manifests(args.file)):
+            groups[manifest['kind']].append(manifest)
+            if manifest['kind'] == 'IntermediateCA':
+                continue
+
+            key    = f"{manifest['kind']}:{manifest['metadata']['name']}"
+            digest = content_hash(manifest)
+            if statefile.entries.get(key) == digest:
+                continue
+            applied += 1
+
+            if vault_client.state is None:
+                check_vault_server(vault_client)
+
+                # the mounts are enough to apply KV engines and Root CAs, the full snapshot is taken once every manifest is read
+                state        = VaultState()
+                state.mounts = vault_client.read_mounts()
+                vault_client.use_snapshot(state)
+
+            if args.sequential:
+                apply(manifest, key, digest)
+                continue
+
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=args.concurrency)
+            pending.append(executor.submit(utils.bind_target(apply), manifest, key, digest))
+
+        for future in pending:
+            future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    return roots, intermediates, kv_engines, applied
+
+
+def apply_documents(vault_client, args, statefile, roots, intermediates, kv_engines, cascade=False, warm=True, applied=0):
+    """ applies the resources that changed since they were recorded in the state file, saves it and returns the number applied """
+    # resolve the CA hierarchy before making any changes
+    levels = utils.get_intermediate_ca_levels(intermediates, roots)
+
+    roots, levels, kv_engines, digests = statefile.changes(roots, levels, kv_engines, cascade=cascade)
+
+    intermediates = [ca for level in levels for ca in level]
+
+    if roots or intermediates or kv_engines:
+        # the early apply has already checked the server
+        if not applied:
+            check_vault_server(vault_client)
+        if warm:
+            vault_client.warm_connections()
+
+        # existence checks are answered from a single snapshot rather than per resource
+        state = VaultState.snapshot(vault_client, roots, intermediates)
+
+        if not args.overwrite:
+            # the roles and policies listed in Vault with the digest they were applied with are skipped, even on a refresh,
+            # and only the ones whose digest changed are read back to compare them with Vault
+            levels        = statefile.drifted(levels, digests, state)
+            intermediates = [ca for level in levels for ca in level]
+            state.read_definitions(vault_client, intermediates)
+        vault_client.use_snapshot(state, overwrite=args.overwrite)
+
+        # the key pairs of new local CAs are generated in worker processes while the rest of the hierarchy is applied
+        local_cas = [ca for ca in intermediates if ca['spec']['type'] == 'local' and not state.has_ca(ca['metadata']['name'])]
+        keygen    = None
+        if local_cas:
+            from .keygen import KeyGenerator
+            keygen = KeyGenerator(args.keygen_workers).start(local_cas)
+        vault_client.use_keygen(keygen)
+
+        try:
+            if args.sequential:
+                apply_manifests(vault_client, vault_client.baseurl, roots, levels, kv_engines)
+            else:
+                from . import aio
+                aio.run_apply(vault_client, roots, levels, kv_engines, concurrency=args.concurrency)
+        finally:
+            if keygen is not None:
+                keygen.close()
+    elif not applied:
+        utils.output_message("No changes to apply since the last apply")
+
+    pruned = statefile.update(digests, prune=args.prune)
+    if pruned:
+        utils.output_message(f"Removed {pruned} stale entries from the state file")
+    statefile.save()
+
+    return applied + len(roots) + len(intermediates) + len(kv_engines)
+
+
+def disable_tls_warnings():
+    """ silences the warnings urllib3 emits for every request to a server whose certificate is not verified """
+    import requests
+    requests.packages.urllib3.disable_warnings()
+
+
+def check_vault_server(vault_client):
+    """ exits if the Vault server is sealed """
+    _, sealed = vault_client.healthcheck()
+    if sealed:
+        sys.exit(1)
+
+
+def apply_kv_engine(vault_client, baseurl, kve):
+    kvengine = KeyValueEngine(baseurl, kve)
+    vault_client.mount_kv_engine(kvengine)
+
+
+def apply_root_ca(vault_client, baseurl, ca):
+    root_ca = RootCA(baseurl, ca)
+
+    vault_client.mount_pki_engine(root_ca)
+    vault_client.create_root_ca(root_ca)
+    if not vault_client.check_existing_ca(root_ca, quiet=True):
+        vault_client.configure_ca_urls(root_ca)
+
 
-        # mount KV engines
-        for kve in kv_engines:
-            kvengine = KeyValueEngine(args.baseurl, kve)
-            vault_client.mount_kv_engine(kvengine)
+def apply_intermediate_ca(vault_client, baseurl, ca):
+    intermediate_ca = IntermediateCA(baseurl, ca)
 
-        # create the Root CAs
-        for ca in roots:
-            manifest = schemas.RootCASchema(ca)
-            root_ca  = RootCA(args.baseurl, manifest)
+    vault_client.mount_pki_engine(intermediate_ca)
 
-            vault_client.mount_pki_engine(root_ca)
-            vault_client.create_root_ca(root_ca)
-            if not vault_client.check_existing_ca(root_ca, quiet=True):
-                vault_client.configure_ca_urls(root_ca)
+    if not vault_client.check_existing_ca(intermediate_ca):
+        vault_client.create_intermediate_ca(intermediate_ca)
+        vault_client.sign_intermediate_ca(intermediate_ca)
+        vault_client.set_intermediate_ca(intermediate_ca)
+        vault_client.configure_ca_urls(intermediate_ca)
+        vault_client.set_crl_configuration(intermediate_ca)
 
-        intermediates = utils.sort_intermediate_certificate_authorities(intermediates)
+        if intermediate_ca.store_private_key:
+            vault_client.store_ca_private_key(intermediate_ca)
 
-        # create the Intermediate CAs
-        for ca in intermediates:
-            manifest        = schemas.IntermediateCASchema(ca)
-            intermediate_ca = IntermediateCA(args.baseurl, manifest)
+    vault_client.configure_ca_roles(intermediate_ca)
+    vault_client.configure_ca_policies(intermediate_ca)
 
-            vault_client.mount_pki_engine(intermediate_ca)
 
-            if not vault_client.check_existing_ca(intermediate_ca):
-                vault_client.create_intermediate_ca(intermediate_ca)
-                vault_client.sign_intermediate_ca(intermediate_ca)
-                vault_client.set_intermediate_ca(intermediate_ca)
-                vault_client.configure_ca_urls(intermediate_ca)
-                vault_client.set_crl_configuration(intermediate_ca)
+def apply_manifests(vault_client, baseurl, roots, levels, kv_engines):
+    """ applies the validated manifests one operation at a time """
+    # mount KV engines
+    for kve in kv_engines:
+        apply_kv_engine(vault_client, baseurl, kve)
 
-                if intermediate_ca.catype == 'exported':
-                    vault_client.store_ca_private_key(intermediate_ca)
+    # create the Root CAs
+    for ca in roots:
+        apply_root_ca(vault_client, baseurl, ca)
 
-            vault_client.configure_ca_roles(intermediate_ca)
-            vault_client.configure_ca_policies(intermediate_ca)
+    # create the Intermediate CAs, issuers first
+    for level in levels:
+        for ca in level:
+            apply_intermediate_ca(vault_client, baseurl, ca)
@@ -0,0 +1,217 @@
+from .models import RootCA, IntermediateCA, KeyValueEngine
+from .resources import IntermediateCAManifest
+from . import utils
+from typing import List, Optional
+import json
+
+PLAN_VERSION = 1
+
+CREATE = 'create'
+UPDATE = 'update'
+NOOP   = 'no-op'
+
+SYMBOLS = {CREATE: '+', UPDATE: '~', NOOP: '='}
+
+KINDS = {
+    'KV': ('KV secrets engine', KeyValueEngine),
+    'RootCA': ('Root CA', RootCA),
+    'IntermediateCA': ('intermediate CA', IntermediateCA)
+}
+
+ROOT_CA_STEPS         = ['create_root_ca', 'configure_ca_urls']
+INTERMEDIATE_CA_STEPS = ['create_intermediate_ca', 'sign_intermediate_ca', 'set_intermediate_ca', 'configure_ca_urls', 'set_crl_configuration']
+
+# the VaultClient operations that a plan file is allowed to run
+OPERATIONS = set(ROOT_CA_STEPS + INTERMEDIATE_CA_STEPS + [
+    'mount_kv_engine', 'mount_pki_engine', 'store_ca_private_key', 'configure_ca_roles', 'configure_ca_policies'
+])
+
+
+def to_seconds(value, setting: str) -> Optional[int]:
+    """ converts a duration setting to seconds, exiting rather than failing with a traceback on an invalid one """
+    try:
+        return utils.duration_to_seconds(value)
+    except ValueError:
+        utils.exit_with_message(f"Invalid duration for {setting}: {value}")
+    return None
+
+
+def role_matches(expected: dict, actual: Optional[dict]) -> bool:
+    """ compares the settings of a role in a manifest with the ones returned by Vault """
+    if actual is None:
+        return False
+
+    for key, value in expected.items():
+        current = actual.get(key)
+        if key in ('ttl', 'max_ttl'):
+            value, current = to_seconds(value, key), to_seconds(current, key)
+        if value != current:
+            return False
+    return True
+
+
+def crl_matches(expected: dict, actual: Optional[dict]) -> bool:
+    """ compares the CRL configuration in a manifest with the one returned by Vault """
+    if actual is None:
+        return False
+
+    expiry = to_seconds(expected.get('expiry'), 'expiry') == to_seconds(actual.get('expiry'), 'expiry')
+    return expiry and expected.get('disable', False) == actual.get('disable', False)
+
+
+def resource(action: str, manifest: dict, steps: List[str], changes: Optional[List[dict]]=None) -> dict:
+    return {
+        'kind': manifest['kind'],
+        'name': manifest['metadata']['name'],
+        'action': action,
+        'steps': steps,
+        'changes': changes or [],
+        'manifest': manifest
+    }
+
+
+def change(action: str, kind: str, name: str) -> dict:
+    return {'action': action, 'kind': kind, 'name': name}
+
+
+def plan_kv_engine(state, manifest: dict) -> dict:
+    if state.has_mount(manifest['metadata']['name']):
+        return resource(NOOP, manifest, [])
+    return resource(CREATE, manifest, ['mount_kv_engine'])
+
+
+def plan_root_ca(state, manifest: dict) -> dict:
+    name = manifest['metadata']['name']
+
+    if state.has_ca(name):
+        return resource(NOOP, manifest, [])
+
+    steps = [] if state.has_mount(name) else ['mount_pki_engine']
+    return resource(CREATE, manifest, steps + ROOT_CA_STEPS)
+
+
+def plan_intermediate_ca(state, manifest: IntermediateCAManifest) -> dict:
+    name = manifest['metadata']['name']
+    spec = manifest['spec']
+
+    if not state.has_ca(name):
+        steps = [] if state.has_mount(name) else ['mount_pki_engine']
+        steps.extend(INTERMEDIATE_CA_STEPS)
+
+        if spec['type'] == 'exported' or (spec['type'] == 'local' and 'kv_engine' in manifest['metadata']):
+            steps.append('store_ca_private_key')
+        if spec['roles']:
+            steps.append('configure_ca_roles')
+        if spec['policies']:
+            steps.append('configure_ca_policies')
+
+        changes = [change(CREATE, 'role', role['name']) for role in spec['roles']]
+        changes.extend(change(CREATE, 'policy', policy['name']) for policy in spec['policies'])
+        return resource(CREATE, manifest, steps, changes)
+
+    steps   = []
+    changes = []
+
+    if not crl_matches(spec['crl'], state.crl_configs.get(name)):
+        steps.append('set_crl_configuration')
+        changes.append(change(UPDATE, 'CRL configuration', name))
+
+    roles = []
+    for role in spec['roles']:
+        if not state.has_role(name, role['name']):
+            action = CREATE
+        elif role_matches(role['config'], state.roles[name][role['name']]):
+            action = NOOP
+        else:
+            action = UPDATE
+
+        changes.append(change(action, 'role', role['name']))
+        if action != NOOP:
+            roles.append(role)
+
+    policies = []
+    for policy in spec['policies']:
+        if not state.has_policy(policy['name']):
+            action = CREATE
+        elif state.policy_matches(policy['name'], policy['policy']):
+            action = NOOP
+        else:
+            action = UPDATE
+
+        changes.append(change(action, 'policy', policy['name']))
+        if action != NOOP:
+            policies.append(policy)
+
+    if roles:
+        steps.append('configure_ca_roles')
+    if policies:
+        steps.append('configure_ca_policies')
+
+    # only the roles and policies that need to be written are kept in the plan
+    pending = manifest.with_spec(roles=roles, policies=policies)
+    return resource(UPDATE if steps else NOOP, pending, steps, changes)
+
+
+def build_plan(state, baseurl: str, roots: List[dict], levels: List[List[IntermediateCAManifest]], kv_engines: List[dict]) -> dict:
+    """ diffs the validated manifests against the live state of the Vault server """
+    resources = [plan_kv_engine(state, kve) for kve in kv_engines]
+    resources.extend(plan_root_ca(state, ca) for ca in roots)
+    resources.extend(plan_intermediate_ca(state, ca) for level in levels for ca in level)
+
+    return {'version': PLAN_VERSION, 'vault_addr': baseurl, 'resources': resources}
+
+
+def print_plan(plan: dict) -> None:
+    counts = {CREATE: 0, UPDATE: 0, NOOP: 0}
+
+    for r in plan['resources']:
+        label = KINDS[r['kind']][0]
+        counts[r['action']] += 1
+        utils.output_message(f"{SYMBOLS[r['action']]} {r['action']} {label}: {r['name']}")
+
+        for c in r['changes']:
+            counts[c['action']] += 1
+            utils.output_message(f"  {SYMBOLS[c['action']]} {c['action']} {c['kind']} '{c['name']}' for {label}: {r['name']}")
+
+    utils.output_message(f"Plan: {counts[CREATE]} to create, {counts[UPDATE]} to update, {counts[NOOP]} unchanged")
+
+
+def write_plan_file(plan: dict, path: str) -> None:
+    try:
+        utils.write_atomic(path, json.dumps(plan, indent=2))
+    except Exception:
+        utils.exit_with_message(f"Failed to write the plan to {path}")
+    else:
+        utils.output_message(f"Saved the plan to {path}")
+
+
+def read_plan_file(path: str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            plan = json.load(f)
+    except FileNotFoundError:
+        return utils.exit_with_message("plan file does not exist")
+    except ValueError:
+        return utils.exit_with_message("failed to parse plan file, invalid JSON")
+
+    if plan.get('version') != PLAN_VERSION:
+        utils.exit_with_message("Unsupported plan file version")
+
+    for r in plan.get('resources', []):
+        if r.get('kind') not in KINDS or not set(r.get('steps', [])) <= OPERATIONS:
+            utils.exit_with_message(f"Invalid resource in plan file: {r.get('name')}")
+    return plan
+
+
+def apply_plan(vault_client, plan: dict) -> None:
+    """ runs only the writes recorded in a plan against the Vault server it was created for """
+    if plan['vault_addr'] != vault_client.baseurl:
+        utils.exit_with_message(f"plan was created for a different Vault server: {plan['vault_addr']}")
+
+    for r in plan['resources']:
+        if not r['steps']:
+            continue
+
+        model = KINDS[r['kind']][1](vault_client.baseurl, r['manifest'])
+        for step in r['steps']:
+            getattr(vault_client, step)(model)
@@ -0,0 +1,126 @@
+from . import schemas
+from typing import Any, Dict, Type
+
+
+class FrozenDict(dict):
+    """ a dict that cannot be modified after it has been validated """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f"'{type(self).__name__}' object is immutable")
+
+    __setitem__ = __delitem__ = _immutable
+    __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        # hashed by content, as equal dicts compare equal
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # frozen values cannot change, so a deep copy is the value itself, thaw returns a mutable copy
+        return self
+
+    def copy(self) -> dict:
+        return dict(self)
+
+
+class FrozenList(list):
+    """ a list that cannot be modified after it has been validated """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f"'{type(self).__name__}' object is immutable")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def copy(self) -> list:
+        return list(self)
+
+
+def freeze(value):
+    """ returns an immutable copy of a validated document """
+    # frozen values cannot change, so they are shared rather than copied
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """ returns a mutable copy of a frozen document """
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+class Manifest(FrozenDict):
+    """ a validated manifest document """
+    schema: Any = None
+
+    @property
+    def kind(self) -> str:
+        return self['kind']
+
+    @property
+    def name(self) -> str:
+        return self['metadata']['name']
+
+    @property
+    def spec(self) -> FrozenDict:
+        return self['spec']
+
+    def with_spec(self, **changes):
+        """ returns a copy of the manifest with some fields of its spec replaced """
+        spec = dict(self['spec'], **{k: freeze(v) for k, v in changes.items()})
+        return type(self)(dict(self, spec=FrozenDict(spec)))
+
+
+class KeyValueManifest(Manifest):
+    schema = schemas.KeyValueSchema
+
+
+class RootCAManifest(Manifest):
+    schema = schemas.RootCASchema
+
+
+class IntermediateCAManifest(Manifest):
+    schema = schemas.IntermediateCASchema
+
+    @property
+    def issuer(self) -> str:
+        return self['metadata']['issuer']
+
+
+MANIFESTS: Dict[str, Type[Manifest]] = {
+    'KV': KeyValueManifest,
+    'RootCA': RootCAManifest,
+    'IntermediateCA': IntermediateCAManifest
+}
+
+
+def validate(document: dict) -> Manifest:
+    """ validates a manifest document exactly once and returns it as an immutable typed resource """
+    cls = MANIFESTS[document['kind']]
+    return cls((k, freeze(v)) for k, v in cls.schema(document).items())
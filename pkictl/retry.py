@@ -0,0 +1,85 @@
+from email.utils import parsedate_to_datetime
+from threading import Condition
+from typing import Optional
+import datetime
+import random
+import time
+
+# the base and maximum delay of the exponential backoff, in seconds
+BACKOFF_BASE = 0.25
+BACKOFF_CAP  = 10.0
+
+# a Retry-After longer than this is not worth waiting for
+RETRY_AFTER_CAP = 60.0
+
+# rate limited by a Vault quota, or unavailable such as a sealed node or a standby that cannot forward
+PRESSURE_STATUS_CODES = (429, 503)
+
+# the request may have reached Vault, so it is only retried if repeating it is harmless
+GATEWAY_STATUS_CODES = (502, 504)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'LIST', 'PUT', 'DELETE')
+
+
+def backoff_delay(attempt: int, base: float=BACKOFF_BASE, cap: float=BACKOFF_CAP) -> float:
+    """ returns an exponential backoff with full jitter for the given retry attempt, starting at 0 """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """ returns the number of seconds in a Retry-After header, which is either a delay or an HTTP date """
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if date is None:
+            return None
+        seconds = (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+
+    return min(max(seconds, 0.0), RETRY_AFTER_CAP)
+
+
+class AdaptiveLimiter:
+    """ limits the requests in flight, halving the limit when Vault signals pressure and growing it back by one per round of successes """
+
+    def __init__(self, maximum: int, minimum: int=1, cooldown: float=1.0):
+        self.maximum   = maximum
+        self.minimum   = minimum
+        self.cooldown  = cooldown
+        self.limit     = float(maximum)
+        self.inflight  = 0
+        self.decreased = 0.0
+        self.condition = Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.inflight >= int(self.limit):
+                self.condition.wait()
+            self.inflight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.condition:
+            self.inflight -= 1
+            self.condition.notify()
+
+    def on_pressure(self) -> None:
+        """ multiplicative decrease, at most once per cooldown so that a burst of rejections counts once """
+        with self.condition:
+            now = time.monotonic()
+            if now - self.decreased >= self.cooldown:
+                self.limit     = max(float(self.minimum), self.limit / 2)
+                self.decreased = now
+
+    def on_success(self) -> None:
+        """ additive increase of about one slot for every `limit` successful requests """
+        with self.condition:
+            if self.limit < self.maximum:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+                self.condition.notify_all()
@@ -0,0 +1,238 @@
+from .defaults import DEFAULT_CERT_CACHE_FILE, DEFAULT_ROTATE_THRESHOLD
+from .der import SEQUENCE, VERSION, parse_time, read_element
+from .models import IntermediateCA
+from . import utils
+from typing import Dict, List, Optional, Set, Tuple
+import base64
+import datetime
+import hashlib
+import json
+import re
+import time
+
+CACHE_VERSION = 1
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# before Vault 1.11 a mount has a single issuer, whose key intermediate/generate replaces straight away
+IN_PLACE_ROTATION_VERSION = (1, 11)
+
+# the notBefore and notAfter of a certificate
+Validity = Tuple[datetime.datetime, datetime.datetime]
+
+
+def parse_validity(pem: str) -> Validity:
+    """ returns the validity window of the first certificate of a PEM chain, decoding only the fields ahead of it """
+    try:
+        start = pem.index('-----BEGIN CERTIFICATE-----') + len('-----BEGIN CERTIFICATE-----')
+        der   = base64.b64decode(''.join(pem[start:pem.index('-----END CERTIFICATE-----', start)].split()))
+
+        # Certificate ::= SEQUENCE { tbsCertificate SEQUENCE { [0] version, serialNumber, signature, issuer, validity, ... } }
+        _, offset, _ = read_element(der, 0)
+        tag, offset, _ = read_element(der, offset)
+        if tag != SEQUENCE:
+            raise ValueError("the certificate does not start with a TBSCertificate")
+
+        tag, _, end = read_element(der, offset)
+        if tag == VERSION:
+            offset = end
+
+        # the serial number, signature algorithm and issuer come before the validity
+        for _ in range(3):
+            _, _, offset = read_element(der, offset)
+
+        tag, offset, _ = read_element(der, offset)
+        if tag != SEQUENCE:
+            raise ValueError("the certificate has no validity")
+
+        tag, start, end = read_element(der, offset)
+        not_before = parse_time(tag, der[start:end])
+        tag, start, end = read_element(der, end)
+        not_after = parse_time(tag, der[start:end])
+    except (IndexError, ValueError, UnicodeDecodeError) as err:
+        raise ValueError(f"failed to parse certificate: {err}")
+    return not_before, not_after
+
+
+def parse_cached_time(text: str) -> datetime.datetime:
+    return datetime.datetime.strptime(text, TIME_FORMAT).replace(tzinfo=datetime.timezone.utc)
+
+
+class ValidityCache:
+    """ the validity windows of the certificates parsed by earlier scans, keyed by a digest of their PEM """
+
+    def __init__(self, path: Optional[str]):
+        self.path    = path
+        self.entries: Dict[str, List[str]] = {}
+        self.used: Dict[str, List[str]]    = {}
+        self.parsed  = 0
+
+        if path is None:
+            return
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self.entries = data['certificates']
+        except (OSError, ValueError, KeyError, AttributeError):
+            # the cache only saves work, so a missing or corrupt one is rebuilt
+            pass
+
+    def validity(self, pem: str) -> Validity:
+        digest = hashlib.sha256(pem.encode('utf-8')).hexdigest()
+
+        # CAs that share a certificate, like a copy of a mount, are parsed once
+        entry = self.used.get(digest) or self.entries.get(digest)
+        if entry is None:
+            not_before, not_after = parse_validity(pem)
+            entry = [not_before.strftime(TIME_FORMAT), not_after.strftime(TIME_FORMAT)]
+            self.parsed += 1
+
+        # only the certificates of this scan are kept, so that rotated ones drop out
+        self.used[digest] = entry
+        return parse_cached_time(entry[0]), parse_cached_time(entry[1])
+
+    def save(self) -> None:
+        if self.path is None or self.used == self.entries:
+            return
+        try:
+            utils.write_atomic(self.path, json.dumps({'version': CACHE_VERSION, 'certificates': self.used}, indent=2, sort_keys=True), mode=0o644)
+        except OSError:
+            utils.exit_with_message(f"Failed to write the certificate cache to {self.path}")
+        self.entries = dict(self.used)
+
+
+def scan(vault_client, names: List[str], cache: ValidityCache) -> Dict[str, Validity]:
+    """ fetches the certificates of the CAs concurrently and returns their validity windows """
+    certificates = vault_client.map_concurrently(vault_client.read_ca_certificate, names)
+
+    missing = [name for name, certificate in zip(names, certificates) if certificate is None]
+    if missing:
+        utils.exit_with_message(f"CAs have not been generated yet: {', '.join(missing)}")
+
+    validity = {}
+    for name, certificate in zip(names, certificates):
+        try:
+            validity[name] = cache.validity(certificate)
+        except ValueError as err:
+            utils.exit_with_message(f"Failed to read the certificate of CA '{name}': {err}")
+    cache.save()
+    return validity
+
+
+def plan_rotation(levels: List[List[dict]], validity: Dict[str, Validity], deadline: datetime.datetime) -> List[List[dict]]:
+    """ returns the intermediate CAs to re-issue level by level: those that expire before the deadline and every CA below them """
+    rotating: Set[str] = set()
+    pending  = []
+
+    for level in levels:
+        # a CA signed by a rotated CA is re-signed by its new certificate, as its chain would still end at the old one
+        rotate = [ca for ca in level if validity[ca['metadata']['name']][1] <= deadline or ca['metadata']['issuer'] in rotating]
+        rotating.update(ca['metadata']['name'] for ca in rotate)
+        if rotate:
+            pending.append(rotate)
+    return pending
+
+
+def parse_version(version: str) -> Tuple[int, int]:
+    """ returns the major and minor numbers of a Vault version such as '1.11.0+ent' """
+    match = re.match(r'v?(\d+)\.(\d+)', version)
+    if match is None:
+        raise ValueError(f"invalid Vault version: {version}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def check_in_place_rotation(vault_client) -> None:
+    """ exits unless the Vault server keeps the current issuer of a mount while a new one is generated and signed """
+    version = vault_client.read_version()
+    try:
+        supported = parse_version(version) >= IN_PLACE_ROTATION_VERSION
+    except ValueError:
+        utils.exit_with_message(f"Failed to read the version of the Vault server, which rotating intermediate CAs in place requires: {version!r}")
+
+    if not supported:
+        utils.exit_with_message(f"Rotating intermediate CAs in place requires Vault 1.11 or later, the Vault server runs {version}: "
+                                f"earlier versions replace the key of the CA as soon as a new one is generated, which stops issuance until it is signed")
+
+
+def rotate_intermediate_ca(vault_client, baseurl: str, ca: dict) -> None:
+    """ issues a new certificate for an intermediate CA in its mount, so that its roles and issued certificates are untouched """
+    intermediate_ca = IntermediateCA(baseurl, ca)
+
+    vault_client.create_intermediate_ca(intermediate_ca)
+    vault_client.sign_intermediate_ca(intermediate_ca)
+
+    # the old issuer is kept next to the new one, which has to be made the default to sign with it
+    issuers = vault_client.set_intermediate_ca(intermediate_ca)
+    if issuers:
+        vault_client.set_default_issuer(intermediate_ca, issuers[0])
+
+    if intermediate_ca.store_private_key:
+        vault_client.store_ca_private_key(intermediate_ca)
+
+
+def format_expiry(not_after: datetime.datetime, now: datetime.datetime) -> str:
+    days = (not_after - now).total_seconds() / 86400
+    when = f"in {days:.0f} days" if days >= 0 else f"{-days:.0f} days ago"
+    return f"{not_after:%Y-%m-%d %H:%M} UTC ({when})"
+
+
+def rotate_cas(vault_client, roots: List[dict], intermediates: List[dict], threshold: int=DEFAULT_ROTATE_THRESHOLD,
+               cache_file: Optional[str]=DEFAULT_CERT_CACHE_FILE, dry_run: bool=False, keygen_workers: Optional[int]=None) -> List[str]:
+    """ re-issues the intermediate CAs that expire within threshold days and the CAs below them, issuers first, and returns their names """
+    levels = utils.get_intermediate_ca_levels(intermediates, roots)
+    names  = [ca['metadata']['name'] for ca in roots] + [ca['metadata']['name'] for level in levels for ca in level]
+    cache  = ValidityCache(cache_file)
+
+    start    = time.perf_counter()
+    validity = scan(vault_client, names, cache)
+    now      = datetime.datetime.now(datetime.timezone.utc)
+    deadline = now + datetime.timedelta(days=threshold)
+
+    expiring = sorted((name for name in names if validity[name][1] <= deadline), key=lambda name: validity[name][1])
+    utils.output_message(f"Scanned the certificates of {len(names)} CAs in {time.perf_counter() - start:.2f}s ({cache.parsed} parsed), "
+                         f"{len(expiring)} expire within {threshold} days")
+
+    for name in expiring:
+        utils.output_message(f"CA '{name}' expires on {format_expiry(validity[name][1], now)}")
+
+    # a Root CA is the trust anchor that clients were given, so replacing it cannot be done in place
+    for ca in roots:
+        name = ca['metadata']['name']
+        if validity[name][1] <= deadline:
+            utils.output_message(f"Root CA '{name}' is not rotated, a new Root CA has to be distributed to clients")
+
+    pending = plan_rotation(levels, validity, deadline)
+    rotated = [ca['metadata']['name'] for level in pending for ca in level]
+
+    if not rotated:
+        utils.output_message("No intermediate CAs to rotate")
+        return rotated
+
+    if dry_run:
+        for name in rotated:
+            reason = f"expires on {format_expiry(validity[name][1], now)}" if validity[name][1] <= deadline else "was issued by a rotated CA"
+            utils.output_message(f"Would rotate intermediate CA '{name}', which {reason}")
+        return rotated
+
+    check_in_place_rotation(vault_client)
+
+    # the key pairs of local CAs are generated in worker processes while the CAs above them are rotated
+    local_cas = [ca for level in pending for ca in level if ca['spec']['type'] == 'local']
+    keygen    = None
+    if local_cas:
+        from .keygen import KeyGenerator
+        keygen = KeyGenerator(keygen_workers).start(local_cas)
+    vault_client.use_keygen(keygen)
+
+    try:
+        for level in pending:
+            vault_client.map_concurrently(lambda ca: rotate_intermediate_ca(vault_client, vault_client.baseurl, ca), level)
+    finally:
+        if keygen is not None:
+            keygen.close()
+
+    renewed = scan(vault_client, rotated, cache)
+    for name in rotated:
+        utils.output_message(f"Rotated intermediate CA '{name}', which now expires on {format_expiry(renewed[name][1], now)}")
+    return rotated
@@ -1,6 +1,115 @@
-from voluptuous import Schema, Required, Optional, All, Any, Range, Match, Coerce
+from voluptuous import Schema, Required, Optional, All, Any, Range, Match, Coerce, Invalid
+import re
 
 MOUNT_PATH_REGEX = r'^(?![-\/])[a-z0-9-_\/]+(?<![-\/])$'
+ROLE_NAME_REGEX  = r'^[a-z0-9-_]+$'
+DURATION_REGEX   = r'(\d+[hms])+\Z'
+DOMAIN_REGEX     = r'^(?![-.])[a-zA-Z0-9-\.]+(?<![.-])$'
+
+ROLE_FLAGS = (
+    'allow_localhost', 'allow_subdomains', 'allow_any_name', 'allow_ip_sans', 'enforce_hostnames', 'generate_lease', 'no_store'
+)
+
+# the voluptuous schemas for roles and policies, validate_roles and validate_policies are equivalent but faster
+RolesSchema = Schema([{
+    Required('name'): Match(ROLE_NAME_REGEX, msg="Must be lowercase alphanumberic string"),
+    Required('config'): {
+        Required('max_ttl'): Match(DURATION_REGEX),
+        Optional('ttl'): Match(DURATION_REGEX),
+        Required('server_flag'): bool,
+        Required('client_flag'): bool,
+        Optional('allow_localhost'): bool,
+        Optional('allow_subdomains'): bool,
+        Optional('allow_any_name'): bool,
+        Optional('allow_ip_sans'): bool,
+        Optional('enforce_hostnames'): bool,
+        Optional('generate_lease'): bool,
+        Optional('no_store'): bool,
+        Optional('allowed_domains'): [Match(DOMAIN_REGEX)],
+    }
+}])
+
+PoliciesSchema = Schema([{
+    Required('name'): Match(MOUNT_PATH_REGEX, msg="Must be lowercase alphanumberic string"),
+    Required('policy'): str
+}])
+
+_mount_path = re.compile(MOUNT_PATH_REGEX)
+_role_name  = re.compile(ROLE_NAME_REGEX)
+_duration   = re.compile(DURATION_REGEX)
+_domain     = re.compile(DOMAIN_REGEX)
+
+
+def _check_keys(data, required, optional, path):
+    if not isinstance(data, dict):
+        raise Invalid("expected a dictionary", path=path)
+
+    for key in required:
+        if key not in data:
+            raise Invalid("required key not provided", path=path + [key])
+
+    for key in data:
+        if key not in required and key not in optional:
+            raise Invalid("extra keys not allowed", path=path + [key])
+
+
+def _check_match(pattern, value, path, msg=None):
+    if not isinstance(value, str):
+        raise Invalid(msg or "expected string or buffer", path=path)
+    if not pattern.match(value):
+        raise Invalid(msg or f"does not match regular expression {pattern.pattern}", path=path)
+
+
+def _check_bool(value, path):
+    if not isinstance(value, bool):
+        raise Invalid("expected bool", path=path)
+
+
+def validate_roles(roles):
+    """ validates the roles of an Intermediate CA, equivalent to RolesSchema """
+    if not isinstance(roles, list):
+        raise Invalid("expected a list")
+
+    validated = []
+    for i, role in enumerate(roles):
+        _check_keys(role, ('name', 'config'), (), [i])
+        _check_match(_role_name, role['name'], [i, 'name'], "Must be lowercase alphanumberic string")
+
+        config = role['config']
+        path   = [i, 'config']
+        _check_keys(config, ('max_ttl', 'server_flag', 'client_flag'), ('ttl', 'allowed_domains') + ROLE_FLAGS, path)
+
+        for key, value in config.items():
+            if key in ('max_ttl', 'ttl'):
+                _check_match(_duration, value, path + [key])
+            elif key == 'allowed_domains':
+                if not isinstance(value, list):
+                    raise Invalid("expected a list", path=path + [key])
+                for j, domain in enumerate(value):
+                    _check_match(_domain, domain, path + [key, j])
+            else:
+                _check_bool(value, path + [key])
+
+        validated.append({'name': role['name'], 'config': dict(config)})
+    return validated
+
+
+def validate_policies(policies):
+    """ validates the policies of an Intermediate CA, equivalent to PoliciesSchema """
+    if not isinstance(policies, list):
+        raise Invalid("expected a list")
+
+    validated = []
+    for i, policy in enumerate(policies):
+        _check_keys(policy, ('name', 'policy'), (), [i])
+        _check_match(_mount_path, policy['name'], [i, 'name'], "Must be lowercase alphanumberic string")
+
+        if not isinstance(policy['policy'], str):
+            raise Invalid("expected str", path=[i, 'policy'])
+
+        validated.append({'name': policy['name'], 'policy': policy['policy']})
+    return validated
+
 
 RootCASchema = Schema({
     Required('kind'): All('RootCA', msg="Must be 'RootCA'"),
@@ -11,7 +120,7 @@ RootCASchema = Schema({
     Required('spec'): {
         Required('key_type'): Any('rsa', 'ec', msg="Must be 'rsa' or 'ec'"),
         Required('key_bits'): Range(min=256, max=4096),
-        Optional('ttl', default='87660h'): Match(r'\d+h'),
+        Optional('ttl', default='87660h'): Match(r'\d+h\Z'),
         Optional('exclude_cn_from_sans', default=True): bool,
         Required('subject'): {
             Required('common_name'): str,
@@ -33,14 +142,14 @@ IntermediateCASchema = Schema({
         Optional('kv_engine'): Match(MOUNT_PATH_REGEX, msg="Must be lowercase alphanumberic string")
     },
     Required('spec'): {
-        Required('type'): Any('internal', 'exported', msg="Must be 'internal' or 'exported'"),
+        Required('type'): Any('internal', 'exported', 'local', msg="Must be 'internal', 'exported' or 'local'"),
         Required('key_type'): Any('rsa', 'ec', msg="Must be 'rsa' or 'ec'"),
         Required('key_bits'): Range(min=256, max=4096),
-        Optional('ttl', default='87660h'): Match(r'\d+h'),
+        Optional('ttl', default='87660h'): Match(r'\d+h\Z'),
         Optional('exclude_cn_from_sans', default=True): bool,
         Optional('max_path_length', default=0): Range(min=-1, max=5),
         Optional('crl', default={}): {
-            Optional('expiry', default='72h'): Match(r'\d+[hms]'),
+            Optional('expiry', default='72h'): Match(DURATION_REGEX),
             Optional('disable', default=False): bool
         },
         Required('subject'): {
@@ -51,27 +160,8 @@ IntermediateCASchema = Schema({
             Optional('organization'): str,
             Optional('ou'): str,
         },
-        Optional('roles', default=[]): [{
-            Required('name'): Match(r'^[a-z0-9-_]+$', msg="Must be lowercase alphanumberic string"),
-            Required('config'): {
-                Required('max_ttl'): Match(r'\d+[hms]'),
-                Optional('ttl'): Match(r'\d+[hms]'),
-                Required('server_flag'): bool,
-                Required('client_flag'): bool,
-                Optional('allow_localhost'): bool,
-                Optional('allow_subdomains'): bool,
-                Optional('allow_any_name'): bool,
-                Optional('allow_ip_sans'): bool,
-                Optional('enforce_hostnames'): bool,
-                Optional('generate_lease'): bool,
-                Optional('no_store'): bool,
-                Optional('allowed_domains'): [Match(r'^(?![-.])[a-zA-Z0-9-\.]+(?<![.-])$')],
-            }
-        }],
-        Optional('policies', default=[]): [{
-            Required('name'): Match(MOUNT_PATH_REGEX, msg="Must be lowercase alphanumberic string"),
-            Required('policy'): str
-        }]
+        Optional('roles', default=[]): validate_roles,
+        Optional('policies', default=[]): validate_policies
     }
 })
 
@@ -83,8 +173,8 @@ KeyValueSchema = Schema({
     },
     Required('spec'): {
         Optional("config"): {
-            Optional('default_lease_ttl', default='8766h'): Match(r'\d+[hms]'),
-            Optional('max_lease_ttl', default='17532h'): Match(r'\d+[hms]'),
+            Optional('default_lease_ttl', default='8766h'): Match(DURATION_REGEX),
+            Optional('max_lease_ttl', default='17532h'): Match(DURATION_REGEX),
             Optional('force_no_cache', default=False): bool
         },
         Required("options"): {
@@ -92,3 +182,12 @@ KeyValueSchema = Schema({
         }
     }
 })
+
+TargetsSchema = Schema([{
+    Required('name'): Match(ROLE_NAME_REGEX, msg="Must be lowercase alphanumberic string"),
+    Required('url'): Match(r'^https?://', msg="Must be an http or https URL"),
+    Optional('token'): str,
+    Optional('token_env'): str,
+    Optional('tls_skip_verify'): bool,
+    Optional('ca_cert'): str
+}])
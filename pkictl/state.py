@@ -0,0 +1,84 @@
+from typing import Dict, List, Optional
+
+
+class VaultState:
+    """ a read-only view of the resources defined in the manifests as they currently exist in Vault """
+
+    def __init__(self):
+        self.mounts: Dict[str, dict]                            = {}
+        self.certificates: Dict[str, str]                       = {}
+        self.crl_configs: Dict[str, dict]                       = {}
+        self.roles: Dict[str, Dict[str, Optional[dict]]]        = {}
+        self.policies: Dict[str, Optional[str]]                 = {}
+
+    @classmethod
+    def snapshot(cls, vault_client, roots: List[dict], intermediates: List[dict]):
+        """ reads which resources exist, using a number of requests proportional to the number of mounts """
+        return cls.read(vault_client, roots, intermediates, details=False)
+
+    @classmethod
+    def read(cls, vault_client, roots: List[dict], intermediates: List[dict], details: bool=True):
+        """ reads the live state needed to diff the manifests, batching independent reads concurrently """
+        state = cls()
+        state.mounts = vault_client.read_mounts()
+
+        cas = [ca['metadata']['name'] for ca in roots + intermediates]
+        mounted = [name for name in cas if name in state.mounts]
+
+        certificates = vault_client.map_concurrently(vault_client.read_ca_certificate, mounted)
+        state.certificates = {name: cert for name, cert in zip(mounted, certificates) if cert}
+
+        # roles and the CRL configuration only need to be compared for intermediate CAs that exist
+        existing = [ca for ca in intermediates if ca['metadata']['name'] in state.certificates]
+        names    = [ca['metadata']['name'] for ca in existing]
+
+        listed = vault_client.map_concurrently(vault_client.list_roles, names)
+        for name, keys in zip(names, listed):
+            state.roles[name] = dict.fromkeys(keys)
+
+        state.policies = dict.fromkeys(vault_client.list_policies())
+
+        if details:
+            state.read_details(vault_client, existing)
+        return state
+
+    def read_details(self, vault_client, intermediates: List[dict]):
+        """ reads the CRL configuration, roles and policies defined in the manifests that already exist """
+        names = [ca['metadata']['name'] for ca in intermediates]
+
+        crls = vault_client.map_concurrently(vault_client.read_crl_configuration, names)
+        self.crl_configs.update(zip(names, crls))
+
+        self.read_definitions(vault_client, intermediates)
+
+    def read_definitions(self, vault_client, intermediates: List[dict]):
+        """ reads the roles and policies defined in the manifests that already exist """
+        wanted: List[tuple] = []
+        for ca in intermediates:
+            name = ca['metadata']['name']
+            wanted.extend((name, role['name']) for role in ca['spec'].get('roles', []) if self.has_role(name, role['name']))
+
+        configs = vault_client.map_concurrently(lambda r: vault_client.read_role(*r), wanted)
+        for (name, role), config in zip(wanted, configs):
+            self.roles[name][role] = config
+
+        managed = [p['name'] for ca in intermediates for p in ca['spec'].get('policies', []) if self.has_policy(p['name'])]
+
+        documents = vault_client.map_concurrently(vault_client.read_policy, managed)
+        self.policies.update(zip(managed, documents))
+
+    def has_mount(self, name: str) -> bool:
+        return name in self.mounts
+
+    def has_ca(self, name: str) -> bool:
+        return name in self.certificates
+
+    def has_role(self, ca: str, role: str) -> bool:
+        return role in self.roles.get(ca, {})
+
+    def has_policy(self, name: str) -> bool:
+        return name in self.policies
+
+    def policy_matches(self, name: str, policy: str) -> bool:
+        current = self.policies.get(name)
+        return current is not None and current.strip() == policy.strip()
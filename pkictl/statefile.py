@@ -0,0 +1,147 @@
+from .resources import IntermediateCAManifest
+from . import utils
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+
+STATE_FILE_VERSION = 1
+
+
+def content_hash(document) -> str:
+    """ returns a stable digest of a validated manifest document """
+    serialized = json.dumps(document, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class StateFile:
+    """ records a hash of every resource applied to a Vault server so unchanged resources can be skipped """
+
+    def __init__(self, path: str, vault_addr: str):
+        self.path       = path
+        self.vault_addr = vault_addr
+        self.lock       = Lock()
+        self.servers: Dict[str, Dict[str, str]] = {}
+        self.cleared: Dict[str, str]            = {}
+
+    def for_server(self, vault_addr: str) -> 'StateFile':
+        """ returns a view of the same state file for another Vault server, which can be updated and saved concurrently """
+        statefile         = StateFile(self.path, vault_addr)
+        statefile.lock    = self.lock
+        statefile.servers = self.servers
+
+        # the entries are created upfront, as adding them while another view is saving would break its iteration
+        with self.lock:
+            self.servers.setdefault(vault_addr, {})
+        return statefile
+
+    @classmethod
+    def load(cls, path: str, vault_addr: str):
+        statefile = cls(path, vault_addr)
+
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return statefile
+        except ValueError:
+            return utils.exit_with_message(f"failed to parse state file, invalid JSON: {path}")
+
+        if data.get('version') != STATE_FILE_VERSION:
+            utils.exit_with_message(f"Unsupported state file version: {path}")
+
+        statefile.servers = data.get('servers', {})
+        return statefile
+
+    @property
+    def entries(self) -> Dict[str, str]:
+        return self.servers.setdefault(self.vault_addr, {})
+
+    def clear(self) -> None:
+        """ forgets every resource applied to the Vault server, keeping the digests aside to compare roles and policies with """
+        with self.lock:
+            self.cleared = self.servers.get(self.vault_addr, {})
+            self.servers[self.vault_addr] = {}
+
+    def recorded(self, key: str) -> Optional[str]:
+        """ returns the digest recorded for a resource when it was last applied, even if the state file was cleared since """
+        return self.entries.get(key, self.cleared.get(key))
+
+    def drifted(self, levels: List[List[IntermediateCAManifest]], digests: Dict[str, str], state) -> List[List[IntermediateCAManifest]]:
+        """ keeps the roles and policies of the CAs that changed since they were applied, or that are missing from the Vault snapshot """
+        def unchanged(key: str) -> bool:
+            return self.recorded(key) == digests[key]
+
+        drifted = []
+        for level in levels:
+            pending = []
+            for ca in level:
+                name     = ca['metadata']['name']
+                roles    = [r for r in ca['spec']['roles'] if not (state.has_role(name, r['name']) and unchanged(f"role:{name}/{r['name']}"))]
+                policies = [p for p in ca['spec']['policies'] if not (state.has_policy(p['name']) and unchanged(f"policy:{p['name']}"))]
+                pending.append(ca.with_spec(roles=roles, policies=policies))
+            drifted.append(pending)
+        return drifted
+
+    def changes(self, roots: List[dict], levels: List[List[IntermediateCAManifest]], kv_engines: List[dict],
+                cascade: bool=False) -> Tuple[List[dict], List[List[IntermediateCAManifest]], List[dict], Dict[str, str]]:
+        """ returns the resources that changed since they were last applied and the digests of every resource, and with cascade the CAs issued by a changed CA """
+        digests: Dict[str, str] = {}
+
+        def changed(key: str, document) -> bool:
+            digests[key] = content_hash(document)
+            return self.entries.get(key) != digests[key]
+
+        kv_pending = [kve for kve in kv_engines if changed(f"KV:{kve['metadata']['name']}", kve)]
+        roots_pending = [ca for ca in roots if changed(f"RootCA:{ca['metadata']['name']}", ca)]
+
+        # the CAs whose own configuration changed, so that the CAs they issue can follow
+        changed_cas = {ca['metadata']['name'] for ca in roots_pending}
+
+        levels_pending = []
+        for level in levels:
+            pending = []
+            for ca in level:
+                name = ca['metadata']['name']
+                spec = ca['spec']
+
+                # roles and policies are tracked on their own so that editing one does not rewrite the others
+                ca_changed = changed(f"IntermediateCA:{name}", dict(ca, spec={k: v for k, v in spec.items() if k not in ('roles', 'policies')}))
+                roles      = [r for r in spec['roles'] if changed(f"role:{name}/{r['name']}", r)]
+                policies   = [p for p in spec['policies'] if changed(f"policy:{p['name']}", p)]
+
+                if cascade and (ca_changed or ca['metadata']['issuer'] in changed_cas):
+                    changed_cas.add(name)
+                    ca_changed = True
+
+                if ca_changed or roles or policies:
+                    pending.append(ca.with_spec(roles=roles, policies=policies))
+
+            if pending:
+                levels_pending.append(pending)
+
+        return roots_pending, levels_pending, kv_pending, digests
+
+    def update(self, digests: Dict[str, str], prune: bool=False) -> int:
+        """ records the applied digests, optionally dropping entries for resources no longer in the manifests """
+        pruned = 0
+        with self.lock:
+            if prune:
+                stale = [key for key in self.entries if key not in digests]
+                for key in stale:
+                    del self.entries[key]
+                pruned = len(stale)
+
+            self.entries.update(digests)
+        return pruned
+
+    def save(self) -> None:
+        """ atomically writes the state file """
+        data = {'version': STATE_FILE_VERSION, 'servers': self.servers}
+
+        try:
+            # views of the same file for other servers save from other threads
+            with self.lock:
+                utils.write_atomic(self.path, json.dumps(data, indent=2, sort_keys=True))
+        except Exception:
+            utils.exit_with_message(f"Failed to write the state file to {self.path}")
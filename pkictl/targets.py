@@ -0,0 +1,95 @@
+from . import schemas, utils
+from typing import List, Optional
+from voluptuous import Invalid
+import os
+import yaml
+
+
+class Target:
+    """ a Vault cluster that the manifests are applied to, with its own token and TLS settings """
+
+    def __init__(self, name: str, url: str, token: str, verify_ssl=True):
+        self.name       = name
+        self.url        = url
+        self.token      = token
+        self.verify_ssl = verify_ssl
+
+
+class TargetResult:
+    """ the outcome of applying the manifests to a single target """
+
+    def __init__(self, target: Target):
+        self.target  = target
+        self.applied = 0
+        self.error: Optional[str] = None
+        self.elapsed = 0.0
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def line(self, width: int) -> str:
+        outcome = f"failed: {self.error}" if self.failed else f"applied {self.applied} resources"
+        return f"{self.target.name:<{width}}  {self.target.url}  {outcome} in {self.elapsed:.1f}s"
+
+
+def read_targets(path: str, verify_ssl=True) -> List[Target]:
+    """ reads and validates a YAML file listing the Vault clusters to apply the manifests to, verify_ssl is the TLS setting of the targets without one """
+    try:
+        with open(path, 'r') as f:
+            document = yaml.safe_load(f)
+    except FileNotFoundError:
+        utils.exit_with_message(f"targets file does not exist: {path}")
+    except yaml.YAMLError:
+        utils.exit_with_message(f"failed to parse targets file, invalid YAML: {path}")
+
+    try:
+        entries = schemas.TargetsSchema(document)
+    except Invalid as err:
+        utils.exit_with_message(f"invalid targets file {path}: {err}")
+
+    if not entries:
+        utils.exit_with_message(f"no targets defined in targets file: {path}")
+
+    names = [entry['name'] for entry in entries]
+    urls  = [entry['url'].rstrip('/') for entry in entries]
+    for values, kind in ((names, 'name'), (urls, 'URL')):
+        duplicates = sorted({v for v in values if values.count(v) > 1})
+        if duplicates:
+            utils.exit_with_message(f"target {kind} defined more than once: {', '.join(duplicates)}")
+
+    default_token = None
+    targets: List[Target] = []
+
+    for entry in entries:
+        if 'token' in entry:
+            token = entry['token']
+        elif 'token_env' in entry:
+            token = os.getenv(entry['token_env'])
+            if token is None:
+                utils.exit_with_message(f"environment variable {entry['token_env']} not set for target: {entry['name']}")
+        else:
+            # targets without a token of their own share VAULT_TOKEN, which is only prompted for once
+            if default_token is None:
+                default_token = utils.get_from_environment('VAULT_TOKEN')
+            token = default_token
+
+        # the TLS settings of a target override the ones of --tls-skip-verify and VAULT_SKIP_VERIFY
+        if 'ca_cert' in entry:
+            target_verify_ssl = entry['ca_cert']
+        elif 'tls_skip_verify' in entry:
+            target_verify_ssl = not entry['tls_skip_verify']
+        else:
+            target_verify_ssl = verify_ssl
+        targets.append(Target(entry['name'], entry['url'], token, target_verify_ssl))
+    return targets
+
+
+def print_report(results: List[TargetResult]) -> None:
+    """ outputs one line per target, followed by the number of targets that failed """
+    width  = max(len(r.target.name) for r in results)
+    failed = sum(r.failed for r in results)
+
+    utils.output_message(f"Applied the manifests to {len(results) - failed} of {len(results)} Vault clusters")
+    for result in results:
+        utils.output_message(result.line(width), err=result.failed)
@@ -52,19 +52,26 @@ def create_test_http_server():
 
 def get_test_root_ca(baseurl):
     with open(ROOT_MANIFEST_YAML) as f:
-        d = yaml.load(f.read())
+        d = yaml.load(f.read(), Loader=yaml.SafeLoader)
     return RootCA(baseurl, d)
 
 
 def get_test_intermediate_ca(baseurl):
     with open(INTERMEDIATE_MANIFEST_YAML) as f:
-        d = yaml.load(f.read())
+        d = yaml.load(f.read(), Loader=yaml.SafeLoader)
+    return IntermediateCA(baseurl, d)
+
+
+def get_test_local_intermediate_ca(baseurl):
+    with open(INTERMEDIATE_MANIFEST_YAML) as f:
+        d = yaml.load(f.read(), Loader=yaml.SafeLoader)
+    d['spec']['type'] = 'local'
     return IntermediateCA(baseurl, d)
 
 
 def get_test_kv_engine(baseurl):
     with open(KV_MANIFEST_YAML) as f:
-        d = yaml.load(f.read())
+        d = yaml.load(f.read(), Loader=yaml.SafeLoader)
     return KeyValueEngine(baseurl, d)
 
 
@@ -0,0 +1,84 @@
+from helper import PKI_MANIFEST_YAML
+from pkictl import aio, utils
+from pkictl.vault import VaultClient
+from unittest.mock import MagicMock
+import threading
+import time
+import unittest
+
+
+class TestAsyncApply(unittest.TestCase):
+    def setUp(self):
+        self.baseurl      = "https://localhost:8200"
+        self.vault_client = MagicMock(spec=VaultClient)
+        self.vault_client.baseurl = self.baseurl
+        self.vault_client.check_existing_ca.return_value = False
+
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        self.roots, intermediates, self.kv_engines = utils.get_validated_manifests(documents)
+        self.levels = utils.get_intermediate_ca_levels(intermediates, self.roots)
+
+    def test_run_apply(self):
+        aio.run_apply(self.vault_client, self.roots, self.levels, self.kv_engines)
+
+        self.assertEqual(self.vault_client.mount_kv_engine.call_count, 2)
+        self.assertEqual(self.vault_client.create_root_ca.call_count, 2)
+        self.assertEqual(self.vault_client.mount_pki_engine.call_count, 5)
+        self.assertEqual(self.vault_client.create_intermediate_ca.call_count, 3)
+        self.assertEqual(self.vault_client.store_ca_private_key.call_count, 2)
+        self.assertEqual(self.vault_client.configure_ca_roles.call_count, 3)
+        self.assertEqual(self.vault_client.configure_ca_policies.call_count, 3)
+
+    def test_run_apply_issuer_order(self):
+        aio.run_apply(self.vault_client, self.roots, self.levels, self.kv_engines)
+
+        signed = [c[0][0].name for c in self.vault_client.sign_intermediate_ca.call_args_list]
+        self.assertLess(signed.index('pki/intermediate-ca-staging'), signed.index('pki/intermediate-ca-dev'))
+
+    def test_run_apply_concurrency_limit(self):
+        running = []
+        peak    = []
+        lock    = threading.Lock()
+
+        def mount(kvengine):
+            with lock:
+                running.append(kvengine)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(kvengine)
+
+        self.vault_client.mount_kv_engine.side_effect = mount
+        kv_engines = [{'kind': 'KV', 'metadata': {'name': f'kv-{i}', 'description': ''}, 'spec': {}} for i in range(8)]
+
+        aio.run_apply(self.vault_client, [], [], kv_engines, concurrency=2)
+
+        self.assertEqual(self.vault_client.mount_kv_engine.call_count, 8)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_run_apply_fatal_error(self):
+        def fail(ca):
+            utils.exit_with_message(f"Failed to mount PKI secrets engine: {ca.name}")
+
+        self.vault_client.mount_pki_engine.side_effect = fail
+
+        with self.assertRaises(SystemExit) as e:
+            aio.run_apply(self.vault_client, self.roots, self.levels, self.kv_engines)
+
+        self.assertIn("[-] pkictl - Error: Failed to mount PKI secrets engine:", e.exception.args[0])
+        self.vault_client.create_root_ca.assert_not_called()
+        self.vault_client.create_intermediate_ca.assert_not_called()
+
+
+class TestAsyncVaultClient(unittest.TestCase):
+    def test_call(self):
+        vault_client = MagicMock(spec=VaultClient)
+        vault_client.healthcheck.return_value = (True, False)
+
+        client = aio.AsyncVaultClient(vault_client)
+        self.assertEqual(client.call('healthcheck'), (True, False))
+
+        vault_client.healthcheck.side_effect = SystemExit("[-] pkictl - Error: test")
+        with self.assertRaises(aio.ApplyError):
+            client.call('healthcheck')
+        client.close()
@@ -0,0 +1,90 @@
+from helper import PKI_MANIFEST_YAML, capture_stdout
+from pkictl import bundles, utils
+import os
+import tempfile
+import unittest
+
+
+class FakeVaultClient:
+    """ returns a fake certificate for every CA and records the requests """
+
+    def __init__(self, missing=()):
+        self.missing   = set(missing)
+        self.requested = []
+        self.secrets   = {}
+
+    def read_ca_certificate(self, name):
+        self.requested.append(name)
+        return None if name in self.missing else f"CERT {name}\n"
+
+    def map_concurrently(self, func, items):
+        return [func(i) for i in items]
+
+    def write_secret(self, path, data):
+        self.secrets[path] = data
+
+
+class TestBundles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir  = tempfile.TemporaryDirectory()
+        self.out_dir = os.path.join(self.tmpdir.name, 'bundles')
+
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        self.roots, self.intermediates, _ = utils.get_validated_manifests(documents)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self, name):
+        with open(os.path.join(self.out_dir, name)) as f:
+            return f.read()
+
+    def export(self, vault_client, **kwargs):
+        with capture_stdout(bundles.export_bundles, vault_client, self.roots, self.intermediates, self.out_dir, **kwargs) as output:
+            return output
+
+    def test_build_chains(self):
+        issuers      = {'root': None, 'a': 'root', 'b': 'a', 'c': 'a'}
+        certificates = {name: name.upper() for name in issuers}
+
+        chains = bundles.build_chains(certificates, issuers)
+        self.assertEqual(chains['root'], ['ROOT'])
+        self.assertEqual(chains['c'], ['C', 'A', 'ROOT'])
+
+        # the shared issuers only appear once, ahead of the CAs they issued
+        self.assertEqual(bundles.build_trust_bundle(chains), ['ROOT', 'A', 'B', 'C'])
+
+    def test_export_bundles(self):
+        vault_client = FakeVaultClient()
+        output       = self.export(vault_client)
+
+        # every CA is fetched once, even though the Root CAs are in several chains
+        names = ['pki/root-ca-1', 'pki/root-ca-2', 'pki/intermediate-ca-production', 'pki/intermediate-ca-staging', 'pki/intermediate-ca-dev']
+        self.assertEqual(sorted(vault_client.requested), sorted(names))
+        self.assertIn("Exported the chains of 5 CAs and a trust bundle of 5 certificates", output)
+        self.assertIn("(6 written, 0 unchanged)", output)
+
+        self.assertEqual(self.read('pki/intermediate-ca-dev.pem'),
+                         "CERT pki/intermediate-ca-dev\nCERT pki/intermediate-ca-staging\nCERT pki/root-ca-2\n")
+        self.assertEqual(self.read('trust-bundle.pem').splitlines()[:2], ["CERT pki/root-ca-1", "CERT pki/root-ca-2"])
+
+        # files that are up to date are not written again
+        output = self.export(FakeVaultClient())
+        self.assertIn("(0 written, 6 unchanged)", output)
+        self.assertEqual([f for f in os.listdir(self.out_dir) if f.startswith('.')], [])
+
+    def test_export_bundles_kv_path(self):
+        vault_client = FakeVaultClient()
+        self.export(vault_client, bundle_file='ca.pem', kv_path='secrets/trust')
+
+        secret = vault_client.secrets['secrets/trust']
+        self.assertEqual(secret['trust_bundle'], self.read('ca.pem'))
+        self.assertEqual(secret['chains']['pki/root-ca-1'], "CERT pki/root-ca-1\n")
+
+    def test_export_bundles_missing_ca(self):
+        vault_client = FakeVaultClient(missing=['pki/intermediate-ca-dev'])
+
+        with self.assertRaises(SystemExit) as cm:
+            self.export(vault_client)
+        self.assertIn("CAs have not been generated yet: pki/intermediate-ca-dev", str(cm.exception.code))
+        self.assertFalse(os.path.exists(self.out_dir))
@@ -1,3 +1,5 @@
+from contextlib import redirect_stderr
+from io import StringIO
 from pkictl.cli import cli
 import argparse
 import unittest
@@ -10,14 +12,14 @@ class TestCLI(unittest.TestCase):
 
     def test_cli(self):
         t = self.parser.parse_args([])
-        r = argparse.Namespace(debugging=False, subcommand=None)
+        r = argparse.Namespace(debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=None)
         self.assertEqual(r, t)
 
     def test_init_subcommand(self):
         subcommand = 'init'
 
         t = self.parser.parse_args([subcommand, '--tls-skip-verify', '-u', self.baseurl])
-        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, subcommand=subcommand, tls_skip_verify=True)
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=subcommand, tls_skip_verify=True)
 
         self.assertEqual(r, t)
 
@@ -25,6 +27,77 @@ class TestCLI(unittest.TestCase):
         subcommand = 'apply'
 
         t = self.parser.parse_args([subcommand, '-u', self.baseurl, '-f', 'test.yaml'])
-        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, subcommand=subcommand, tls_skip_verify=None, file='test.yaml')
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=subcommand, tls_skip_verify=None, file='test.yaml', plan=None, targets=None, pool_size=10, concurrency=10, sequential=False, keygen_workers=None, overwrite=False, state_file='.pkictl-state.json', refresh=False, prune=False, apply_early=False, metrics_file=None, max_retries=5)
+
+        self.assertEqual(r, t)
+
+    def test_apply_subcommand_plan(self):
+        subcommand = 'apply'
+
+        t = self.parser.parse_args([subcommand, '--plan', 'plan.json'])
+        self.assertEqual(t.plan, 'plan.json')
+        self.assertIsNone(t.file)
+
+    def test_watch_subcommand(self):
+        subcommand = 'watch'
+
+        t = self.parser.parse_args([subcommand, '-u', self.baseurl, '-f', 'manifests', '--poll', '--interval', '0.5'])
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=subcommand, tls_skip_verify=None, file='manifests', poll=True, interval=0.5, pool_size=10,
+                               concurrency=10, sequential=False, keygen_workers=None, overwrite=False, state_file='.pkictl-state.json', refresh=False, prune=False, metrics_file=None, max_retries=5)
+
+        self.assertEqual(r, t)
+
+    def test_plan_subcommand(self):
+        subcommand = 'plan'
+
+        t = self.parser.parse_args([subcommand, '-u', self.baseurl, '-f', 'test.yaml', '-o', 'plan.json'])
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=subcommand, tls_skip_verify=None, file='test.yaml', out='plan.json', metrics_file=None, max_retries=5)
+
+        self.assertEqual(r, t)
+
+    def test_issue_subcommand(self):
+        subcommand = 'issue'
+
+        t = self.parser.parse_args([subcommand, '-u', self.baseurl, '--ca', 'pki/intermediate-ca', '-r', 'server', '-i', 'subjects.csv', '-o', 'certs.jsonl', '-c', '20'])
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=subcommand, tls_skip_verify=None, ca='pki/intermediate-ca',
+                               role='server', input='subjects.csv', out='certs.jsonl', format=None, concurrency=20, metrics_file=None, max_retries=5)
+
+        self.assertEqual(r, t)
+
+    def test_export_bundles_subcommand(self):
+        subcommand = 'export-bundles'
+
+        t = self.parser.parse_args([subcommand, '-u', self.baseurl, '-f', 'pki.yaml', '-o', 'certs', '--kv-path', 'secrets/trust'])
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=subcommand, tls_skip_verify=None, file='pki.yaml', out_dir='certs',
+                               bundle='trust-bundle.pem', kv_path='secrets/trust', concurrency=10, metrics_file=None, max_retries=5)
+
+        self.assertEqual(r, t)
+
+    def test_rotate_subcommand(self):
+        subcommand = 'rotate'
+
+        t = self.parser.parse_args([subcommand, '-u', self.baseurl, '-f', 'pki.yaml', '--threshold', '60', '--dry-run'])
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=subcommand, tls_skip_verify=None, file='pki.yaml', threshold=60,
+                               dry_run=True, cache_file='.pkictl-cert-cache.json', concurrency=10, keygen_workers=None, metrics_file=None, max_retries=5)
+
+        self.assertEqual(r, t)
+
+    def test_crl_rotate_subcommand(self):
+        t = self.parser.parse_args(['crl', 'rotate', '-u', self.baseurl, '-f', 'pki.yaml', '--skip-recent', '1h', '-c', '20'])
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand='crl', crl_command='rotate', tls_skip_verify=None, file='pki.yaml',
+                               skip_recent='1h', concurrency=20, metrics_file=None, max_retries=5)
+
+        self.assertEqual(r, t)
+
+        # a subcommand of crl is required
+        with self.assertRaises(SystemExit), redirect_stderr(StringIO()):
+            self.parser.parse_args(['crl'])
+
+    def test_tidy_subcommand(self):
+        subcommand = 'tidy'
+
+        t = self.parser.parse_args([subcommand, '-u', self.baseurl, '-f', 'pki.yaml', '-c', '4', '--pause', '10ms'])
+        r = argparse.Namespace(baseurl=self.baseurl, debugging=False, log_format='human', record=None, replay=None, replay_latency=False, har=None, subcommand=subcommand, tls_skip_verify=None, file='pki.yaml',
+                               concurrency=4, safety_buffer='72h', pause='10ms', interval=5.0, metrics_file=None, max_retries=5)
 
         self.assertEqual(r, t)
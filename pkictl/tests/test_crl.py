@@ -0,0 +1,105 @@
+from helper import PKI_MANIFEST_YAML, capture_stdout
+from pkictl import crl, utils
+from pkictl.vault import VaultClient
+import base64
+import datetime
+import unittest
+
+# CRLs issued on 2020-01-01, one revoking the serials 1000 and 1001 and one revoking none
+CRL_REVOKED = base64.b64decode("""
+MIHcMIGEAgEBMAoGCCqGSM49BAMCMBkxFzAVBgNVBAMMDnBraWN0bCB0ZXN0IENB
+Fw0yMDAxMDEwMDAwMDBaFw0yMDAxMDQwMDAwMDBaMCowEwICA+gXDTE5MTIzMTAw
+MDAwMFowEwICA+kXDTE5MTIzMTAwMDAwMFqgDjAMMAoGA1UdFAQDAgEHMAoGCCqG
+SM49BAMCA0cAMEQCIDa4KFjC9gHuGTYoHnANTlAO+t7RjYwJRqhdXRlzTVv5AiBI
+u5CNTstPlGb1kLE2AIRHhdhkcUzoDFoHz8FolK461Q==
+""")
+
+CRL_EMPTY = base64.b64decode("""
+MIGgMEgCAQEwCgYIKoZIzj0EAwIwGTEXMBUGA1UEAwwOcGtpY3RsIHRlc3QgQ0EX
+DTIwMDEwMTAwMDAwMFoXDTIwMDEwNDAwMDAwMFowCgYIKoZIzj0EAwIDSAAwRQIg
+E6FP0wHUmzlwvDYXsJwff3WQh2JJKvXU4UDozDDVjykCIQCic6XrUHHYo7HO6m38
+rF6PomF3w+kP6fwscNrqBfeRaA==
+""")
+
+# long enough for the CRLs above to count as rebuilt recently
+CENTURY = 100 * 365 * 86400
+
+
+class FakeVaultClient:
+    """ serves a CRL per CA and records the CRLs it is asked to rebuild """
+
+    def __init__(self, crls, failing=()):
+        self.crls    = dict(crls)
+        self.failing = failing
+        self.rotated = []
+
+    def read_crl(self, name):
+        return self.crls.get(name)
+
+    def rotate_crl(self, name):
+        if name in self.failing:
+            return False
+        self.rotated.append(name)
+        self.crls[name] = CRL_REVOKED
+        return True
+
+    def imap_concurrently(self, func, items):
+        return (func(i) for i in items)
+
+    # the results are reported the way the Vault client reports them
+    report_results = VaultClient.report_results
+
+
+class TestCRL(unittest.TestCase):
+    def setUp(self):
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        self.roots, self.intermediates, _ = utils.get_validated_manifests(documents)
+        self.names = [ca['metadata']['name'] for ca in self.roots + self.intermediates]
+
+    def test_parse_crl(self):
+        self.assertEqual(crl.parse_crl(CRL_REVOKED), (datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc), 2))
+        self.assertEqual(crl.parse_crl(CRL_EMPTY), (datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc), 0))
+
+        for invalid in [b"", CRL_REVOKED[:40], b"\x02\x01\x00"]:
+            with self.assertRaises(ValueError):
+                crl.parse_crl(invalid)
+
+    def test_rebuild_crls(self):
+        vault_client = FakeVaultClient({name: CRL_EMPTY for name in self.names})
+
+        with capture_stdout(crl.rebuild_crls, vault_client, self.roots, self.intermediates) as output:
+            pass
+
+        self.assertEqual(vault_client.rotated, self.names)
+        self.assertIn("Rebuilt the CRL of CA 'pki/root-ca-1' in ", output)
+        self.assertIn(f"({len(CRL_REVOKED)} bytes, 2 revoked certificates)", output)
+        self.assertIn(f"Rebuilt {len(self.names)} CRLs in ", output)
+
+    def test_rebuild_crls_skip_recent(self):
+        # the CRL of a CA that was never rebuilt, or that cannot be read, is rebuilt whatever the window
+        crls = {name: CRL_EMPTY for name in self.names[1:]}
+        crls[self.names[1]] = b"not a CRL"
+        vault_client = FakeVaultClient(crls)
+
+        # a CA with a disabled CRL is left alone
+        disabled = dict(self.intermediates[-1], spec=dict(self.intermediates[-1]['spec'], crl={'expiry': '72h', 'disable': True}))
+
+        with capture_stdout(crl.rebuild_crls, vault_client, self.roots, self.intermediates[:-1] + [disabled], CENTURY) as output:
+            pass
+
+        self.assertEqual(vault_client.rotated, self.names[:2])
+        self.assertIn(f"Skipped the CRL of CA '{self.names[2]}', which was rebuilt ", output)
+        self.assertIn(f"Skipped the CRL of CA '{self.names[-1]}', which is disabled", output)
+        self.assertIn("Rebuilt 2 CRLs in ", output)
+        self.assertIn(f"skipped {len(self.names) - 3} rebuilt recently", output)
+
+    def test_rebuild_crls_failed(self):
+        vault_client = FakeVaultClient({name: CRL_EMPTY for name in self.names}, failing=self.names[:2])
+
+        with self.assertRaises(SystemExit) as e:
+            with capture_stdout(crl.rebuild_crls, vault_client, self.roots, self.intermediates):
+                pass
+
+        # every other CRL is still rebuilt
+        self.assertEqual(vault_client.rotated, self.names[2:])
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: Failed to rebuild the CRLs of 2 CAs")
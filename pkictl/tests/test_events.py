@@ -0,0 +1,107 @@
+from pkictl import events
+from io import StringIO
+from unittest.mock import patch
+import json
+import threading
+import unittest
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.stream = StringIO()
+        self.log    = events.EventLog(stream=self.stream)
+
+    def test_format_human(self):
+        self.log.emit(events.INFO, "Mounted KV secrets engine: test-kv")
+        self.log.emit(events.ERROR, "Failed to sign intermediate CA", target='us-east-1')
+
+        self.assertEqual(self.stream.getvalue().splitlines(), [
+            "[*] pkictl - Mounted KV secrets engine: test-kv",
+            "[-] pkictl[us-east-1] - Error: Failed to sign intermediate CA"
+        ])
+
+    def test_format_json(self):
+        self.log.configure(fmt='json')
+        self.log.emit(events.DEBUG, "Request method: GET", target='dev', fields={'status': 200})
+
+        record = json.loads(self.stream.getvalue())
+        self.assertEqual(record['level'], 'debug')
+        self.assertEqual(record['message'], "Request method: GET")
+        self.assertEqual(record['target'], 'dev')
+        self.assertEqual(record['status'], 200)
+        self.assertTrue(record['time'].endswith('Z'))
+
+    def test_level(self):
+        calls = []
+
+        def message():
+            calls.append(1)
+            return "debug message"
+
+        # messages below the level are dropped without being formatted
+        self.log.configure(level=events.INFO)
+        self.log.emit(events.DEBUG, message)
+        self.assertEqual((self.stream.getvalue(), calls), ('', []))
+
+        self.log.configure(level=events.DEBUG)
+        self.log.emit(events.DEBUG, message)
+        self.assertEqual((self.stream.getvalue(), calls), ("[*] pkictl - debug message\n", [1]))
+
+    def test_background_writer(self):
+        self.log.start()
+        try:
+            threads = [threading.Thread(target=lambda i=i: [self.log.emit(events.INFO, f"thread {i} message {n}") for n in range(100)]) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.log.flush()
+            self.assertEqual(len(self.stream.getvalue().splitlines()), 400)
+
+            self.log.emit(events.INFO, "last message")
+        finally:
+            self.log.close()
+
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(lines[-1], "[*] pkictl - last message")
+        self.assertTrue(all(line.startswith("[*] pkictl - ") for line in lines))
+        self.assertIsNone(self.log.writer)
+
+    def test_background_writer_failure(self):
+        self.stream.close()
+
+        self.log.start()
+        with patch('sys.stderr', StringIO()) as stderr:
+            try:
+                self.log.emit(events.INFO, "first message")
+                self.log.flush()
+                self.log.emit(events.INFO, "second message")
+            finally:
+                self.log.close()
+
+        # the failure is reported once, and the writer still drains the queue
+        self.assertEqual(stderr.getvalue(), "[-] pkictl - Error: failed to write messages: ValueError('I/O operation on closed file')\n")
+        self.assertIsNone(self.log.writer)
+
+    def test_fatal_error_json(self):
+        from pkictl import pkictl
+
+        argv = ['pkictl', '--log-format', 'json', 'apply', '-u', 'https://localhost:8200', '-f', 'manifest.yaml']
+        with patch('sys.argv', argv), patch('pkictl.events.log', self.log), \
+                patch('pkictl.pkictl.run_subcommand', side_effect=SystemExit("[-] pkictl - Error: manifest file does not exist: manifest.yaml")):
+            with self.assertRaises(SystemExit) as e:
+                pkictl.main()
+
+        # the error is an event on the log rather than plain text on stderr
+        record = json.loads(self.stream.getvalue())
+        self.assertEqual((record['level'], record['message']), ('error', "manifest file does not exist: manifest.yaml"))
+        self.assertEqual(e.exception.code, 1)
+
+    def test_summarize_body(self):
+        self.assertEqual(events.summarize_body("short body"), "short body")
+
+        body    = "-----BEGIN CERTIFICATE-----" + "A" * 1000
+        summary = events.summarize_body(body, limit=27)
+        self.assertTrue(summary.startswith("-----BEGIN CERTIFICATE-----... (1027 characters, sha256:"))
+        self.assertNotEqual(summary, events.summarize_body(body[:-1] + "B", limit=27))
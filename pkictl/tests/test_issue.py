@@ -0,0 +1,175 @@
+from helper import capture_stdout
+from pkictl import issue
+from unittest.mock import MagicMock, patch
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+
+class TestIssue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmpdir.name, 'certs.jsonl')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def read_results(self):
+        with open(self.output) as f:
+            return [json.loads(line) for line in f]
+
+    def get_vault_client(self, fail=()):
+        def issue_certificate(ca_name, role, params):
+            if params['common_name'] in fail:
+                return None, "common name not allowed by this role"
+            return {'certificate': f"CERT {params['common_name']}", 'serial_number': params['common_name']}, None
+
+        vault_client = MagicMock()
+        vault_client.issue_certificate = MagicMock(side_effect=issue_certificate)
+        return vault_client
+
+    def test_read_subjects_csv(self):
+        path = self.write('subjects.csv', 'common_name,alt_names,ttl\nwww.example.com,"a.example.com,b.example.com",24h\napi.example.com,,\n')
+
+        subjects = list(issue.read_subjects(path))
+        self.assertEqual(subjects, [
+            (2, {'common_name': 'www.example.com', 'alt_names': 'a.example.com,b.example.com', 'ttl': '24h'}, None),
+            (3, {'common_name': 'api.example.com'}, None)
+        ])
+
+    def test_read_subjects_jsonl(self):
+        path = self.write('subjects.jsonl', '{"common_name": "www.example.com", "ip_sans": ["10.0.0.1", "10.0.0.2"]}\n\n{"common_name": "api.example.com"}\n')
+
+        subjects = list(issue.read_subjects(path))
+        self.assertEqual(subjects, [
+            (1, {'common_name': 'www.example.com', 'ip_sans': '10.0.0.1,10.0.0.2'}, None),
+            (3, {'common_name': 'api.example.com'}, None)
+        ])
+
+    def test_read_subjects_invalid(self):
+        invalid = [
+            ('a.jsonl', '{"common_name": \n', 1, "invalid JSON"),
+            ('b.jsonl', '{"alt_names": "www.example.com"}\n', 1, "common_name not defined"),
+            ('c.jsonl', '["www.example.com"]\n', 1, "expected an object"),
+            ('d.csv', 'common_name,key_bits\nwww.example.com,4096\n', 2, "unsupported field 'key_bits'"),
+        ]
+
+        for name, text, line, msg in invalid:
+            path = self.write(name, text)
+            self.assertEqual(list(issue.read_subjects(path)), [(line, None, msg)])
+
+        with self.assertRaises(SystemExit) as e:
+            list(issue.read_subjects(os.path.join(self.tmpdir.name, 'missing.jsonl')))
+        self.assertIn("input file does not exist", e.exception.args[0])
+
+    def test_issue_certificates_invalid_line(self):
+        lines = [f'{{"common_name": "host-{i}.example.com"}}\n' for i in range(10)]
+        lines[5] = '{"common_name": \n'
+        path = self.write('subjects.jsonl', ''.join(lines))
+
+        with capture_stdout(issue.issue_certificates, self.get_vault_client(), 'pki/intermediate-ca', 'server', path, self.output, concurrency=4) as output:
+            pass
+
+        # the invalid line is reported and the certificates requested before and after it are all written
+        self.assertIn(f"Failed to read the subject on line 6 of {path}: invalid JSON", output)
+        results = {r['line']: r for r in self.read_results()}
+        self.assertEqual(sorted(results), list(range(1, 11)))
+        self.assertEqual(results[6], {'line': 6, 'error': 'invalid JSON'})
+        self.assertEqual(results[10]['certificate'], 'CERT host-9.example.com')
+
+    def test_issue_certificates_interrupted(self):
+        path = self.write('subjects.jsonl', ''.join(f'{{"common_name": "host-{i}.example.com"}}\n' for i in range(10)))
+        subjects = issue.read_subjects(path)
+
+        def read_subjects(path, fmt=None):
+            # the input stops being readable after a few subjects were submitted
+            for i, subject in enumerate(subjects):
+                if i == 3:
+                    raise KeyboardInterrupt
+                yield subject
+
+        with patch('pkictl.issue.read_subjects', read_subjects), self.assertRaises(KeyboardInterrupt):
+            issue.issue_certificates(self.get_vault_client(), 'pki/intermediate-ca', 'server', path, self.output, concurrency=4)
+
+        # the certificates already requested are written with their private keys
+        self.assertEqual(sorted(r['line'] for r in self.read_results()), [1, 2, 3])
+
+    def test_issue_certificates(self):
+        path = self.write('subjects.jsonl', ''.join(f'{{"common_name": "host-{i}.example.com"}}\n' for i in range(25)))
+        vault_client = self.get_vault_client()
+
+        summary = issue.issue_certificates(vault_client, 'pki/intermediate-ca', 'server', path, self.output, concurrency=4)
+
+        self.assertEqual((summary.issued, summary.failed, summary.skipped), (25, 0, 0))
+        self.assertEqual(summary.latencies.count, 25)
+        vault_client.issue_certificate.assert_any_call('pki/intermediate-ca', 'server', {'common_name': 'host-0.example.com'})
+
+        results = self.read_results()
+        self.assertEqual(sorted(r['line'] for r in results), list(range(1, 26)))
+        self.assertEqual(os.stat(self.output).st_mode & 0o777, 0o600)
+
+    def test_issue_certificates_bounded(self):
+        path = self.write('subjects.jsonl', ''.join(f'{{"common_name": "host-{i}.example.com"}}\n' for i in range(20)))
+
+        lock     = threading.Lock()
+        inflight = [0, 0]
+
+        def issue_certificate(ca_name, role, params):
+            with lock:
+                inflight[0] += 1
+                inflight[1] = max(inflight)
+            time.sleep(0.005)
+            with lock:
+                inflight[0] -= 1
+            return {'certificate': 'CERT'}, None
+
+        vault_client = MagicMock()
+        vault_client.issue_certificate = issue_certificate
+
+        issue.issue_certificates(vault_client, 'pki/intermediate-ca', 'server', path, self.output, concurrency=3)
+        self.assertLessEqual(inflight[1], 3)
+
+    def test_issue_certificates_resume(self):
+        path = self.write('subjects.jsonl', ''.join(f'{{"common_name": "host-{i}.example.com"}}\n' for i in range(5)))
+
+        with capture_stdout(issue.issue_certificates, self.get_vault_client(fail={'host-3.example.com'}), 'pki/intermediate-ca', 'server', path, self.output):
+            pass
+
+        # a run killed while writing leaves a partial line behind
+        with open(self.output, 'a') as f:
+            f.write('{"line": 5, "comm')
+
+        vault_client = self.get_vault_client()
+        summary = issue.issue_certificates(vault_client, 'pki/intermediate-ca', 'server', path, self.output)
+
+        self.assertEqual((summary.issued, summary.failed, summary.skipped), (1, 0, 4))
+        vault_client.issue_certificate.assert_called_once_with('pki/intermediate-ca', 'server', {'common_name': 'host-3.example.com'})
+        self.assertEqual(issue.read_completed(self.output), {1, 2, 3, 4, 5})
+
+    def test_latency_stats(self):
+        stats = issue.LatencyStats(size=10)
+        for i in range(1, 101):
+            stats.record(i / 1000)
+
+        self.assertEqual(stats.count, 100)
+        self.assertEqual(len(stats.samples), 10)
+        self.assertEqual(stats.maximum, 0.1)
+
+    def test_summary(self):
+        summary = issue.IssueSummary()
+        summary.issued, summary.elapsed = 50, 2.0
+        summary.latencies.record(0.02)
+
+        lines = summary.lines()
+        self.assertEqual(lines[0], "Issued 50 certificates, 0 failed, 0 already issued")
+        self.assertEqual(lines[1], "Throughput: 25.0 certificates/s over 2.0s")
+        self.assertEqual(lines[2], "Latency: p50 20ms, p95 20ms, p99 20ms, max 20ms")
@@ -0,0 +1,61 @@
+from pkictl import keygen
+from unittest.mock import patch
+import unittest
+
+SUBJECT = {'common_name': 'Test Intermediate CA', 'country': 'US', 'organization': 'pkictl'}
+
+
+def manifest(name, key_type='ec', key_bits=256):
+    return {'metadata': {'name': name}, 'spec': {'type': 'local', 'key_type': key_type, 'key_bits': key_bits, 'subject': SUBJECT}}
+
+
+@unittest.skipUnless(keygen.is_available(), 'the cryptography package is not installed')
+class TestKeyGen(unittest.TestCase):
+    def test_generate_key_and_csr(self):
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+
+        for key_type, key_bits, header in (('ec', 384, 'EC PRIVATE KEY'), ('rsa', 2048, 'RSA PRIVATE KEY')):
+            key, csr = keygen.generate_key_and_csr(key_type, key_bits, SUBJECT)
+            self.assertTrue(key.startswith(f"-----BEGIN {header}-----"))
+
+            request = x509.load_pem_x509_csr(csr.encode('utf-8'), default_backend())
+            self.assertTrue(request.is_signature_valid)
+            self.assertEqual(request.public_key().key_size, key_bits)
+            self.assertEqual(request.subject.rfc4514_string(), 'O=pkictl,C=US,CN=Test Intermediate CA')
+
+    def test_generate_key_and_csr_unsupported_curve(self):
+        with self.assertRaises(ValueError):
+            keygen.generate_key_and_csr('ec', 4096, SUBJECT)
+
+    def test_key_generator(self):
+        generator = keygen.KeyGenerator(workers=2).start([manifest('pki/a'), manifest('pki/b')])
+        try:
+            self.assertEqual(set(generator.futures), {'pki/a', 'pki/b'})
+
+            key, csr = generator.result(manifest('pki/a'))
+            self.assertIn('PRIVATE KEY', key)
+            self.assertNotIn('pki/a', generator.futures)
+
+            # CAs that were not started are generated in this process
+            key, csr = generator.result(manifest('pki/c'))
+            self.assertIn('CERTIFICATE REQUEST', csr)
+        finally:
+            generator.close()
+        self.assertEqual(generator.futures, {})
+
+    def test_key_generator_invalid(self):
+        with self.assertRaises(SystemExit) as e:
+            keygen.KeyGenerator().result(manifest('pki/a', key_bits=4096))
+        self.assertIn("Failed to generate a key pair for intermediate CA 'pki/a'", e.exception.code)
+
+
+class TestKeyGenUnavailable(unittest.TestCase):
+    def test_cryptography_missing(self):
+        with patch('pkictl.keygen.x509', None):
+            with self.assertRaises(SystemExit) as e:
+                keygen.KeyGenerator().start([manifest('pki/a')])
+        self.assertIn("require the cryptography package", e.exception.code)
+
+        # nothing needs the cryptography package when there are no local CAs
+        self.assertEqual(keygen.KeyGenerator().start([]).futures, {})
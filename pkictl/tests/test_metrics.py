@@ -0,0 +1,106 @@
+from helper import create_test_http_server
+from pkictl import metrics
+from pkictl.metrics import Metrics, TimedHTTPAdapter
+from pkictl.vault import VaultClient
+from requests.adapters import HTTPAdapter
+import json
+import os
+import tempfile
+import unittest
+
+
+class Operations:
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+
+    @metrics.operation
+    def outer(self):
+        return metrics.current_operation(), self.inner()
+
+    @metrics.operation
+    def inner(self):
+        return metrics.current_operation()
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.baseurl = "http://localhost:8222"
+        self.metrics = Metrics()
+        self.server  = create_test_http_server()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, vault_client, operation, path='/'):
+        metrics.tagged(vault_client.request, operation)(method='GET', url=f"{self.baseurl}{path}", missing_ok=True)
+
+    def test_operation_tag(self):
+        self.assertEqual(Operations(self.metrics).outer(), ('outer', 'outer'))
+        self.assertIsNone(metrics.current_operation())
+
+    def test_operation_tag_disabled(self):
+        self.assertEqual(Operations().outer(), (None, None))
+
+    def test_map_concurrently_tag(self):
+        vault_client = VaultClient(baseurl=self.baseurl, metrics=self.metrics)
+
+        def configure():
+            return vault_client.map_concurrently(lambda _: metrics.current_operation(), range(4))
+
+        self.assertEqual(metrics.tagged(configure, 'configure_ca_roles')(), ['configure_ca_roles'] * 4)
+
+    def test_adapter(self):
+        self.assertIs(type(VaultClient(baseurl=self.baseurl).session.get_adapter(self.baseurl)), HTTPAdapter)
+        self.assertIsInstance(VaultClient(baseurl=self.baseurl, metrics=self.metrics).session.get_adapter(self.baseurl), TimedHTTPAdapter)
+
+    def test_record_request(self):
+        vault_client = VaultClient(baseurl=self.baseurl, metrics=self.metrics)
+        self.request(vault_client, 'check_existing_ca')
+        self.request(vault_client, 'check_existing_ca', '/404')
+        self.request(vault_client, 'read_mounts')
+
+        m = self.metrics.operations['check_existing_ca']
+        self.assertEqual(m.requests, 2)
+        self.assertEqual(m.errors, 1)
+        self.assertEqual(m.latency['total'].count, 2)
+        self.assertEqual(m.latency['headers'].count, 2)
+        self.assertGreater(m.latency['connect'].sum, 0)
+        self.assertLessEqual(m.latency['connect'].sum, m.latency['total'].sum)
+
+        self.assertEqual(self.metrics.operations['read_mounts'].requests, 1)
+
+    def test_to_dict(self):
+        vault_client = VaultClient(baseurl=self.baseurl, metrics=self.metrics)
+        self.request(vault_client, 'read_mounts')
+        self.metrics.record_retry()
+
+        data = self.metrics.to_dict()['operations']
+        self.assertEqual(sorted(data), ['read_mounts', 'request'])
+        self.assertEqual(data['request']['retries'], 1)
+
+        total = data['read_mounts']['latency']['total']
+        self.assertEqual(total['count'], 1)
+        self.assertEqual(total['buckets']['+Inf'], 1)
+
+    def test_to_prometheus(self):
+        vault_client = VaultClient(baseurl=self.baseurl, metrics=self.metrics)
+        self.request(vault_client, 'read_mounts')
+
+        lines = self.metrics.to_prometheus().split('\n')
+        self.assertIn('# TYPE pkictl_vault_requests_total counter', lines)
+        self.assertIn('pkictl_vault_requests_total{operation="read_mounts"} 1', lines)
+        self.assertIn('pkictl_vault_request_duration_seconds_bucket{operation="read_mounts",phase="total",le="+Inf"} 1', lines)
+        self.assertIn('pkictl_vault_request_duration_seconds_count{operation="read_mounts",phase="headers"} 1', lines)
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'metrics.json')
+            self.metrics.write(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f), {'operations': {}})
+
+            path = os.path.join(tmpdir, 'metrics.prom')
+            self.metrics.write(path)
+            with open(path) as f:
+                self.assertTrue(f.read().startswith('# HELP pkictl_vault_requests_total'))
@@ -1,5 +1,6 @@
 from helper import ROOT_MANIFEST_YAML, INTERMEDIATE_MANIFEST_YAML, KV_MANIFEST_YAML
 from pkictl.models import RootCA, IntermediateCA, KeyValueEngine
+import json
 import unittest
 import yaml
 
@@ -10,7 +11,7 @@ class TestRootCA(unittest.TestCase):
 
     def test_root_ca(self):
         with open(ROOT_MANIFEST_YAML) as f:
-            d = yaml.load(f.read())
+            d = yaml.load(f.read(), Loader=yaml.SafeLoader)
 
         rootca = RootCA(self.baseurl, d)
 
@@ -22,6 +23,17 @@ class TestRootCA(unittest.TestCase):
         self.assertEqual(rootca.url, f'{self.baseurl}/v1/test-root-ca/root/generate/internal')
         self.assertEqual(rootca.config_url, f'{self.baseurl}/v1/test-root-ca/config/urls')
 
+    def test_root_ca_payloads(self):
+        with open(ROOT_MANIFEST_YAML) as f:
+            d = yaml.load(f.read(), Loader=yaml.SafeLoader)
+
+        rootca = RootCA(self.baseurl, d)
+
+        self.assertFalse(hasattr(rootca, '__dict__'))
+        self.assertEqual(json.loads(rootca.spec_json), rootca.spec)
+        self.assertEqual(json.loads(rootca.backend_json), rootca.backend)
+        self.assertEqual(json.loads(rootca.ca_urls_json), rootca.ca_urls)
+
 
 class TestIntermediateCA(unittest.TestCase):
     def setUp(self):
@@ -29,7 +41,7 @@ class TestIntermediateCA(unittest.TestCase):
 
     def test_intermediate_ca(self):
         with open(INTERMEDIATE_MANIFEST_YAML) as f:
-            d = yaml.load(f.read())
+            d = yaml.load(f.read(), Loader=yaml.SafeLoader)
 
         intermediate_ca = IntermediateCA(self.baseurl, d)
 
@@ -44,6 +56,34 @@ class TestIntermediateCA(unittest.TestCase):
         self.assertEqual(intermediate_ca.issuer_sign_url, f'{self.baseurl}/v1/test-root-ca/root/sign-intermediate')
         self.assertEqual(intermediate_ca.set_signed_url, f'{self.baseurl}/v1/test-intermediate-ca/intermediate/set-signed')
 
+    def test_intermediate_ca_payloads(self):
+        with open(INTERMEDIATE_MANIFEST_YAML) as f:
+            d = yaml.load(f.read(), Loader=yaml.SafeLoader)
+
+        intermediate_ca = IntermediateCA(self.baseurl, d)
+        intermediate_ca.csr = "-----BEGIN CERTIFICATE REQUEST-----\n"
+
+        self.assertFalse(hasattr(intermediate_ca, '__dict__'))
+        self.assertEqual(json.loads(intermediate_ca.crl_config_json), d['spec']['crl'])
+        self.assertEqual(json.loads(intermediate_ca.sign_json), dict(intermediate_ca.spec, csr=intermediate_ca.csr))
+
+    def test_intermediate_ca_store_private_key(self):
+        with open(INTERMEDIATE_MANIFEST_YAML) as f:
+            d = yaml.load(f.read(), Loader=yaml.SafeLoader)
+
+        self.assertTrue(IntermediateCA(self.baseurl, d).store_private_key)
+
+        d['spec']['type'] = 'local'
+        intermediate_ca = IntermediateCA(self.baseurl, d)
+        self.assertTrue(intermediate_ca.store_private_key)
+        self.assertEqual(intermediate_ca.import_url, f"{self.baseurl}/v1/{intermediate_ca.name}/config/ca")
+
+        del d['metadata']['kv_engine']
+        self.assertFalse(IntermediateCA(self.baseurl, d).store_private_key)
+
+        d['spec']['type'] = 'internal'
+        self.assertFalse(IntermediateCA(self.baseurl, d).store_private_key)
+
 
 class TestKeyValueEngine(unittest.TestCase):
     def setUp(self):
@@ -51,7 +91,7 @@ class TestKeyValueEngine(unittest.TestCase):
 
     def test_keyvalue_engine(self):
         with open(KV_MANIFEST_YAML) as f:
-            d = yaml.load(f.read())
+            d = yaml.load(f.read(), Loader=yaml.SafeLoader)
 
         kv_engine = KeyValueEngine(self.baseurl, d)
 
@@ -65,3 +105,4 @@ class TestKeyValueEngine(unittest.TestCase):
         self.assertIn('type', kv_engine.spec)
         self.assertIn('description', kv_engine.spec)
         self.assertIn('options', kv_engine.spec)
+        self.assertEqual(json.loads(kv_engine.spec_json), kv_engine.spec)
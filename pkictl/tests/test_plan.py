@@ -0,0 +1,193 @@
+from helper import capture_stdout, PKI_MANIFEST_YAML
+from pkictl import plan, resources, utils
+from pkictl.state import VaultState
+from pkictl.vault import VaultClient
+from unittest.mock import MagicMock
+import tempfile
+import unittest
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.baseurl = "https://localhost:8200"
+
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        self.roots, self.intermediates, self.kv_engines = utils.get_validated_manifests(documents)
+        self.levels = utils.get_intermediate_ca_levels(self.intermediates, self.roots)
+
+    def get_state(self, **kwargs):
+        state = VaultState()
+        for k, v in kwargs.items():
+            setattr(state, k, v)
+        return state
+
+    def get_applied_state(self):
+        """ returns the state of a Vault server that the manifest has already been applied to """
+        names = [ca['metadata']['name'] for ca in self.roots + self.intermediates]
+        names.extend(kve['metadata']['name'] for kve in self.kv_engines)
+
+        state = self.get_state(
+            mounts={name: {} for name in names},
+            certificates={ca['metadata']['name']: 'PEM' for ca in self.roots + self.intermediates}
+        )
+        for ca in self.intermediates:
+            name = ca['metadata']['name']
+            state.crl_configs[name] = {'expiry': ca['spec']['crl']['expiry'], 'disable': False}
+            state.roles[name] = {r['name']: resources.thaw(r['config']) for r in ca['spec']['roles']}
+            state.policies.update({p['name']: p['policy'] for p in ca['spec']['policies']})
+        return state
+
+    def test_build_plan_empty_server(self):
+        p = plan.build_plan(VaultState(), self.baseurl, self.roots, self.levels, self.kv_engines)
+
+        self.assertEqual(p['vault_addr'], self.baseurl)
+        self.assertEqual(len(p['resources']), 7)
+        self.assertTrue(all(r['action'] == plan.CREATE for r in p['resources']))
+
+        # KV engines, then Root CAs, then intermediate CAs in issuer order
+        kinds = [r['kind'] for r in p['resources']]
+        self.assertEqual(kinds, ['KV'] * 2 + ['RootCA'] * 2 + ['IntermediateCA'] * 3)
+
+        dev = p['resources'][-1]
+        self.assertEqual(dev['name'], 'pki/intermediate-ca-dev')
+        self.assertEqual(dev['steps'][0], 'mount_pki_engine')
+        self.assertIn('store_ca_private_key', dev['steps'])
+
+    def test_build_plan_no_changes(self):
+        state = self.get_applied_state()
+        state.roles['pki/intermediate-ca-dev']['client']['max_ttl'] = 94672800  # Vault returns seconds
+
+        p = plan.build_plan(state, self.baseurl, self.roots, self.levels, self.kv_engines)
+        for r in p['resources']:
+            self.assertEqual(r['action'], plan.NOOP)
+            self.assertEqual(r['steps'], [])
+
+    def test_build_plan_update(self):
+        state = self.get_applied_state()
+        state.roles['pki/intermediate-ca-dev']['server']['allowed_domains'] = ['old.example.com']
+        state.roles['pki/intermediate-ca-dev'].pop('client')
+        state.crl_configs['pki/intermediate-ca-production']['expiry'] = '72h'
+
+        p = plan.build_plan(state, self.baseurl, self.roots, self.levels, self.kv_engines)
+        resources = {r['name']: r for r in p['resources']}
+
+        dev = resources['pki/intermediate-ca-dev']
+        self.assertEqual(dev['action'], plan.UPDATE)
+        self.assertEqual(dev['steps'], ['configure_ca_roles'])
+        self.assertEqual([r['name'] for r in dev['manifest']['spec']['roles']], ['client', 'server'])
+        self.assertEqual(dev['manifest']['spec']['policies'], [])
+
+        production = resources['pki/intermediate-ca-production']
+        self.assertEqual(production['steps'], ['set_crl_configuration'])
+
+    def test_role_matches_compound_duration(self):
+        self.assertTrue(plan.role_matches({'ttl': '1h30m'}, {'ttl': 5400}))
+        self.assertTrue(plan.crl_matches({'expiry': '1h30m'}, {'expiry': '90m'}))
+
+        # an invalid duration exits with a message instead of a traceback
+        with self.assertRaises(SystemExit) as e:
+            plan.role_matches({'ttl': '1h30'}, {'ttl': 5400})
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: Invalid duration for ttl: 1h30")
+
+    def test_print_plan(self):
+        p = plan.build_plan(self.get_applied_state(), self.baseurl, self.roots, self.levels, self.kv_engines)
+
+        with capture_stdout(plan.print_plan, p) as output:
+            lines = output.strip().split('\n')
+        self.assertEqual(lines[0], "[*] pkictl - = no-op KV secrets engine: kv/intermediate-ca-staging")
+        self.assertEqual(lines[-1], "[*] pkictl - Plan: 0 to create, 0 to update, 17 unchanged")
+
+    def test_plan_file(self):
+        p = plan.build_plan(VaultState(), self.baseurl, self.roots, self.levels, self.kv_engines)
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as t:
+            with capture_stdout(plan.write_plan_file, p, t.name):
+                pass
+            self.assertEqual(plan.read_plan_file(t.name), p)
+
+    def test_read_plan_file_invalid_step(self):
+        p = plan.build_plan(VaultState(), self.baseurl, self.roots, self.levels, self.kv_engines)
+        p['resources'][0]['steps'] = ['unseal_server']
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as t:
+            with capture_stdout(plan.write_plan_file, p, t.name):
+                pass
+            with self.assertRaises(SystemExit) as e:
+                plan.read_plan_file(t.name)
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: Invalid resource in plan file: kv/intermediate-ca-staging")
+
+    def test_apply_plan(self):
+        state = self.get_applied_state()
+        state.policies['intermediate-ca-production-server-policy'] = 'path "*" {}'
+
+        p = plan.build_plan(state, self.baseurl, self.roots, self.levels, self.kv_engines)
+
+        vault_client = MagicMock(spec=VaultClient)
+        vault_client.baseurl = self.baseurl
+        plan.apply_plan(vault_client, p)
+
+        vault_client.configure_ca_policies.assert_called_once()
+        ca = vault_client.configure_ca_policies.call_args[0][0]
+        self.assertEqual(ca.name, 'pki/intermediate-ca-production')
+        vault_client.configure_ca_roles.assert_not_called()
+        vault_client.mount_pki_engine.assert_not_called()
+
+    def test_apply_plan_different_server(self):
+        p = plan.build_plan(VaultState(), "https://vault.example.com", self.roots, self.levels, self.kv_engines)
+
+        vault_client = MagicMock(spec=VaultClient)
+        vault_client.baseurl = self.baseurl
+
+        with self.assertRaises(SystemExit) as e:
+            plan.apply_plan(vault_client, p)
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: plan was created for a different Vault server: https://vault.example.com")
+
+
+class TestVaultState(unittest.TestCase):
+    def test_read(self):
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        roots, intermediates, _ = utils.get_validated_manifests(documents)
+
+        vault_client = VaultClient(baseurl="https://localhost:8200")
+        vault_client.read_mounts            = MagicMock(return_value={'pki/root-ca-1': {}, 'pki/intermediate-ca-production': {}})
+        vault_client.read_ca_certificate    = MagicMock(return_value='PEM')
+        vault_client.read_crl_configuration = MagicMock(return_value={'expiry': '48h', 'disable': False})
+        vault_client.list_roles             = MagicMock(return_value=['server', 'legacy'])
+        vault_client.read_role              = MagicMock(return_value={'max_ttl': 94672800})
+        vault_client.list_policies          = MagicMock(return_value=['default', 'root'])
+        vault_client.read_policy            = MagicMock()
+
+        state = VaultState.read(vault_client, roots, intermediates)
+
+        self.assertTrue(state.has_ca('pki/root-ca-1'))
+        self.assertFalse(state.has_ca('pki/root-ca-2'))
+        self.assertEqual(vault_client.read_ca_certificate.call_count, 2)
+
+        # only the roles defined in the manifest are read
+        vault_client.read_role.assert_called_once_with('pki/intermediate-ca-production', 'server')
+        self.assertTrue(state.has_role('pki/intermediate-ca-production', 'server'))
+        vault_client.read_policy.assert_not_called()
+
+    def test_snapshot(self):
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        roots, intermediates, _ = utils.get_validated_manifests(documents)
+
+        vault_client = VaultClient(baseurl="https://localhost:8200")
+        vault_client.read_mounts            = MagicMock(return_value={'pki/root-ca-1': {}, 'pki/intermediate-ca-production': {}})
+        vault_client.read_ca_certificate    = MagicMock(return_value='PEM')
+        vault_client.read_crl_configuration = MagicMock()
+        vault_client.list_roles             = MagicMock(return_value=['server'])
+        vault_client.read_role              = MagicMock()
+        vault_client.list_policies          = MagicMock(return_value=['intermediate-ca-production-server-policy'])
+        vault_client.read_policy            = MagicMock()
+
+        state = VaultState.snapshot(vault_client, roots, intermediates)
+
+        self.assertTrue(state.has_mount('pki/root-ca-1'))
+        self.assertTrue(state.has_role('pki/intermediate-ca-production', 'server'))
+        self.assertTrue(state.has_policy('intermediate-ca-production-server-policy'))
+
+        vault_client.list_roles.assert_called_once_with('pki/intermediate-ca-production')
+        vault_client.read_crl_configuration.assert_not_called()
+        vault_client.read_role.assert_not_called()
+        vault_client.read_policy.assert_not_called()
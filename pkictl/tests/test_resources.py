@@ -0,0 +1,85 @@
+from helper import PKI_MANIFEST_YAML
+from pkictl import resources, utils
+import copy
+import json
+import pickle
+import unittest
+
+
+class TestResources(unittest.TestCase):
+    def setUp(self):
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        self.roots, self.intermediates, self.kv_engines = utils.get_validated_manifests(documents)
+
+    def test_typed_resources(self):
+        self.assertIsInstance(self.roots[0], resources.RootCAManifest)
+        self.assertIsInstance(self.kv_engines[0], resources.KeyValueManifest)
+
+        ca = self.intermediates[0]
+        self.assertIsInstance(ca, resources.IntermediateCAManifest)
+        self.assertEqual(ca.kind, 'IntermediateCA')
+        self.assertEqual(ca.name, ca['metadata']['name'])
+        self.assertEqual(ca.issuer, ca['metadata']['issuer'])
+
+    def test_immutable(self):
+        ca = self.intermediates[0]
+
+        with self.assertRaises(TypeError):
+            ca['kind'] = 'RootCA'
+        with self.assertRaises(TypeError):
+            ca['spec']['roles'].append({})
+        with self.assertRaises(TypeError):
+            ca['spec']['roles'][0]['config'].update(max_ttl='1h')
+
+    def test_copies(self):
+        ca = self.intermediates[0]
+
+        spec = ca['spec'].copy()
+        spec.pop('roles')
+        self.assertIn('roles', ca['spec'])
+
+        # a deep copy of a frozen manifest is still frozen, thaw returns a mutable one
+        frozen = copy.deepcopy({'ca': ca})['ca']
+        self.assertIsInstance(frozen, resources.IntermediateCAManifest)
+        self.assertIsInstance(frozen['spec']['roles'], resources.FrozenList)
+        with self.assertRaises(TypeError):
+            frozen['spec']['roles'].clear()
+
+        mutable = resources.thaw(ca)
+        mutable['spec']['roles'].clear()
+        self.assertEqual(type(mutable), dict)
+        self.assertNotEqual(ca['spec']['roles'], [])
+
+        self.assertEqual(pickle.loads(pickle.dumps(ca)), ca)
+        self.assertEqual(json.loads(json.dumps(ca)), ca)
+
+    def test_hash(self):
+        ca = self.intermediates[0]
+
+        # equal manifests hash the same, so they can be used as keys whichever copy is looked up
+        same = resources.validate(resources.thaw(ca))
+        self.assertIsNot(same, ca)
+        self.assertEqual(same, ca)
+        self.assertEqual(hash(same), hash(ca))
+        self.assertEqual({ca: 1}[same], 1)
+
+        changed = ca.with_spec(roles=[])
+        self.assertNotEqual(changed, ca)
+        self.assertNotEqual(hash(changed), hash(ca))
+
+    def test_with_spec(self):
+        ca      = self.intermediates[0]
+        pending = ca.with_spec(roles=[], policies=[])
+
+        self.assertIsInstance(pending, resources.IntermediateCAManifest)
+        self.assertEqual(pending['spec']['roles'], [])
+        self.assertEqual(pending['spec']['crl'], ca['spec']['crl'])
+        self.assertNotEqual(ca['spec']['roles'], [])
+
+    def test_with_spec_shares_values(self):
+        ca      = self.intermediates[0]
+        pending = ca.with_spec(policies=[])
+
+        # frozen values are shared rather than copied, as a CA can hold thousands of roles
+        self.assertIs(pending['spec']['roles'], ca['spec']['roles'])
+        self.assertIs(resources.freeze(ca), ca)
@@ -0,0 +1,71 @@
+from email.utils import formatdate
+from pkictl import retry
+from pkictl.retry import AdaptiveLimiter
+import threading
+import time
+import unittest
+
+
+class TestRetry(unittest.TestCase):
+    def test_backoff_delay(self):
+        for attempt in range(10):
+            delay = retry.backoff_delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(retry.BACKOFF_CAP, retry.BACKOFF_BASE * 2 ** attempt))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(retry.parse_retry_after('3'), 3.0)
+        self.assertEqual(retry.parse_retry_after('-1'), 0.0)
+        self.assertEqual(retry.parse_retry_after('3600'), retry.RETRY_AFTER_CAP)
+        self.assertIsNone(retry.parse_retry_after(None))
+        self.assertIsNone(retry.parse_retry_after('soon'))
+
+        seconds = retry.parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+        self.assertTrue(25 <= seconds <= 30)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_aimd(self):
+        limiter = AdaptiveLimiter(8, cooldown=0)
+
+        limiter.on_pressure()
+        self.assertEqual(limiter.limit, 4)
+        limiter.on_pressure()
+        limiter.on_pressure()
+        limiter.on_pressure()
+        self.assertEqual(limiter.limit, 1)
+
+        for _ in range(100):
+            limiter.on_success()
+        self.assertEqual(limiter.limit, 8)
+
+    def test_cooldown(self):
+        limiter = AdaptiveLimiter(8, cooldown=60)
+
+        # a burst of rejections only halves the limit once
+        for _ in range(5):
+            limiter.on_pressure()
+        self.assertEqual(limiter.limit, 4)
+
+    def test_limits_inflight(self):
+        limiter = AdaptiveLimiter(4, cooldown=0)
+        limiter.on_pressure()
+
+        lock, inflight = threading.Lock(), [0, 0]
+
+        def work():
+            with limiter:
+                with lock:
+                    inflight[0] += 1
+                    inflight[1] = max(inflight)
+                time.sleep(0.005)
+                with lock:
+                    inflight[0] -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertLessEqual(inflight[1], 2)
@@ -0,0 +1,178 @@
+from helper import PKI_MANIFEST_YAML, capture_stdout
+from pkictl import rotate, utils
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+# self-signed certificates valid from 2020 until 2030 (UTCTime) and 2060 (GeneralizedTime)
+CERT_2030 = """-----BEGIN CERTIFICATE-----
+MIIBHzCBxqADAgECAgID6DAKBggqhkjOPQQDAjAZMRcwFQYDVQQDDA5wa2ljdGwg
+dGVzdCBDQTAeFw0yMDAxMDEwMDAwMDBaFw0zMDAxMDEwMDAwMDBaMBkxFzAVBgNV
+BAMMDnBraWN0bCB0ZXN0IENBMFkwEwYHKoZIzj0CAQYIKoZIzj0DAQcDQgAEKRqb
+Yv6dlf+J2rUUi5n10pq6RVmyhyw+iQARClJTsRdg8RsLfMuudxAishsrukQU9hQd
+0Lzi33Iwt2PB6fiUoTAKBggqhkjOPQQDAgNIADBFAiEA5TF4vQbhh8m1eESuD5aT
+uquYyZ53lVjoAuRBQsYtG/oCIB0A1wT0FW/15dCr6d0JFz8/wyo5NojgVBDcDKZs
+iDoe
+-----END CERTIFICATE-----
+"""
+
+CERT_2060 = """-----BEGIN CERTIFICATE-----
+MIIBIDCByKADAgECAgID6DAKBggqhkjOPQQDAjAZMRcwFQYDVQQDDA5wa2ljdGwg
+dGVzdCBDQTAgFw0yMDAxMDEwMDAwMDBaGA8yMDYwMDEwMTAwMDAwMFowGTEXMBUG
+A1UEAwwOcGtpY3RsIHRlc3QgQ0EwWTATBgcqhkjOPQIBBggqhkjOPQMBBwNCAAQp
+Gpti/p2V/4natRSLmfXSmrpFWbKHLD6JABEKUlOxF2DxGwt8y653ECKyGyu6RBT2
+FB3QvOLfcjC3Y8Hp+JShMAoGCCqGSM49BAMCA0cAMEQCIHvGRYEl6UsKjBA+dzBB
+NEckHy2nCyhy6qoImt+88v5AAiBeIZW+SEuagz+E3txTY4YKqFvK0KmH60Sa64P7
+lkeTUA==
+-----END CERTIFICATE-----
+"""
+
+UTC = datetime.timezone.utc
+
+
+class FakeVaultClient:
+    """ serves a certificate per CA, and issues certificates valid until 2060 to the CAs it rotates """
+
+    def __init__(self, certificates, version='1.13.1'):
+        self.baseurl      = 'https://localhost:8200'
+        self.certificates = dict(certificates)
+        self.version      = version
+        self.calls        = []
+
+    def read_version(self):
+        return self.version
+
+    def read_ca_certificate(self, name):
+        return self.certificates.get(name)
+
+    def map_concurrently(self, func, items):
+        return [func(i) for i in items]
+
+    def use_keygen(self, keygen):
+        self.keygen = keygen
+
+    def create_intermediate_ca(self, ca):
+        self.calls.append(('create', ca.name))
+
+    def sign_intermediate_ca(self, ca):
+        self.calls.append(('sign', ca.name))
+
+    def set_intermediate_ca(self, ca):
+        self.calls.append(('set', ca.name))
+        self.certificates[ca.name] = CERT_2060
+        return [f"issuer-{ca.name}"]
+
+    def set_default_issuer(self, ca, issuer):
+        self.calls.append(('default', issuer))
+
+    def store_ca_private_key(self, ca):
+        self.calls.append(('store', ca.name))
+
+
+class TestRotate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache  = os.path.join(self.tmpdir.name, 'cache.json')
+
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        self.roots, self.intermediates, _ = utils.get_validated_manifests(documents)
+
+        # every CA is valid until 2060 but the staging CA, whose certificate expires in 2030
+        names = [ca['metadata']['name'] for ca in self.roots + self.intermediates]
+        self.certificates = {name: CERT_2060 for name in names}
+        self.certificates['pki/intermediate-ca-staging'] = CERT_2030
+
+        # the threshold that takes in the certificates that expire in 2030
+        self.threshold = (datetime.datetime(2031, 1, 1, tzinfo=UTC) - datetime.datetime.now(UTC)).days
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_parse_validity(self):
+        self.assertEqual(rotate.parse_validity(CERT_2030), (datetime.datetime(2020, 1, 1, tzinfo=UTC), datetime.datetime(2030, 1, 1, tzinfo=UTC)))
+
+        # the first certificate of a chain is the one of the CA
+        self.assertEqual(rotate.parse_validity(CERT_2060 + CERT_2030)[1], datetime.datetime(2060, 1, 1, tzinfo=UTC))
+
+        for invalid in ["", "-----BEGIN CERTIFICATE-----\nMIIB\n-----END CERTIFICATE-----", CERT_2030.replace('MIIBHzCBxqAD', 'MIIBHzCBxqBD')]:
+            with self.assertRaises(ValueError):
+                rotate.parse_validity(invalid)
+
+    def test_validity_cache(self):
+        cache = rotate.ValidityCache(self.cache)
+        cache.validity(CERT_2030)
+        cache.validity(CERT_2030)
+        cache.save()
+        self.assertEqual(cache.parsed, 1)
+
+        # later scans read the validity from the cache instead of parsing the certificate
+        cache = rotate.ValidityCache(self.cache)
+        self.assertEqual(cache.validity(CERT_2030)[1], datetime.datetime(2030, 1, 1, tzinfo=UTC))
+        self.assertEqual(cache.parsed, 0)
+
+        with open(self.cache, 'w') as f:
+            f.write("not json")
+        self.assertEqual(rotate.ValidityCache(self.cache).entries, {})
+
+    def test_plan_rotation(self):
+        levels   = utils.get_intermediate_ca_levels(self.intermediates, self.roots)
+        validity = {name: rotate.parse_validity(pem) for name, pem in self.certificates.items()}
+
+        pending = rotate.plan_rotation(levels, validity, datetime.datetime(2031, 1, 1, tzinfo=UTC))
+
+        # the CAs issued by a rotated CA follow it, a level later
+        self.assertEqual([[ca['metadata']['name'] for ca in level] for level in pending], [['pki/intermediate-ca-staging'], ['pki/intermediate-ca-dev']])
+        self.assertEqual(rotate.plan_rotation(levels, validity, datetime.datetime(2029, 1, 1, tzinfo=UTC)), [])
+
+    def test_rotate_cas(self):
+        vault_client = FakeVaultClient(self.certificates)
+
+        with capture_stdout(rotate.rotate_cas, vault_client, self.roots, self.intermediates, self.threshold, self.cache) as output:
+            pass
+
+        self.assertEqual(vault_client.calls, [
+            ('create', 'pki/intermediate-ca-staging'), ('sign', 'pki/intermediate-ca-staging'), ('set', 'pki/intermediate-ca-staging'),
+            ('default', 'issuer-pki/intermediate-ca-staging'), ('store', 'pki/intermediate-ca-staging'),
+            ('create', 'pki/intermediate-ca-dev'), ('sign', 'pki/intermediate-ca-dev'), ('set', 'pki/intermediate-ca-dev'),
+            ('default', 'issuer-pki/intermediate-ca-dev'), ('store', 'pki/intermediate-ca-dev')
+        ])
+        self.assertIn("Scanned the certificates of 5 CAs", output)
+        self.assertIn("CA 'pki/intermediate-ca-staging' expires on 2030-01-01 00:00 UTC", output)
+        self.assertIn("Rotated intermediate CA 'pki/intermediate-ca-dev', which now expires on 2060-01-01 00:00 UTC", output)
+
+        with open(self.cache) as f:
+            self.assertEqual(len(json.load(f)['certificates']), 2)
+
+    def test_rotate_cas_dry_run(self):
+        vault_client = FakeVaultClient(self.certificates)
+
+        with capture_stdout(rotate.rotate_cas, vault_client, self.roots, self.intermediates, self.threshold, None, dry_run=True) as output:
+            pass
+
+        self.assertEqual(vault_client.calls, [])
+        self.assertIn("Would rotate intermediate CA 'pki/intermediate-ca-dev', which was issued by a rotated CA", output)
+
+    def test_rotate_cas_old_vault(self):
+        vault_client = FakeVaultClient(self.certificates, version='1.0.3')
+
+        with self.assertRaises(SystemExit) as e:
+            with capture_stdout(rotate.rotate_cas, vault_client, self.roots, self.intermediates, self.threshold, None):
+                pass
+
+        # the CAs are left alone, as generating a new key in the mount would interrupt issuance
+        self.assertEqual(vault_client.calls, [])
+        self.assertIn("Rotating intermediate CAs in place requires Vault 1.11 or later, the Vault server runs 1.0.3", e.exception.args[0])
+
+        self.assertEqual(rotate.parse_version('1.11.0+ent'), (1, 11))
+        with self.assertRaises(ValueError):
+            rotate.parse_version('')
+
+    def test_rotate_cas_missing_ca(self):
+        del self.certificates['pki/intermediate-ca-dev']
+
+        with self.assertRaises(SystemExit) as e:
+            with capture_stdout(rotate.rotate_cas, FakeVaultClient(self.certificates), self.roots, self.intermediates, self.threshold, None):
+                pass
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: CAs have not been generated yet: pki/intermediate-ca-dev")
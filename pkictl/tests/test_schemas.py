@@ -118,6 +118,9 @@ class TestSchemas(unittest.TestCase):
 
         self.assertIsInstance(schemas.IntermediateCASchema(test_data), dict)
 
+        test_data['spec']['type'] = 'local'
+        self.assertIsInstance(schemas.IntermediateCASchema(test_data), dict)
+
     def test_intermediate_schema_invalid(self):
 
         test_data = {
@@ -139,20 +142,20 @@ class TestSchemas(unittest.TestCase):
 
     def test_schema_from_file(self):
         with open(ROOT_MANIFEST_YAML) as f:
-            test_data = yaml.load(f.read())
+            test_data = yaml.load(f.read(), Loader=yaml.SafeLoader)
             self.assertIsInstance(schemas.RootCASchema(test_data), dict)
 
         with open(INTERMEDIATE_MANIFEST_YAML) as f:
-            test_data = yaml.load(f.read())
+            test_data = yaml.load(f.read(), Loader=yaml.SafeLoader)
             self.assertIsInstance(schemas.IntermediateCASchema(test_data), dict)
 
         with open(KV_MANIFEST_YAML) as f:
-            test_data = yaml.load(f.read())
+            test_data = yaml.load(f.read(), Loader=yaml.SafeLoader)
             self.assertIsInstance(schemas.KeyValueSchema(test_data), dict)
 
     def test_schema_from_multidoc_file(self):
         with open('pkictl/tests/manifests/pki.yaml') as f:
-            documents = yaml.load_all(f.read())
+            documents = yaml.load_all(f.read(), Loader=yaml.SafeLoader)
 
             for document in documents:
                 schema_type = document.get('kind', None)
@@ -198,3 +201,44 @@ class TestSchemas(unittest.TestCase):
 
         with self.assertRaises(voluptuous.MultipleInvalid):
             self.assertIsInstance(schemas.KeyValueSchema(test_data), dict)
+
+    def test_validate_roles_matches_schema(self):
+        with open(INTERMEDIATE_MANIFEST_YAML, 'r') as f:
+            roles = yaml.load(f, Loader=yaml.SafeLoader)['spec']['roles']
+
+        self.assertEqual(schemas.validate_roles(roles), schemas.RolesSchema(roles))
+
+    def test_validate_roles_invalid(self):
+        role = {'name': 'server', 'config': {'max_ttl': '1h', 'server_flag': True, 'client_flag': False}}
+
+        invalid = [
+            ({'name': 'server'}, [0, 'config'], "required key not provided"),
+            ({'name': 'Server', 'config': role['config']}, [0, 'name'], "Must be lowercase alphanumberic string"),
+            (dict(role, config=dict(role['config'], ttl='1y')), [0, 'config', 'ttl'], None),
+            (dict(role, config=dict(role['config'], ttl='1h30')), [0, 'config', 'ttl'], None),
+            (dict(role, config=dict(role['config'], max_ttl='1hour')), [0, 'config', 'max_ttl'], None),
+            (dict(role, config=dict(role['config'], no_store='yes')), [0, 'config', 'no_store'], "expected bool"),
+            (dict(role, config=dict(role['config'], allowed_domains=['-example.com'])), [0, 'config', 'allowed_domains', 0], None),
+            (dict(role, config=dict(role['config'], key_type='rsa')), [0, 'config', 'key_type'], "extra keys not allowed"),
+        ]
+
+        compound = dict(role, config=dict(role['config'], ttl='1h30m'))
+        self.assertEqual(schemas.validate_roles([compound]), schemas.RolesSchema([compound]))
+
+        for data, path, msg in invalid:
+            with self.assertRaises(voluptuous.MultipleInvalid):
+                schemas.RolesSchema([data])
+
+            with self.assertRaises(voluptuous.Invalid) as e:
+                schemas.validate_roles([data])
+            self.assertEqual(e.exception.path, path)
+            if msg:
+                self.assertEqual(e.exception.msg, msg)
+
+    def test_validate_policies(self):
+        policies = [{'name': 'intermediate-ca-server-policy', 'policy': 'path "*" {}'}]
+        self.assertEqual(schemas.validate_policies(policies), schemas.PoliciesSchema(policies))
+
+        with self.assertRaises(voluptuous.Invalid) as e:
+            schemas.validate_policies([{'name': 'policy'}])
+        self.assertEqual(e.exception.path, [0, 'policy'])
@@ -0,0 +1,227 @@
+from helper import PKI_MANIFEST_YAML
+from pkictl import pkictl, resources, utils
+from pkictl.cli import cli
+from pkictl.state import VaultState
+from pkictl.statefile import StateFile, content_hash
+from pkictl.vault import VaultClient
+from argparse import Namespace
+from unittest.mock import MagicMock, patch
+import json
+import os
+import tempfile
+import unittest
+
+
+class TestStateFile(unittest.TestCase):
+    def setUp(self):
+        self.baseurl = "https://localhost:8200"
+        self.tmpdir  = tempfile.TemporaryDirectory()
+        self.path    = os.path.join(self.tmpdir.name, 'state.json')
+
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        self.roots, intermediates, self.kv_engines = utils.get_validated_manifests(documents)
+        self.levels = utils.get_intermediate_ca_levels(intermediates, self.roots)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def apply(self, statefile):
+        roots, levels, kv_engines, digests = statefile.changes(self.roots, self.levels, self.kv_engines)
+        statefile.update(digests)
+        statefile.save()
+        return roots, levels, kv_engines
+
+    def test_content_hash(self):
+        self.assertEqual(content_hash({'a': 1, 'b': [1, 2]}), content_hash({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(content_hash({'a': 1}), content_hash({'a': 2}))
+
+    def test_changes_without_state(self):
+        statefile = StateFile.load(self.path, self.baseurl)
+
+        roots, levels, kv_engines = self.apply(statefile)
+        self.assertEqual(len(roots), 2)
+        self.assertEqual(len(kv_engines), 2)
+        self.assertEqual(sum(len(level) for level in levels), 3)
+
+    def test_changes_unchanged(self):
+        self.apply(StateFile.load(self.path, self.baseurl))
+
+        roots, levels, kv_engines = self.apply(StateFile.load(self.path, self.baseurl))
+        self.assertEqual((roots, levels, kv_engines), ([], [], []))
+
+    def test_changes_other_server(self):
+        self.apply(StateFile.load(self.path, self.baseurl))
+
+        roots, levels, kv_engines = self.apply(StateFile.load(self.path, "https://vault.example.com"))
+        self.assertEqual(len(roots), 2)
+
+    def test_changes_single_role(self):
+        self.apply(StateFile.load(self.path, self.baseurl))
+
+        ca = resources.thaw(self.levels[-1][0])
+        ca['spec']['roles'][0]['config']['max_ttl'] = '1h'
+        self.levels = self.levels[:-1] + [[resources.validate(ca)] + self.levels[-1][1:]]
+
+        roots, levels, kv_engines = self.apply(StateFile.load(self.path, self.baseurl))
+        self.assertEqual((roots, kv_engines), ([], []))
+        self.assertEqual(len(levels), 1)
+
+        pending = levels[0][0]
+        self.assertEqual(pending['metadata']['name'], ca['metadata']['name'])
+        self.assertEqual(pending['spec']['roles'], [ca['spec']['roles'][0]])
+        self.assertEqual(pending['spec']['policies'], [])
+
+    def test_changes_cascade(self):
+        self.apply(StateFile.load(self.path, self.baseurl))
+
+        # pki/root-ca-2 issues pki/intermediate-ca-staging, which issues pki/intermediate-ca-dev
+        self.roots = [resources.thaw(ca) for ca in self.roots]
+        for ca in self.roots:
+            if ca['metadata']['name'] == 'pki/root-ca-2':
+                ca['spec']['ttl'] = '1h'
+        self.roots = [resources.validate(ca) for ca in self.roots]
+
+        statefile = StateFile.load(self.path, self.baseurl)
+
+        roots, levels, _, _ = statefile.changes(self.roots, self.levels, self.kv_engines)
+        self.assertEqual([ca['metadata']['name'] for ca in roots], ['pki/root-ca-2'])
+        self.assertEqual(levels, [])
+
+        roots, levels, _, _ = statefile.changes(self.roots, self.levels, self.kv_engines, cascade=True)
+        self.assertEqual([[ca['metadata']['name'] for ca in level] for level in levels], [['pki/intermediate-ca-staging'], ['pki/intermediate-ca-dev']])
+        for ca in levels[0] + levels[1]:
+            self.assertEqual((ca['spec']['roles'], ca['spec']['policies']), ([], []))
+
+    def test_refresh(self):
+        self.apply(StateFile.load(self.path, self.baseurl))
+
+        statefile = StateFile.load(self.path, self.baseurl)
+        statefile.clear()
+        roots, _, _ = self.apply(statefile)
+        self.assertEqual(len(roots), 2)
+
+    def test_prune(self):
+        statefile = StateFile.load(self.path, self.baseurl)
+        statefile.entries['KV:kv/removed'] = 'abc'
+
+        _, _, _, digests = statefile.changes(self.roots, self.levels, self.kv_engines)
+        self.assertEqual(statefile.update(digests), 0)
+        self.assertIn('KV:kv/removed', statefile.entries)
+
+        self.assertEqual(statefile.update(digests, prune=True), 1)
+        self.assertNotIn('KV:kv/removed', statefile.entries)
+
+    def test_for_server(self):
+        statefile = StateFile.load(self.path, self.baseurl)
+        other     = statefile.for_server("https://vault.example.com")
+
+        self.apply(other)
+        self.assertEqual(statefile.entries, {})
+        self.assertIs(statefile.servers, other.servers)
+
+        with open(self.path) as f:
+            data = json.load(f)
+        self.assertEqual(data['servers']["https://vault.example.com"], other.entries)
+
+    def test_load_invalid(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+
+        with self.assertRaises(SystemExit) as e:
+            StateFile.load(self.path, self.baseurl)
+        self.assertEqual(e.exception.args[0], f"[-] pkictl - Error: failed to parse state file, invalid JSON: {self.path}")
+
+    def test_save(self):
+        self.apply(StateFile.load(self.path, self.baseurl))
+
+        with open(self.path) as f:
+            data = json.load(f)
+        self.assertEqual(data['version'], 1)
+        self.assertIn('RootCA:pki/root-ca-1', data['servers'][self.baseurl])
+        self.assertEqual(os.listdir(self.tmpdir.name), ['state.json'])
+
+    def test_apply_early(self):
+        statefile    = StateFile.load(self.path, self.baseurl)
+        vault_client = MagicMock(baseurl=self.baseurl, state=None)
+        vault_client.read_mounts.return_value = {'pki/root-ca-1': {}}
+        vault_client.read_ca_certificate.return_value = '-----BEGIN CERTIFICATE-----'
+        vault_client.use_snapshot.side_effect = lambda state: setattr(vault_client, 'state', state)
+
+        args = Namespace(file=PKI_MANIFEST_YAML, sequential=False, concurrency=2)
+
+        with patch('pkictl.pkictl.check_vault_server'), patch('pkictl.pkictl.apply_kv_engine') as kv, patch('pkictl.pkictl.apply_root_ca') as root:
+            roots, intermediates, kv_engines, applied = pkictl.apply_early(vault_client, args, statefile)
+
+        # the KV engines and Root CAs are applied as they are read, and the intermediate CAs are left for the full apply
+        self.assertEqual((len(roots), len(intermediates), len(kv_engines), applied), (2, 3, 2, 4))
+        self.assertEqual((kv.call_count, root.call_count), (2, 2))
+        self.assertEqual(list(vault_client.state.certificates), ['pki/root-ca-1'])
+        self.assertEqual(statefile.entries['RootCA:pki/root-ca-2'], content_hash(self.roots[1]))
+
+        # the remaining changes are the intermediate CAs alone
+        roots, levels, kv_engines, _ = statefile.changes(roots, utils.get_intermediate_ca_levels(intermediates, roots), kv_engines)
+        self.assertEqual((roots, kv_engines, sum(len(level) for level in levels)), ([], [], 3))
+
+        vault_client.state = None
+        with patch('pkictl.pkictl.apply_kv_engine') as kv, patch('pkictl.pkictl.apply_root_ca') as root:
+            _, _, _, applied = pkictl.apply_early(vault_client, args, statefile)
+        self.assertEqual((applied, kv.call_count, root.call_count), (0, 0, 0))
+
+    def test_apply_documents_refresh(self):
+        statefile = StateFile.load(self.path, self.baseurl)
+        self.apply(statefile)
+        statefile.clear()
+
+        # the ttl of the server role of the dev CA is edited after the last apply
+        intermediates = [resources.thaw(ca) for level in self.levels for ca in level]
+        dev = next(ca for ca in intermediates if ca['metadata']['name'] == 'pki/intermediate-ca-dev')
+        dev['spec']['roles'][1]['config']['ttl'] = '1h'
+        intermediates = [resources.validate(ca) for ca in intermediates]
+
+        # Vault lists every role and policy but the client role of the dev CA, which was deleted behind pkictl's back
+        state = VaultState()
+        state.certificates = {ca['metadata']['name']: 'PEM' for ca in self.roots + intermediates}
+        state.roles = {ca['metadata']['name']: dict.fromkeys(r['name'] for r in ca['spec']['roles']) for ca in intermediates}
+        state.policies = dict.fromkeys(p['name'] for ca in intermediates for p in ca['spec']['policies'])
+        del state.roles['pki/intermediate-ca-dev']['client']
+
+        vault_client = VaultClient(baseurl=self.baseurl)
+        vault_client.read_role   = MagicMock(return_value={'ttl': 24 * 3600})
+        vault_client.read_policy = MagicMock()
+        args = Namespace(overwrite=False, sequential=True, keygen_workers=None, prune=False)
+
+        with patch('pkictl.pkictl.check_vault_server'), patch('pkictl.pkictl.apply_manifests') as apply, \
+                patch.object(VaultState, 'snapshot', return_value=state):
+            pkictl.apply_documents(vault_client, args, statefile, self.roots, intermediates, self.kv_engines, warm=False)
+
+        # a refresh keeps the role that was edited and the one missing from Vault, and reads back only the edited one
+        levels = apply.call_args[0][3]
+        pending = {ca['metadata']['name']: ([r['name'] for r in ca['spec']['roles']], ca['spec']['policies']) for level in levels for ca in level}
+        self.assertEqual(pending.pop('pki/intermediate-ca-dev'), (['client', 'server'], []))
+        self.assertTrue(all(p == ([], []) for p in pending.values()))
+
+        vault_client.read_role.assert_called_once_with('pki/intermediate-ca-dev', 'server')
+        vault_client.read_policy.assert_not_called()
+
+    def test_apply_invalid_manifest(self):
+        with open(PKI_MANIFEST_YAML) as f:
+            manifests = f.read()
+
+        # a second definition of a Root CA in a later file, after KV engines and Root CAs that would be applied early
+        directory = os.path.join(self.tmpdir.name, 'manifests')
+        os.mkdir(directory)
+        with open(os.path.join(directory, 'a.yaml'), 'w') as f:
+            f.write(manifests)
+        with open(os.path.join(directory, 'b.yaml'), 'w') as f:
+            f.write(manifests.split('---\n')[1])
+
+        os.environ['VAULT_TOKEN'] = 'token'
+        self.addCleanup(os.environ.pop, 'VAULT_TOKEN')
+        args = cli().parse_args(['apply', '-u', self.baseurl, '-f', directory, '--state-file', self.path])
+
+        with patch('pkictl.vault.VaultClient') as client, self.assertRaises(SystemExit) as e:
+            pkictl.run_subcommand(args, verify_ssl=True)
+
+        # nothing is written to Vault before every manifest is validated
+        self.assertIn("defined more than once", e.exception.args[0])
+        self.assertEqual(client.return_value.method_calls, [])
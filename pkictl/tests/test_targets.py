@@ -0,0 +1,134 @@
+from helper import PKI_MANIFEST_YAML, capture_stdout
+from pkictl import pkictl, targets
+from pkictl.cli import cli
+from unittest.mock import patch
+import os
+import tempfile
+import unittest
+
+
+class TestTargets(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path   = os.path.join(self.tmpdir.name, 'targets.yaml')
+        os.environ['VAULT_TOKEN'] = 'default-token'
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        for name in ('VAULT_TOKEN', 'TARGET_TOKEN', 'VAULT_SKIP_VERIFY'):
+            os.environ.pop(name, None)
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def test_read_targets(self):
+        os.environ['TARGET_TOKEN'] = 'env-token'
+        self.write("""
+- name: us-east-1
+  url: https://vault.us-east-1.example.com:8200
+  token: literal-token
+- name: eu-west-1
+  url: https://vault.eu-west-1.example.com:8200
+  token_env: TARGET_TOKEN
+  ca_cert: /etc/ssl/vault-ca.pem
+- name: dev
+  url: https://localhost:8200
+  tls_skip_verify: true
+""")
+        r = targets.read_targets(self.path)
+        self.assertEqual([t.name for t in r], ['us-east-1', 'eu-west-1', 'dev'])
+        self.assertEqual([t.token for t in r], ['literal-token', 'env-token', 'default-token'])
+        self.assertEqual([t.verify_ssl for t in r], [True, '/etc/ssl/vault-ca.pem', False])
+
+    def test_read_targets_tls_default(self):
+        self.write("""
+- name: a
+  url: https://a:8200
+- name: b
+  url: https://b:8200
+  tls_skip_verify: false
+- name: c
+  url: https://c:8200
+  ca_cert: /etc/ssl/vault-ca.pem
+""")
+        # the targets without TLS settings of their own take the ones of the command line
+        r = targets.read_targets(self.path, verify_ssl=False)
+        self.assertEqual([t.verify_ssl for t in r], [False, True, '/etc/ssl/vault-ca.pem'])
+
+    def test_read_targets_invalid(self):
+        cases = [
+            ("- name: a\n  url: https://a\n- name: a\n  url: https://b\n", "target name defined more than once: a"),
+            ("- name: a\n  url: https://a\n- name: b\n  url: https://a/\n", "target URL defined more than once: https://a"),
+            ("- name: a\n  url: vault:8200\n", "invalid targets file"),
+            ("- name: a\n  url: https://a\n  token_env: MISSING_TOKEN\n", "environment variable MISSING_TOKEN not set for target: a"),
+            ("[]", "no targets defined"),
+        ]
+        for text, message in cases:
+            self.write(text)
+            with self.assertRaises(SystemExit) as e:
+                targets.read_targets(self.path)
+            self.assertIn(message, e.exception.code)
+
+    def test_apply_targets(self):
+        self.write("- name: us-east-1\n  url: https://a:8200\n- name: eu-west-1\n  url: https://b:8200\n")
+        args = cli().parse_args(['apply', '-f', PKI_MANIFEST_YAML, '--targets', self.path, '--state-file', os.path.join(self.tmpdir.name, 'state.json')])
+
+        def apply_documents(vault_client, args, statefile, roots, intermediates, kv_engines):
+            self.assertEqual(statefile.vault_addr, vault_client.baseurl)
+            if vault_client.baseurl == 'https://b:8200':
+                raise SystemExit("[-] pkictl - Error: Vault is sealed")
+            return len(roots)
+
+        with patch('pkictl.pkictl.apply_documents', side_effect=apply_documents), patch('pkictl.targets.print_report') as report:
+            with self.assertRaises(SystemExit) as e:
+                pkictl.apply_targets(args)
+        self.assertEqual(e.exception.code, 1)
+
+        # the failure of one target does not affect the other
+        results = report.call_args[0][0]
+        self.assertEqual([(r.target.name, r.applied, r.error) for r in results], [('us-east-1', 2, None), ('eu-west-1', 0, 'Vault is sealed')])
+
+        with capture_stdout(targets.print_report, results) as output:
+            lines = output.splitlines()
+        self.assertIn("Applied the manifests to 1 of 2 Vault clusters", lines[0])
+        self.assertTrue(lines[1].startswith("[*] pkictl - us-east-1  https://a:8200  applied 2 resources"))
+        self.assertTrue(lines[2].startswith("[-] pkictl - Error: eu-west-1  https://b:8200  failed: Vault is sealed"))
+
+    def test_make_client(self):
+        args = cli().parse_args(['tidy', '-u', 'https://localhost:8200', '-f', PKI_MANIFEST_YAML, '--max-retries', '2'])
+
+        client = pkictl.make_client(args, False, pool_size=args.concurrency)
+        self.assertEqual((client.baseurl, client.token, client.verify_ssl, client.max_retries), ('https://localhost:8200', 'default-token', False, 2))
+
+        # a target brings its own URL and token, and init runs before Vault has any token
+        client = pkictl.make_client(args, True, baseurl='https://a:8200', token='a-token')
+        self.assertEqual((client.baseurl, client.token), ('https://a:8200', 'a-token'))
+        self.assertIsNone(pkictl.make_client(cli().parse_args(['init']), True, authenticated=False).token)
+
+    def test_apply_targets_tls_skip_verify(self):
+        self.write("- name: a\n  url: https://a:8200\n- name: b\n  url: https://b:8200\n  tls_skip_verify: false\n")
+        os.environ['VAULT_SKIP_VERIFY'] = 'true'
+        argv = ['pkictl', 'apply', '-f', PKI_MANIFEST_YAML, '--targets', self.path, '--state-file', os.path.join(self.tmpdir.name, 'state.json')]
+
+        verify_ssl = {}
+
+        def apply_documents(vault_client, args, statefile, roots, intermediates, kv_engines):
+            verify_ssl[vault_client.baseurl] = vault_client.verify_ssl
+            return 0
+
+        # the log level of the other tests is left alone
+        with patch('sys.argv', argv), patch('pkictl.events.log.configure'), \
+                patch('pkictl.pkictl.apply_documents', side_effect=apply_documents), patch('pkictl.targets.print_report'):
+            pkictl.main()
+
+        # VAULT_SKIP_VERIFY applies to the target without TLS settings, the other one keeps its own
+        self.assertEqual(verify_ssl, {'https://a:8200': False, 'https://b:8200': True})
+
+    def test_apply_targets_plan(self):
+        self.write("- name: a\n  url: https://a\n")
+        args = cli().parse_args(['apply', '--plan', 'plan.json', '--targets', self.path])
+
+        with self.assertRaises(SystemExit) as e:
+            pkictl.apply_targets(args)
+        self.assertIn("--plan cannot be used with --targets", e.exception.code)
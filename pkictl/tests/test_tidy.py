@@ -0,0 +1,114 @@
+from helper import PKI_MANIFEST_YAML, capture_stdout
+from pkictl import tidy, utils
+from pkictl.vault import VaultClient
+from unittest.mock import MagicMock
+import threading
+import unittest
+
+
+class FakeTidies:
+    """ runs each tidy for a number of status polls, tracking how many run at once """
+
+    def __init__(self, polls=2, removed=100, states=None, errors=None, rejected=()):
+        self.polls    = polls
+        self.removed  = removed
+        self.states   = states or {}
+        self.errors   = errors or {}
+        self.rejected = rejected
+        self.running  = {}
+        self.started  = []
+        self.peak     = 0
+        self.lock     = threading.Lock()
+
+    def tidy(self, name, safety_buffer, pause_duration=None):
+        if name in self.rejected:
+            utils.exit_with_message(f"Failed to start tidying CA: {name}")
+
+        with self.lock:
+            self.started.append(name)
+            self.running[name] = self.polls
+            self.peak = max(self.peak, len(self.running))
+
+    def read_tidy_status(self, name):
+        with self.lock:
+            if name not in self.running:
+                return {'state': self.states.get(name, 'Inactive')}
+
+            self.running[name] -= 1
+            if self.running[name] >= 0:
+                return {'state': 'Running', 'cert_store_deleted_count': 0}
+            del self.running[name]
+            if name in self.errors:
+                return {'state': 'Error', 'error': self.errors[name]}
+            return {'state': 'Finished', 'cert_store_deleted_count': self.removed, 'revoked_cert_deleted_count': 1}
+
+
+class TestTidy(unittest.TestCase):
+    def setUp(self):
+        self.vault_client = MagicMock(spec=VaultClient)
+        self.vault_client.baseurl = "https://localhost:8200"
+
+        documents = list(utils.iter_manifests(PKI_MANIFEST_YAML))
+        self.roots, self.intermediates, _ = utils.get_validated_manifests(documents)
+        self.names = [ca['metadata']['name'] for ca in self.roots + self.intermediates]
+
+    def use(self, tidies):
+        self.vault_client.tidy.side_effect             = tidies.tidy
+        self.vault_client.read_tidy_status.side_effect = tidies.read_tidy_status
+        return tidies
+
+    def test_tidy_cas(self):
+        tidies = self.use(FakeTidies())
+
+        with capture_stdout(tidy.tidy_cas, self.vault_client, self.roots, self.intermediates, concurrency=2, interval=0) as output:
+            pass
+
+        # the tidies start in the order of the manifests, never more than two at once
+        self.assertEqual(tidies.started, self.names)
+        self.assertEqual(tidies.peak, 2)
+        self.assertIn("Tidied CA 'pki/intermediate-ca-dev' in ", output)
+        self.assertIn("removed 100 certificates and 1 revoked certificates", output)
+        self.assertIn(f"Tidied {len(self.names)} CAs in ", output)
+        self.assertIn(f"removed {100 * len(self.names)} certificates and {len(self.names)} revoked certificates", output)
+
+        self.vault_client.tidy.assert_any_call('pki/root-ca-1', '72h', None)
+
+    def test_tidy_cas_already_running(self):
+        tidies = self.use(FakeTidies(states={'pki/root-ca-1': 'Running'}))
+        tidies.running['pki/root-ca-1'] = 1
+
+        with capture_stdout(tidy.tidy_cas, self.vault_client, self.roots, self.intermediates, interval=0) as output:
+            pass
+
+        # the tidy that was already running is waited for instead of starting another one
+        self.assertNotIn('pki/root-ca-1', tidies.started)
+        self.assertIn("Waiting for the tidy already running on CA: pki/root-ca-1", output)
+        self.assertIn("Tidied CA 'pki/root-ca-1' in ", output)
+
+    def test_tidy_cas_no_status(self):
+        self.vault_client.read_tidy_status.return_value = None
+
+        with capture_stdout(tidy.tidy_cas, self.vault_client, self.roots, [], interval=0) as output:
+            pass
+
+        self.assertEqual(self.vault_client.tidy.call_count, 2)
+        self.assertIn("Started tidying CA 'pki/root-ca-1', the Vault server does not report its progress", output)
+
+    def test_tidy_cas_failed(self):
+        tidies = self.use(FakeTidies(errors={'pki/intermediate-ca-dev': 'storage is unavailable'}, rejected=['pki/root-ca-1']))
+
+        with self.assertRaises(SystemExit) as e:
+            with capture_stdout(tidy.tidy_cas, self.vault_client, self.roots, self.intermediates, interval=0):
+                pass
+
+        # every other CA is still tidied
+        self.assertEqual(tidies.started, self.names[1:])
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: Failed to tidy 2 CAs")
+
+    def test_tidy_result(self):
+        failed = tidy.TidyResult('pki/root-ca-1', 1.0, {'state': 'Error'}, error="Failed to tidy CA 'pki/root-ca-1': storage is unavailable")
+        self.assertFalse(failed.succeeded)
+        self.assertEqual(failed.message(), "Failed to tidy CA 'pki/root-ca-1': storage is unavailable")
+
+        tidied = tidy.TidyResult('pki/root-ca-1', 1.25, {'state': 'Finished', 'cert_store_deleted_count': 3, 'revoked_cert_deleted_count': None})
+        self.assertEqual(tidied.message(), "Tidied CA 'pki/root-ca-1' in 1.2s, removed 3 certificates and 0 revoked certificates")
@@ -1,7 +1,6 @@
 from helper import capture_stdout
 from helper import ROOT_MANIFEST_YAML, PKI_MANIFEST_YAML
 from pkictl import utils
-from distutils.util import strtobool
 from unittest.mock import patch, MagicMock
 import io
 import os
@@ -24,6 +23,22 @@ class TestUtils(unittest.TestCase):
         with capture_stdout(utils.output_message, msg=m) as output:
             self.assertEqual(output.strip(), f"[*] pkictl - {m}")
 
+    def test_output_message_target(self):
+        m = "standard output message"
+
+        def output():
+            with utils.output_target('us-east-1'):
+                utils.bind_target(utils.output_message)(m)
+            utils.output_message(m)
+
+        with capture_stdout(output) as output:
+            self.assertEqual(output.splitlines(), [f"[*] pkictl[us-east-1] - {m}", f"[*] pkictl - {m}"])
+
+    def test_error_message(self):
+        self.assertEqual(utils.error_message(SystemExit("[-] pkictl - Error: test error message")), "test error message")
+        self.assertEqual(utils.error_message(SystemExit(1)), "exited with status 1")
+        self.assertEqual(utils.error_message(ValueError()), "ValueError")
+
     def test_exit_with_message(self):
         m = "test error message"
         with self.assertRaises(SystemExit) as e:
@@ -64,13 +79,20 @@ class TestUtils(unittest.TestCase):
         r = utils.get_from_environment(k)
         self.assertEqual(r, v)
 
-        r = strtobool(utils.get_from_environment(k))
+        r = utils.strtobool(utils.get_from_environment(k))
         self.assertEqual(r, False)
 
         os.environ.pop('VAULT_SKIP_VERIFY')
         r = utils.get_from_environment(k)
         self.assertEqual(r, 'False')
 
+    def test_strtobool(self):
+        self.assertEqual([utils.strtobool(v) for v in ('1', 'true', 'Yes', 'ON')], [True] * 4)
+        self.assertEqual([utils.strtobool(v) for v in ('0', 'false', 'No', 'OFF')], [False] * 4)
+
+        with self.assertRaises(ValueError):
+            utils.strtobool('maybe')
+
     def test_get_manifest_files(self):
         with tempfile.TemporaryDirectory() as d:
             with tempfile.NamedTemporaryFile(dir=d, suffix='.yaml'), tempfile.NamedTemporaryFile(dir=d, suffix='.yml'):
@@ -79,31 +101,116 @@ class TestUtils(unittest.TestCase):
                 for filename in r:
                     self.assertTrue(filename.endswith('.yml') or filename.endswith('.yaml'))
 
-    def test_read_manifest_file(self):
-        d = utils.read_manifest_file(ROOT_MANIFEST_YAML)
+    def test_get_manifest_files_recursive(self):
+        with tempfile.TemporaryDirectory() as d:
+            for path in ['b.yaml', 'a.yml', 'notes.txt', 'sub/c.yaml', '.hidden/d.yaml']:
+                os.makedirs(os.path.dirname(os.path.join(d, path)), exist_ok=True)
+                open(os.path.join(d, path), 'w').close()
+
+            r = utils.get_manifest_files(directory=d)
+            self.assertEqual(r, [os.path.join(d, p) for p in ['a.yml', 'b.yaml', 'sub/c.yaml']])
+
+    def test_iter_manifests_parallel(self):
+        with tempfile.TemporaryDirectory() as d:
+            for i in range(utils.PARALLEL_PARSE_THRESHOLD + 4):
+                with open(os.path.join(d, f'{i:03}.yaml'), 'w') as f:
+                    f.write(f"---\nindex: {i}\ndocument: 0\n---\nindex: {i}\ndocument: 1\n---\n")
+
+            documents = list(utils.iter_manifests(d, workers=2))
+
+        expected = [{'index': i, 'document': j} for i in range(utils.PARALLEL_PARSE_THRESHOLD + 4) for j in range(2)]
+        self.assertEqual(documents, expected)
+
+    def test_iter_manifests_parallel_errors(self):
+        with tempfile.TemporaryDirectory() as d:
+            for i in range(utils.PARALLEL_PARSE_THRESHOLD):
+                with open(os.path.join(d, f'{i:03}.yaml'), 'w') as f:
+                    f.write("x: y\n" if i > 1 else "x: y:\n")
+
+            with self.assertRaises(SystemExit) as e:
+                with capture_stdout(lambda: list(utils.iter_manifests(d, workers=2))):
+                    pass
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: failed to read 2 manifest files")
+
+    def test_iter_manifests(self):
+        with tempfile.TemporaryDirectory() as d:
+            for name in ['a.yaml', 'b.yaml', 'c.yaml']:
+                with open(os.path.join(d, name), 'w') as f:
+                    f.write("x: y:\n" if name == 'b.yaml' else f"name: {name}\n")
+
+            documents = utils.iter_manifests(d)
+
+            # the documents are yielded as they are parsed, and the errors are reported once every file has been read
+            self.assertEqual(next(documents), {'name': 'a.yaml'})
+            self.assertEqual(next(documents), {'name': 'c.yaml'})
+            with self.assertRaises(SystemExit) as e:
+                next(documents)
+        self.assertEqual(e.exception.args[0], f"[-] pkictl - Error: failed to parse manifest file, invalid YAML in document 0: {d}/b.yaml")
+
+    def test_iter_manifests_yaml(self):
+        import yaml
+
+        stream = (
+            "base: &base {a: 1, b: [x, y]}\n"
+            "merged:\n  <<: *base\n  a: 2\n"
+            "alias: *base\n"
+            "types: [1, 1.5, true, null, 2020-01-01, '01', 0x10]\n"
+            "set: !!set {a, b}\n"
+            "omap: !!omap [{a: 1}, {b: 2}]\n"
+            "---\n"
+            "--- !!map {nested: [[1, [2, {k: v}]], {}]}\n"
+        )
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'manifest.yaml')
+            with open(path, 'w') as f:
+                f.write(stream)
+
+            # the documents are the ones PyYAML loads, but the empty one
+            self.assertEqual(list(utils.iter_manifests(path)), [document for document in yaml.safe_load_all(stream) if document is not None])
+
+    def test_map_bounded(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        submitted = []
+
+        def items():
+            for i in range(10):
+                submitted.append(i)
+                yield i
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = utils.map_bounded(executor, lambda i: i * 2, items(), 3)
+            self.assertEqual(next(results), 0)
+
+            # only the window of items is submitted ahead of the results being consumed
+            self.assertEqual(submitted, [0, 1, 2, 3])
+            self.assertEqual(list(results), [i * 2 for i in range(1, 10)])
+
+    def test_iter_manifests_file(self):
+        d = list(utils.iter_manifests(ROOT_MANIFEST_YAML))
         self.assertIsInstance(d, list)
 
-    def test_read_manifest_file_nonexistant(self):
+    def test_iter_manifests_nonexistant(self):
         with self.assertRaises(SystemExit) as e:
-            utils.read_manifest_file(path='/manifest.yaml')
-        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: manifest file does not exist")
+            list(utils.iter_manifests('/manifest.yaml'))
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: manifest file does not exist: /manifest.yaml")
 
-    def test_read_manifest_file_invalid_yaml(self):
+    def test_iter_manifests_invalid_yaml(self):
         t = tempfile.NamedTemporaryFile()
-        t.write(b"---\nx: y:\n")
+        t.write(b"---\nx: y\n---\nx: y:\n")
         t.seek(0)
 
         with self.assertRaises(SystemExit) as e:
-            utils.read_manifest_file(path=t.name)
-        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: failed to parse manifest file, invalid YAML")
+            list(utils.iter_manifests(t.name))
+        self.assertEqual(e.exception.args[0], f"[-] pkictl - Error: failed to parse manifest file, invalid YAML in document 1: {t.name}")
 
-    def test_read_manifest_file_permission_denied(self):
+    def test_iter_manifests_permission_denied(self):
         with self.assertRaises(SystemExit) as e:
-            utils.read_manifest_file(path='/etc/shadow')
-        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: failed to read manifest file, permission denied")
+            list(utils.iter_manifests('/etc/shadow'))
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: failed to read manifest file, permission denied: /etc/shadow")
 
     def test_get_validated_manifests(self):
-        d = utils.read_manifest_file(PKI_MANIFEST_YAML)
+        d = list(utils.iter_manifests(PKI_MANIFEST_YAML))
 
         roots, intermediates, kv_engines = utils.get_validated_manifests(d)
 
@@ -167,68 +274,72 @@ class TestUtils(unittest.TestCase):
             with capture_stdout(utils.write_vault_root_token, root_token="testoken", file=t.name, debug=True) as output:
                 self.assertEqual(output.strip(), f"[*] pkictl - Successfully wrote the Vault root token to {t.name}")
 
-    def test_sort_intermediate_certificate_authorities(self):
+    def test_get_intermediate_ca_levels(self):
+        roots = [{'metadata': {'name': 'root-ca'}}]
         intermediates = [
-            {
-                'kind': 'IntermediateCA',
-                'metadata': {
-                    'name': 'blah-ca',
-                    'issuer': 'bar-ca'
-                }
-            },
-            {
-                'kind': 'IntermediateCA',
-                'metadata': {
-                    'name': 'foo-ca',
-                    'issuer': 'root-ca'
-                }
-            },
-            {
-                'kind': 'IntermediateCA',
-                'metadata': {
-                    'name': 'bar-ca',
-                    'issuer': 'foo-ca'
-                }
-            },
-            {
-                'kind': 'IntermediateCA',
-                'metadata': {
-                    'name': 'kungfoo-ca',
-                    'issuer': 'root-ca'
-                }
-            }
+            {'metadata': {'name': 'd-ca', 'issuer': 'c-ca'}},
+            {'metadata': {'name': 'c-ca', 'issuer': 'b-ca'}},
+            {'metadata': {'name': 'b-ca', 'issuer': 'a-ca'}},
+            {'metadata': {'name': 'e-ca', 'issuer': 'root-ca'}},
+            {'metadata': {'name': 'a-ca', 'issuer': 'root-ca'}},
+            {'metadata': {'name': 'f-ca', 'issuer': 'a-ca'}}
         ]
 
-        expected = [
-            {
-                'kind': 'IntermediateCA',
-                'metadata': {
-                    'name': 'kungfoo-ca',
-                    'issuer': 'root-ca'
-                }
-            },
-            {
-                'kind': 'IntermediateCA',
-                'metadata': {
-                    'name': 'foo-ca',
-                    'issuer': 'root-ca'
-                }
-            },
-            {
-                'kind': 'IntermediateCA',
-                'metadata': {
-                    'name': 'bar-ca',
-                    'issuer': 'foo-ca'
-                }
-            },
-            {
-                'kind': 'IntermediateCA',
-                'metadata': {
-                    'name': 'blah-ca',
-                    'issuer': 'bar-ca'
-                }
-            }
+        levels = utils.get_intermediate_ca_levels(intermediates, roots)
+
+        names = [[ca['metadata']['name'] for ca in level] for level in levels]
+        self.assertEqual(names, [['e-ca', 'a-ca'], ['b-ca', 'f-ca'], ['c-ca'], ['d-ca']])
+
+    def test_get_intermediate_ca_levels_cycle(self):
+        intermediates = [
+            {'metadata': {'name': 'a-ca', 'issuer': 'root-ca'}},
+            {'metadata': {'name': 'b-ca', 'issuer': 'c-ca'}},
+            {'metadata': {'name': 'c-ca', 'issuer': 'b-ca'}}
         ]
+        with self.assertRaises(SystemExit) as e:
+            utils.get_intermediate_ca_levels(intermediates)
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: circular issuer chain between intermediate CAs: b-ca, c-ca")
 
-        results = utils.sort_intermediate_certificate_authorities(intermediates)
-        self.assertEqual(expected, results)
+    def test_get_intermediate_ca_levels_dangling_issuer(self):
+        roots = [{'metadata': {'name': 'root-ca'}}]
+        intermediates = [{'metadata': {'name': 'a-ca', 'issuer': 'missing-ca'}}]
+
+        with self.assertRaises(SystemExit) as e:
+            utils.get_intermediate_ca_levels(intermediates, roots)
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: issuer 'missing-ca' not defined for intermediate CA: a-ca")
+
+    def test_get_intermediate_ca_levels_duplicate(self):
+        roots = [{'metadata': {'name': 'root-ca'}}]
+        intermediates = [
+            {'metadata': {'name': 'a-ca', 'issuer': 'root-ca'}},
+            {'metadata': {'name': 'a-ca', 'issuer': 'root-ca'}}
+        ]
+
+        with self.assertRaises(SystemExit) as e:
+            utils.get_intermediate_ca_levels(intermediates, roots)
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: CA defined more than once: a-ca")
+
+    def test_get_intermediate_ca_levels_duplicate_root(self):
+        intermediates = [{'metadata': {'name': 'a-ca', 'issuer': 'root-ca'}}]
+
+        # a second Root CA of the same name would replace the first
+        with self.assertRaises(SystemExit) as e:
+            utils.get_intermediate_ca_levels(intermediates, [{'metadata': {'name': 'root-ca'}}, {'metadata': {'name': 'root-ca'}}])
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: CA defined more than once: root-ca")
+
+        # as would an intermediate CA named like a Root CA
+        with self.assertRaises(SystemExit) as e:
+            utils.get_intermediate_ca_levels(intermediates + [{'metadata': {'name': 'root-ca', 'issuer': 'a-ca'}}], [{'metadata': {'name': 'root-ca'}}])
+        self.assertEqual(e.exception.args[0], "[-] pkictl - Error: CA defined more than once: root-ca")
+
+    def test_duration_to_seconds(self):
+        self.assertEqual(utils.duration_to_seconds('72h'), 259200)
+        self.assertEqual(utils.duration_to_seconds('1h30m'), 5400)
+        self.assertEqual(utils.duration_to_seconds('2h3m4s'), 7384)
+        self.assertEqual(utils.duration_to_seconds('300'), 300)
+        self.assertEqual(utils.duration_to_seconds(300), 300)
+        self.assertIsNone(utils.duration_to_seconds(None))
+
+        for invalid in ['', 'h', '1h30', '1d', '1y', '1.5h', '-1h', '1h 30m']:
+            with self.assertRaises(ValueError):
+                utils.duration_to_seconds(invalid)
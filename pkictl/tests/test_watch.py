@@ -0,0 +1,147 @@
+from helper import ROOT_MANIFEST_YAML, INTERMEDIATE_MANIFEST_YAML, KV_MANIFEST_YAML, capture_stdout
+from pkictl import watch
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+class FakeWatcher:
+    """ returns the given batches of changed paths, then stops the watch like Ctrl-C """
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.closed  = False
+
+    def wait(self, timeout=None):
+        if not self.batches:
+            raise KeyboardInterrupt
+        return self.batches.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path   = os.path.join(self.tmpdir.name, 'manifests')
+        os.mkdir(self.path)
+
+        for manifest in (ROOT_MANIFEST_YAML, INTERMEDIATE_MANIFEST_YAML, KV_MANIFEST_YAML):
+            shutil.copy(manifest, self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def manifest(self, name):
+        return os.path.join(self.path, name)
+
+    def edit(self, name, old, new):
+        with open(self.manifest(name)) as f:
+            text = f.read()
+        with open(self.manifest(name), 'w') as f:
+            f.write(text.replace(old, new))
+
+    def load(self):
+        manifests = watch.ManifestSet(self.path)
+        manifests.load()
+        return manifests
+
+    def test_load(self):
+        roots, intermediates, kv_engines = self.load().resources()
+        self.assertEqual((len(roots), len(intermediates), len(kv_engines)), (1, 1, 1))
+
+    def test_refresh_modified_file(self):
+        manifests = self.load()
+        root = manifests.files[self.manifest('root.yaml')]
+
+        self.edit('intermediate.yaml', 'ttl: 43800h', 'ttl: 4380h')
+        updated = manifests.refresh({self.manifest('intermediate.yaml')})
+
+        self.assertEqual(updated, [self.manifest('intermediate.yaml')])
+        self.assertEqual(manifests.resources()[1][0]['spec']['ttl'], '4380h')
+
+        # files that did not change keep their parsed documents
+        self.assertIs(manifests.files[self.manifest('root.yaml')], root)
+
+    def test_refresh_invalid_file(self):
+        manifests = self.load()
+        previous  = manifests.files[self.manifest('kv.yaml')]
+
+        self.edit('kv.yaml', 'kind: KV', 'kind: Unknown')
+        with capture_stdout(manifests.refresh, {self.manifest('kv.yaml')}) as output:
+            self.assertIn('keeping its previous version', output)
+        self.assertIs(manifests.files[self.manifest('kv.yaml')], previous)
+
+    def test_refresh_removed_and_added_files(self):
+        manifests = self.load()
+
+        os.remove(self.manifest('kv.yaml'))
+        os.mkdir(self.manifest('more'))
+        shutil.copy(KV_MANIFEST_YAML, self.manifest('more'))
+
+        with capture_stdout(manifests.refresh, {self.manifest('kv.yaml'), self.manifest('more')}):
+            pass
+
+        self.assertNotIn(self.manifest('kv.yaml'), manifests.files)
+        self.assertIn(os.path.join(self.manifest('more'), 'kv.yaml'), manifests.files)
+
+        shutil.rmtree(self.manifest('more'))
+        with capture_stdout(manifests.refresh, {self.manifest('more')}):
+            pass
+        self.assertEqual(len(manifests.resources()[2]), 0)
+
+    def test_polling_watcher(self):
+        watcher = watch.PollingWatcher(self.path, interval=0.01)
+
+        self.assertEqual(watcher.wait(timeout=0.05), set())
+
+        self.edit('root.yaml', "ttl: '87600h'", "ttl: '8760h'")
+        os.utime(self.manifest('root.yaml'), ns=(0, 0))
+        self.assertEqual(watcher.wait(timeout=1), {self.manifest('root.yaml')})
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is only available on Linux')
+    def test_inotify_watcher(self):
+        watcher = watch.InotifyWatcher(self.path)
+        try:
+            self.assertEqual(watcher.wait(timeout=0.05), set())
+
+            self.edit('root.yaml', "ttl: '87600h'", "ttl: '8760h'")
+            self.assertEqual(watcher.wait(timeout=1), {self.manifest('root.yaml')})
+
+            # a new directory is reported so that it is read as a whole, and editor swap files are ignored
+            os.mkdir(self.manifest('more'))
+            shutil.copy(KV_MANIFEST_YAML, self.manifest('more'))
+            with open(self.manifest('.root.yaml.swp'), 'w') as f:
+                f.write('swap')
+            self.assertEqual(watcher.wait(timeout=1) - {os.path.join(self.manifest('more'), 'kv.yaml')}, {self.manifest('more')})
+
+            # the new directory is watched as well
+            self.edit(os.path.join('more', 'kv.yaml'), "'168h'", "'24h'")
+            self.assertEqual(watcher.wait(timeout=1), {os.path.join(self.manifest('more'), 'kv.yaml')})
+        finally:
+            watcher.close()
+
+    def test_watch_manifests(self):
+        applied = []
+
+        def apply(roots, intermediates, kv_engines):
+            applied.append(intermediates[0]['spec']['ttl'])
+            if len(applied) == 2:
+                raise SystemExit("[-] pkictl - Error: Vault is unavailable")
+
+        self.edit('intermediate.yaml', 'ttl: 43800h', 'ttl: 4380h')
+        with capture_stdout(watch.watch_manifests, self.path, FakeWatcher([]), apply) as output:
+            self.assertIn('Watching 3 manifest files', output)
+
+        # a failed apply does not stop the watch, and a batch without changes does not apply again
+        self.edit('intermediate.yaml', 'ttl: 4380h', 'ttl: 2190h')
+        watcher = FakeWatcher([{self.manifest('intermediate.yaml')}, set()])
+        with capture_stdout(watch.watch_manifests, self.path, watcher, apply) as output:
+            self.assertIn('apply failed: Vault is unavailable', output)
+            self.assertIn('Stopped watching for changes', output)
+
+        self.assertEqual(applied, ['4380h', '2190h', '2190h'])
+        self.assertTrue(watcher.closed)
@@ -0,0 +1,112 @@
+from .aio import ApplyError, AsyncVaultClient
+from .defaults import DEFAULT_SAFETY_BUFFER, DEFAULT_TIDY_CONCURRENCY, DEFAULT_TIDY_INTERVAL
+from . import utils
+from typing import List, Optional
+import asyncio
+import time
+
+# the states of a tidy that is still going, after which Vault reports Finished, Error or Cancelled
+ACTIVE_STATES = ('Running', 'Cancelling')
+
+
+class TidyResult:
+    def __init__(self, name: str, elapsed: float, status: Optional[dict]=None, error: Optional[str]=None):
+        self.name    = name
+        self.elapsed = elapsed
+        self.status  = status
+        self.error   = error
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    @property
+    def certificates(self) -> int:
+        return (self.status or {}).get('cert_store_deleted_count') or 0
+
+    @property
+    def revoked(self) -> int:
+        return (self.status or {}).get('revoked_cert_deleted_count') or 0
+
+    def message(self) -> str:
+        if self.error is not None:
+            return self.error
+        if self.status is None:
+            return f"Started tidying CA '{self.name}', the Vault server does not report its progress"
+        return f"Tidied CA '{self.name}' in {self.elapsed:.1f}s, removed {self.certificates} certificates and {self.revoked} revoked certificates"
+
+
+async def wait_for_tidy(client: AsyncVaultClient, name: str, interval: float) -> Optional[dict]:
+    """ polls the tidy status of a CA until its tidy is over, sleeping in between so the other CAs are polled meanwhile """
+    while True:
+        status = await client.read_tidy_status(name)
+        if status is None or status.get('state') not in ACTIVE_STATES:
+            return status
+        await asyncio.sleep(interval)
+
+
+async def tidy_ca(client: AsyncVaultClient, running: asyncio.Semaphore, name: str, safety_buffer: str,
+                  pause_duration: Optional[str], interval: float) -> TidyResult:
+    """ tidies a CA once one of the running slots is free, holding the slot until Vault reports the tidy is over """
+    async with running:
+        start = time.perf_counter()
+        try:
+            # a tidy that is already running, such as an auto-tidy, is waited for rather than a second one started behind it
+            status = await client.read_tidy_status(name)
+            if status is not None and status.get('state') in ACTIVE_STATES:
+                utils.output_message(f"Waiting for the tidy already running on CA: {name}")
+            else:
+                await client.tidy(name, safety_buffer, pause_duration)
+
+            status = await wait_for_tidy(client, name, interval)
+        except ApplyError as err:
+            return TidyResult(name, time.perf_counter() - start, error=utils.error_message(SystemExit(*err.args)))
+
+    elapsed = time.perf_counter() - start
+    if status is not None and status.get('state') != 'Finished':
+        reason = status.get('error') or f"the tidy ended in state {status.get('state')}"
+        return TidyResult(name, elapsed, status, error=f"Failed to tidy CA '{name}': {reason}")
+    return TidyResult(name, elapsed, status)
+
+
+async def tidy_all(client: AsyncVaultClient, names: List[str], concurrency: int, safety_buffer: str,
+                   pause_duration: Optional[str], interval: float) -> List[TidyResult]:
+    running = asyncio.Semaphore(concurrency)
+    results = []
+
+    # the tasks are scheduled in the order of the manifests, so the CAs take the running slots in that order
+    tasks = [asyncio.ensure_future(tidy_ca(client, running, name, safety_buffer, pause_duration, interval)) for name in names]
+
+    # the results are output as the tidies finish, which is rarely in the order they started
+    for future in asyncio.as_completed(tasks):
+        result = await future
+        utils.output_message(result.message(), err=not result.succeeded)
+        results.append(result)
+    return results
+
+
+def tidy_cas(vault_client, roots: List[dict], intermediates: List[dict], concurrency: int=DEFAULT_TIDY_CONCURRENCY,
+             safety_buffer: str=DEFAULT_SAFETY_BUFFER, pause_duration: Optional[str]=None, interval: float=DEFAULT_TIDY_INTERVAL) -> List[TidyResult]:
+    """ tidies the storage of the CAs with at most concurrency tidies running at once, and outputs what they removed """
+    names = [ca['metadata']['name'] for ca in roots + intermediates]
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    client = AsyncVaultClient(vault_client, concurrency)
+    start  = time.perf_counter()
+    try:
+        results = loop.run_until_complete(tidy_all(client, names, concurrency, safety_buffer, pause_duration, interval))
+    finally:
+        client.close()
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    tidied = [r for r in results if r.succeeded]
+    utils.output_message(f"Tidied {len(tidied)} CAs in {time.perf_counter() - start:.1f}s, removed {sum(r.certificates for r in tidied)} certificates "
+                         f"and {sum(r.revoked for r in tidied)} revoked certificates")
+
+    failed = len(results) - len(tidied)
+    if failed:
+        utils.exit_with_message(f"Failed to tidy {failed} CAs")
+    return results
@@ -0,0 +1,286 @@
+from . import utils
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+import collections
+import datetime
+import hashlib
+import json
+import re
+import requests
+import time
+
+CASSETTE_VERSION = 1
+
+REDACTED = 'REDACTED'
+
+# the headers and JSON fields that carry Vault tokens, unseal keys or private keys
+SECRET_HEADERS = ('x-vault-token', 'authorization', 'cookie', 'set-cookie')
+SECRET_FIELDS  = ('private_key', 'root_token', 'client_token', 'token', 'keys_base64', 'key')
+
+PRIVATE_KEY_PEM = re.compile(r'-----BEGIN ([A-Z ]*)PRIVATE KEY-----.*?-----END \1PRIVATE KEY-----', re.DOTALL)
+
+Interaction = Dict[str, dict]
+
+
+def redact_value(value):
+    """ returns a copy of a decoded JSON value with its secrets replaced """
+    if isinstance(value, dict):
+        redacted = {}
+        for key, item in value.items():
+            # the unseal keys of an init response, which also lists the role names of a CA under 'keys' elsewhere
+            secret = key in SECRET_FIELDS or (key == 'keys' and 'root_token' in value)
+            redacted[key] = REDACTED if secret and item is not None else redact_value(item)
+        return redacted
+    if isinstance(value, list):
+        return [redact_value(item) for item in value]
+    if isinstance(value, str):
+        return PRIVATE_KEY_PEM.sub(REDACTED, value)
+    return value
+
+
+def redact_body(body) -> Optional[str]:
+    """ returns a request or response body as text with its secrets replaced """
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+
+    try:
+        return json.dumps(redact_value(json.loads(body)))
+    except ValueError:
+        return PRIVATE_KEY_PEM.sub(REDACTED, body)
+
+
+def redact_headers(headers) -> Dict[str, str]:
+    return {name: REDACTED if name.lower() in SECRET_HEADERS else value for name, value in headers.items()}
+
+
+def body_digest(body: Optional[str]) -> str:
+    return hashlib.sha256((body or '').encode('utf-8')).hexdigest()
+
+
+class Cassette:
+    """ the exchanges with Vault servers, in the order they completed """
+
+    def __init__(self, interactions: Optional[List[Interaction]]=None):
+        self.interactions = interactions or []
+        self.lock         = Lock()
+
+    @classmethod
+    def load(cls, path: str) -> 'Cassette':
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            utils.exit_with_message(f"cassette file does not exist: {path}")
+        except (OSError, ValueError) as err:
+            utils.exit_with_message(f"failed to read cassette file {path}. Exception: {err}")
+
+        if data.get('version') != CASSETTE_VERSION:
+            utils.exit_with_message(f"unsupported cassette file version: {path}")
+        return cls(data['interactions'])
+
+    def add(self, interaction: Interaction) -> None:
+        with self.lock:
+            self.interactions.append(interaction)
+
+    def save(self, path: str) -> None:
+        # the secrets are redacted, but the cassette still maps out the PKI of the Vault server
+        data = {'version': CASSETTE_VERSION, 'interactions': self.interactions}
+        try:
+            utils.write_atomic(path, json.dumps(data, indent=2))
+        except OSError:
+            utils.exit_with_message(f"Failed to write the cassette file to {path}")
+
+    def write_har(self, path: str) -> None:
+        try:
+            utils.write_atomic(path, json.dumps(to_har(self.interactions), indent=2))
+        except OSError:
+            utils.exit_with_message(f"Failed to write the HAR file to {path}")
+
+
+def to_har_entry(interaction: Interaction) -> dict:
+    request, response, timings = interaction['request'], interaction['response'], interaction['timings']
+
+    def headers(h: Dict[str, str]) -> List[Dict[str, str]]:
+        return [{'name': name, 'value': value} for name, value in h.items()]
+
+    entry_request = {
+        'method': request['method'],
+        'url': request['url'],
+        'httpVersion': 'HTTP/1.1',
+        'headers': headers(request['headers']),
+        'queryString': [{'name': name, 'value': value} for name, value in parse_qsl(urlsplit(request['url']).query)],
+        'cookies': [],
+        'headersSize': -1,
+        'bodySize': len((request['body'] or '').encode('utf-8'))
+    }
+    if request['body'] is not None:
+        mime_type = CaseInsensitiveDict(request['headers']).get('Content-Type', 'application/json')
+        entry_request['postData'] = {'mimeType': mime_type, 'text': request['body']}
+
+    body = response['body'] or ''
+    return {
+        'startedDateTime': interaction['started'],
+        'time': round(timings['total'] * 1000, 3),
+        'request': entry_request,
+        'response': {
+            'status': response['status'],
+            'statusText': response['reason'] or '',
+            'httpVersion': 'HTTP/1.1',
+            'headers': headers(response['headers']),
+            'cookies': [],
+            'content': {
+                'size': len(body.encode('utf-8')),
+                'mimeType': CaseInsensitiveDict(response['headers']).get('Content-Type', ''),
+                'text': body
+            },
+            'redirectURL': '',
+            'headersSize': -1,
+            'bodySize': len(body.encode('utf-8'))
+        },
+        'cache': {},
+        # the time to the response headers is the wait, and reading the body the receive
+        'timings': {
+            'blocked': -1,
+            'dns': -1,
+            'connect': -1,
+            'ssl': -1,
+            'send': 0,
+            'wait': round(timings['wait'] * 1000, 3),
+            'receive': round((timings['total'] - timings['wait']) * 1000, 3)
+        }
+    }
+
+
+def to_har(interactions: List[Interaction]) -> dict:
+    """ returns the interactions as an HTTP Archive, which browsers and HAR viewers show as a waterfall """
+    entries = sorted((to_har_entry(i) for i in interactions), key=lambda entry: entry['startedDateTime'])
+    return {'log': {'version': '1.2', 'creator': {'name': 'pkictl', 'version': '0.1'}, 'pages': [], 'entries': entries}}
+
+
+def interaction_key(method: str, url: str, body: Optional[str]) -> Tuple[str, str, str]:
+    return method, url, body_digest(body)
+
+
+class RecordingAdapter(BaseAdapter):
+    """ sends the requests through another adapter and adds the exchanges to a cassette, with their secrets redacted """
+
+    def __init__(self, adapter: BaseAdapter, cassette: Cassette):
+        super().__init__()
+        self.adapter  = adapter
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        started  = datetime.datetime.now(datetime.timezone.utc)
+        start    = time.perf_counter()
+        response = self.adapter.send(request, **kwargs)
+        wait     = time.perf_counter() - start
+
+        # the body is read here rather than by the session, to time it and record it
+        content = response.content
+        total   = time.perf_counter() - start
+
+        self.cassette.add({
+            'started': started.isoformat(timespec='microseconds').replace('+00:00', 'Z'),
+            'request': {
+                'method': request.method,
+                'url': request.url,
+                'headers': redact_headers(request.headers),
+                'body': redact_body(request.body)
+            },
+            'response': {
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': redact_headers(response.headers),
+                'body': redact_body(content)
+            },
+            'timings': {'wait': wait, 'total': total}
+        })
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """ answers the requests from a cassette without a Vault server, optionally taking as long as the recorded exchanges """
+
+    def __init__(self, cassette: Cassette, played: Cassette, latency: bool=False):
+        super().__init__()
+        self.played  = played
+        self.latency = latency
+        self.lock    = Lock()
+
+        # the requests are matched on their URL and body, and then on their path alone, so a cassette can be replayed against another address
+        self.exact: Dict[tuple, collections.deque] = collections.defaultdict(collections.deque)
+        self.paths: Dict[tuple, collections.deque] = collections.defaultdict(collections.deque)
+        for interaction in cassette.interactions:
+            request = interaction['request']
+            self.exact[interaction_key(request['method'], request['url'], request['body'])].append(interaction)
+            self.paths[(request['method'], urlsplit(request['url']).path)].append(interaction)
+
+    def match(self, method: str, url: str, body: Optional[str]) -> Optional[Interaction]:
+        with self.lock:
+            for queue in (self.exact.get(interaction_key(method, url, body)), self.paths.get((method, urlsplit(url).path))):
+                if queue:
+                    # the responses to a repeated request are replayed in order, and the last one answers any further requests
+                    return queue.popleft() if len(queue) > 1 else queue[0]
+        return None
+
+    def send(self, request, **kwargs):
+        interaction = self.match(request.method, request.url, redact_body(request.body))
+        if interaction is None:
+            raise requests.exceptions.ConnectionError(f"no recorded response for {request.method} {request.url}", request=request)
+
+        if self.latency:
+            time.sleep(interaction['timings']['total'])
+        self.played.add(interaction)
+
+        recorded = interaction['response']
+
+        response = requests.Response()
+        response.status_code = recorded['status']
+        response.reason      = recorded['reason']
+        response.headers     = CaseInsensitiveDict(recorded['headers'])
+        response._content    = (recorded['body'] or '').encode('utf-8')
+        response.encoding    = 'utf-8'
+        response.url         = request.url
+        response.request     = request
+        response.connection  = self
+        return response
+
+    def close(self):
+        pass
+
+
+class Transport:
+    """ records the exchanges with Vault servers to a cassette, or replays them from one without a Vault server """
+
+    def __init__(self, cassette: Optional[Cassette]=None, latency: bool=False):
+        self.cassette = cassette
+        self.latency  = latency
+
+        # the exchanges of this run, recorded or replayed
+        self.exchanges = Cassette()
+
+    @property
+    def replaying(self) -> bool:
+        return self.cassette is not None
+
+    def adapter(self, adapter: BaseAdapter) -> BaseAdapter:
+        """ returns the adapter a VaultClient session sends its requests through in place of adapter """
+        if self.cassette is not None:
+            return ReplayAdapter(self.cassette, self.exchanges, self.latency)
+        return RecordingAdapter(adapter, self.exchanges)
+
+    def close(self, record_path: Optional[str]=None, har_path: Optional[str]=None) -> None:
+        """ writes the cassette and the HTTP Archive of the exchanges of this run """
+        if record_path:
+            self.exchanges.save(record_path)
+            utils.output_message(f"Recorded {len(self.exchanges.interactions)} requests to {record_path}")
+        if har_path:
+            self.exchanges.write_har(har_path)
@@ -1,26 +1,94 @@
-from . import schemas
-from typing import List, Tuple, Optional
+from . import events
+from .schemas import DURATION_REGEX
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Optional
+import collections
+import functools
 import getpass
-import glob
+import itertools
 import os
+import re
 import sys
-import yaml
+import tempfile
+import threading
+
+MANIFEST_EXTENSIONS      = ('.yaml', '.yml')
+PARALLEL_PARSE_THRESHOLD = 16
+DURATION_UNITS           = {'s': 1, 'm': 60, 'h': 3600}
+
+# a Vault duration is a number of seconds or a sequence of numbers and units, such as '72h' or '1h30m'
+_duration      = re.compile(DURATION_REGEX)
+_duration_part = re.compile(r'(\d+)([hms])')
+
+
+# the Vault cluster that the current thread is applying to, when applying to several at once
+_target = threading.local()
+
+
+def current_target() -> Optional[str]:
+    return getattr(_target, 'name', None)
+
+
+@contextmanager
+def output_target(name: Optional[str]):
+    """ labels the messages output by the current thread with the name of a Vault cluster """
+    previous, _target.name = current_target(), name
+    try:
+        yield
+    finally:
+        _target.name = previous
+
+
+def bind_target(func):
+    """ wraps func to output messages under the caller's target label, for handing work to other threads """
+    name = current_target()
+    if name is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with output_target(name):
+            return func(*args, **kwargs)
+    return wrapper
 
 
 def output_message(msg: str, err: bool = False):
-    prefix = "[-]" if err else "[*]"
-    message = [prefix, 'pkictl', '-', msg]
-    if err:
-        message.insert(3, "Error:")
-    print(' '.join(message), flush=True)
+    events.log.emit(events.ERROR if err else events.INFO, msg, current_target())
+
+
+def debug_message(msg: events.Message, **fields):
+    """ outputs a debug message, which may be a function so that it is only formatted if it is written """
+    events.log.emit(events.DEBUG, msg, current_target(), fields)
 
 
 def exit_with_message(msg: str):
     sys.exit(f"[-] pkictl - Error: {msg}")
 
 
+def error_message(err: BaseException) -> str:
+    """ returns the message of an error that was caught instead of ending the run, without the exit prefix """
+    if isinstance(err, SystemExit):
+        if not isinstance(err.code, str):
+            return f"exited with status {err.code}"
+        return err.code.replace('[-] pkictl - Error: ', '', 1)
+    return str(err) or type(err).__name__
+
+
+def strtobool(value: str) -> bool:
+    """ converts a truth value such as VAULT_SKIP_VERIFY to a bool, like the strtobool of the deprecated distutils """
+    value = value.lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    elif value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return False
+    raise ValueError(f"invalid truth value {value!r}")
+
+
 def get_from_environment(name: str):
     value = os.getenv(name)
+    if value is None:
+        # the messages output so far should precede the prompt
+        events.log.flush()
     if name == 'VAULT_ADDR' and value is None:
         return input("Vault URL: ")
     elif name == 'VAULT_TOKEN' and value is None:
@@ -31,38 +99,127 @@ def get_from_environment(name: str):
 
 
 def get_manifest_files(directory: str) -> List[str]:
-    """ returns a list of absolute paths to YAML manifest files within a directory """
-    pattern  = '*.y[am]*l'  # match .yaml or .yml
-    return glob.glob(f'{directory}/{pattern}')
+    """ returns a sorted list of absolute paths to YAML manifest files within a directory and its subdirectories """
+    manifest_files: List[str] = []
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                manifest_files.extend(get_manifest_files(entry.path))
+            elif entry.name.endswith(MANIFEST_EXTENSIONS) and entry.is_file():
+                manifest_files.append(os.path.abspath(entry.path))
+    return sorted(manifest_files)
+
+
+@functools.lru_cache(maxsize=None)
+def yaml_loader():
+    """ returns the YAML loader for manifests, importing PyYAML when the first manifest is read """
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:  # PyYAML was built without libyaml
+        from yaml import SafeLoader  # type: ignore
+    return SafeLoader
 
 
-def read_manifest_file(path: str) -> List[dict]:
+def iter_manifest_file(path: str, errors: List[str]) -> Iterator[dict]:
+    """ yields the documents of a manifest file as they are parsed, adding an error message to errors if it cannot be parsed """
+    import yaml
+
+    count = 0
     try:
-        with open(path, 'r') as f:
-            return list(yaml.load_all(f.read()))
+        with open(path, 'rb') as f:
+            # the documents are constructed one at a time, so a file is never held in full
+            for document in yaml.load_all(f, Loader=yaml_loader()):
+                if document is not None:
+                    count += 1
+                    yield document
     except FileNotFoundError:
-        error_message = "manifest file does not exist"
+        errors.append(f"manifest file does not exist: {path}")
     except yaml.YAMLError:
-        error_message = "failed to parse manifest file, invalid YAML"
+        errors.append(f"failed to parse manifest file, invalid YAML in document {count}: {path}")
     except PermissionError:
-        error_message = "failed to read manifest file, permission denied"
+        errors.append(f"failed to read manifest file, permission denied: {path}")
     except Exception as err:
-        error_message = f"failed to read manifest file. Exception: {err}"
-    return exit_with_message(error_message)
+        errors.append(f"failed to read manifest file {path}. Exception: {err}")
+
+
+def parse_manifest_file(path: str) -> Tuple[List[dict], Optional[str]]:
+    """ returns the documents of a manifest file, or an error message if it could not be parsed """
+    errors: List[str] = []
+    documents = list(iter_manifest_file(path, errors))
+    return documents, errors[0] if errors else None
+
+
+def list_manifest_files(path: str) -> List[str]:
+    path = os.path.abspath(os.path.expanduser(path))
+    return get_manifest_files(path) if os.path.isdir(path) else [path]
+
+
+def iter_manifests(path: str, workers: Optional[int]=None) -> Iterator[dict]:
+    """ yields the documents of a manifest file or of every manifest file within a directory as they are parsed, so they can be validated one at a time """
+    manifest_files = list_manifest_files(path)
+    errors: List[str] = []
+
+    if len(manifest_files) < PARALLEL_PARSE_THRESHOLD:
+        for manifest_file in manifest_files:
+            yield from iter_manifest_file(manifest_file, errors)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or os.cpu_count() or 1
+
+        # the workers only parse a few files ahead of the one being consumed, so memory does not grow with the number of files
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for documents, error_message in map_bounded(executor, parse_manifest_file, manifest_files, workers * 2):
+                if error_message:
+                    errors.append(error_message)
+                yield from documents
+
+    exit_on_manifest_errors(errors)
+
+
+def map_bounded(executor, func, items: Iterable, window: int) -> Iterator:
+    """ yields func(item) for every item in order, with at most window calls submitted to the executor at a time """
+    items   = iter(items)
+    pending = collections.deque(executor.submit(func, item) for item in itertools.islice(items, window))
+
+    while pending:
+        future = pending.popleft()
+        for item in itertools.islice(items, 1):
+            pending.append(executor.submit(func, item))
+        yield future.result()
 
 
-def get_validated_manifests(documents: List[dict]=[]) -> Tuple[List[dict], List[dict], List[dict]]:
+def exit_on_manifest_errors(errors: List[str]) -> None:
+    if len(errors) == 1:
+        exit_with_message(errors[0])
+    elif errors:
+        for error_message in errors:
+            output_message(error_message, err=True)
+        exit_with_message(f"failed to read {len(errors)} manifest files")
+
+
+def get_validated_manifests(documents: Iterable[dict]=()) -> Tuple[List[dict], List[dict], List[dict]]:
     roots: List[dict]           = []
     intermediates: List[dict]   = []
     kv_engines: List[dict]     = []
 
+    groups = {'RootCA': roots, 'IntermediateCA': intermediates, 'KV': kv_engines}
+    for manifest in iter_validated_manifests(documents):
+        groups[manifest['kind']].append(manifest)
+    return roots, intermediates, kv_engines
+
+
+def iter_validated_manifests(documents: Iterable[dict]) -> Iterator[dict]:
+    """ validates the documents one at a time, so that a stream of parsed documents is never held in full """
+    from . import resources
+
     for i in documents:
         schema_type = i.get('kind')
 
-        if schema_type == 'RootCA':
-            roots.append(schemas.RootCASchema(i))
-
-        elif schema_type == 'IntermediateCA':
+        if schema_type == 'IntermediateCA':
             ca_name     = i['metadata']['name']
             ca_type     = i['spec'].get('type')
             kv_engine  = i['metadata'].get('kv_engine', None)
@@ -70,14 +227,27 @@ def get_validated_manifests(documents: List[dict]=[]) -> Tuple[List[dict], List[
             if ca_type == 'exported' and kv_engine is None:
                 exit_with_message(f"kv_engine not defined for exported intermediate CA: {ca_name}")
 
-            intermediates.append(schemas.IntermediateCASchema(i))
+        elif schema_type not in ('RootCA', 'KV'):
+            exit_with_message("Unsupported schema defined in manifest file")
 
-        elif schema_type == 'KV':
-            kv_engines.append(schemas.KeyValueSchema(i))
+        yield resources.validate(i)
 
-        else:
-            exit_with_message("Unsupported schema defined in manifest file")
-    return roots, intermediates, kv_engines
+
+def write_atomic(path: str, content: str, mode: int=0o600) -> None:
+    """ writes a file through a temporary file in the same directory, so readers never see it half-written """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp   = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}-")
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
 
 def write_vault_master_keys(master_keys: List[str]=[], file: str='vault.log', debug: bool=False) -> None:
@@ -105,21 +275,66 @@ def write_vault_root_token(root_token: str=None, file: str='.vault-token', debug
             output_message(f"Successfully wrote the Vault root token to {file}")
 
 
-def get_issuer_index(array: List[dict], key: str, value: str) -> Optional[int]:
-    for i, d in enumerate(array):
-        if d['metadata'][key] == value:
-            return i
-    return None
+def get_intermediate_ca_levels(intermediates: List[dict], roots: Optional[List[dict]]=None) -> List[List[dict]]:
+    """ groups intermediate CAs into levels that are only issued by Root CAs or CAs in earlier levels """
+    # without roots, any issuer that is not an intermediate CA is assumed to be a Root CA
+    root_names: Optional[Set[str]] = None
+    if roots is not None:
+        root_names = set()
+        for ca in roots:
+            name = ca['metadata']['name']
+            if name in root_names:
+                exit_with_message(f"CA defined more than once: {name}")
+            root_names.add(name)
 
+    index: Dict[str, dict]           = {}
+    children: Dict[str, List[str]]   = {}
+    pending: Dict[str, int]          = {}
 
-def sort_intermediate_certificate_authorities(intermediates: List[dict]):
-    sorted_intermediates: List[dict] = []
     for ca in intermediates:
+        name = ca['metadata']['name']
+        if name in index or (root_names is not None and name in root_names):
+            exit_with_message(f"CA defined more than once: {name}")
+        index[name] = ca
+
+    level: List[str] = []
+    for name, ca in index.items():
         issuer = ca['metadata']['issuer']
 
-        index = get_issuer_index(intermediates, key='name', value=issuer)
-        if index is None:
-            sorted_intermediates.insert(0, ca)
+        if issuer in index:
+            children.setdefault(issuer, []).append(name)
+            pending[name] = 1
+        elif root_names is None or issuer in root_names:
+            level.append(name)
         else:
-            sorted_intermediates.insert(index, ca)
-    return sorted_intermediates
+            exit_with_message(f"issuer '{issuer}' not defined for intermediate CA: {name}")
+
+    levels: List[List[dict]] = []
+    while level:
+        levels.append([index[name] for name in level])
+
+        next_level = []
+        for name in level:
+            for child in children.get(name, []):
+                pending[child] -= 1
+                if pending[child] == 0:
+                    next_level.append(child)
+        level = next_level
+
+    unresolved = [name for name, count in pending.items() if count > 0]
+    if unresolved:
+        exit_with_message(f"circular issuer chain between intermediate CAs: {', '.join(sorted(unresolved))}")
+    return levels
+
+
+def duration_to_seconds(value) -> Optional[int]:
+    """ converts a Vault duration such as '72h' or '1h30m', or a number of seconds, to seconds, raises ValueError otherwise """
+    if value is None or isinstance(value, int):
+        return value
+
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    if not _duration.match(value):
+        raise ValueError(f"invalid duration: {value}")
+    return sum(int(number) * DURATION_UNITS[unit] for number, unit in _duration_part.findall(value))
@@ -1,50 +1,172 @@
-from . import utils
+from .metrics import TimedHTTPAdapter, operation, tagged, current_operation
+from .defaults import DEFAULT_MAX_RETRIES, DEFAULT_POOL_SIZE
+from .retry import AdaptiveLimiter, GATEWAY_STATUS_CODES, IDEMPOTENT_METHODS, PRESSURE_STATUS_CODES
+from . import events, plan, retry, utils
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin
 import requests
+import time
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
 
 
 class VaultClient:
-    def __init__(self, baseurl=None, token=None, verify_ssl=True, debugging=False):
+    def __init__(self, baseurl=None, token=None, verify_ssl=True, debugging=False, pool_size=DEFAULT_POOL_SIZE, metrics=None, max_retries=DEFAULT_MAX_RETRIES,
+                 transport=None):
         self.baseurl     = baseurl
         self.token       = token
         self.verify_ssl  = verify_ssl
         self.debugging   = debugging
         self.timeout     = 80
         self.master_keys = []
+        self.pool_size   = pool_size
+        self.metrics     = metrics
+        self.max_retries = max_retries
+        self.limiter     = AdaptiveLimiter(pool_size)
+        self.transport   = transport
+        self.session     = self.create_session()
+        self.state       = None
+        self.overwrite   = False
+        self.keygen      = None
 
     @property
     def headers(self):
         return {'X-VAULT-TOKEN': self.token}
 
-    def request(self, method, url, headers=None, json=None):
-        try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=json,
-                timeout=self.timeout,
-                verify=self.verify_ssl
-            )
-        except requests.exceptions.RequestException as err:
-            utils.exit_with_message(f"Failed to contact the Vault server: {err}")
-        else:
+    def use_snapshot(self, state, overwrite=False):
+        """ decides whether resources exist from a VaultState snapshot instead of probing the Vault server """
+        self.state     = state
+        self.overwrite = overwrite
+
+    def use_keygen(self, keygen):
+        """ takes the key pairs of local intermediate CAs from a KeyGenerator that has already started generating them """
+        self.keygen = keygen
+
+    def create_session(self):
+        """ creates a persistent HTTP session backed by a pool of keep-alive connections """
+        # connections only time their connect when metrics are enabled
+        adapter_class = HTTPAdapter if self.metrics is None else TimedHTTPAdapter
+        adapter       = adapter_class(pool_connections=1, pool_maxsize=self.pool_size)
+
+        # a transport records the exchanges through the adapter or replays them in its place
+        if self.transport is not None:
+            adapter = self.transport.adapter(adapter)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def warm_connections(self):
+        """ opens the pooled connections to the Vault server in parallel so the TLS handshakes happen upfront """
+        URL = urljoin(self.baseurl, "v1/sys/health")
+
+        def connect(_):
+            try:
+                self.session.head(URL, timeout=self.timeout, verify=self.verify_ssl)
+            except requests.exceptions.RequestException:
+                pass
+
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            list(executor.map(connect, range(self.pool_size)))
+
+    def close(self):
+        """ closes all pooled connections to the Vault server """
+        self.session.close()
+
+    def send(self, method, url, headers, json, data):
+        """ sends a single request, returning the response or the error that prevented it """
+        with self.limiter:
+            if self.metrics is not None:
+                start = self.metrics.start_request()
+
+            try:
+                response = self.session.request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    json=json,
+                    data=data,
+                    timeout=self.timeout,
+                    verify=self.verify_ssl
+                )
+            except requests.exceptions.RequestException as err:
+                if self.metrics is not None:
+                    self.metrics.record_request(start)
+                return None, err
+
+            if self.metrics is not None:
+                self.metrics.record_request(start, response, len(response.request.body or b''))
+
+        if response.status_code in PRESSURE_STATUS_CODES:
+            self.limiter.on_pressure()
+        elif response.status_code < 500:
+            self.limiter.on_success()
+        return response, None
+
+    def retry_delay(self, attempt, response, error, idempotent):
+        """ returns how long to wait before retrying a failed request, or None if it should not be retried """
+        if error is not None:
+            return retry.backoff_delay(attempt) if idempotent else None
+
+        # Vault rejected these before processing them, so even non-idempotent requests are safe to repeat
+        if response.status_code in PRESSURE_STATUS_CODES:
+            retry_after = retry.parse_retry_after(response.headers.get('Retry-After'))
+            return retry_after if retry_after is not None else retry.backoff_delay(attempt)
+
+        if response.status_code in GATEWAY_STATUS_CODES and idempotent:
+            return retry.backoff_delay(attempt)
+        return None
+
+    def request(self, method, url, headers=None, json=None, data=None, missing_ok=False, retries=True, idempotent=None):
+        # data is a request body that has already been serialized to JSON
+        if data is not None:
+            headers = dict(headers or {}, **JSON_HEADERS)
+
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            response, error = self.send(method, url, headers, json, data)
+
+            delay = None
+            if retries and attempt < self.max_retries:
+                delay = self.retry_delay(attempt, response, error, idempotent)
+            if delay is None:
+                break
+
+            if self.metrics is not None:
+                self.metrics.record_retry()
             if self.debugging:
-                msg = f"Request method: {method}, Request URL: {url}, Response status code: {response.status_code}, Response body: {response.text}"
-                utils.output_message(msg)
+                reason = error if error is not None else f"status code {response.status_code}"
+                utils.debug_message(f"Retrying request method: {method}, Request URL: {url} in {delay:.2f}s after {reason}", method=method, url=url, attempt=attempt + 1)
+
+            time.sleep(delay)
+            attempt += 1
 
-            # See: https://www.vaultproject.io/api/index.html#http-status-codes
-            if response.status_code == 403:
-                utils.exit_with_message("Failed to authenticate to the Vault server: invalid token")
-            elif response.status_code == 404:
-                utils.exit_with_message("Failed to process request: invalid path")
-            return response
+        if error is not None:
+            utils.exit_with_message(f"Failed to contact the Vault server: {error}")
 
+        if self.debugging:
+            # the body is only decoded and shortened if the message is written
+            utils.debug_message(lambda: f"Request method: {method}, Request URL: {url}, Response status code: {response.status_code}, Response body: {events.summarize_body(response.text)}",
+                                method=method, url=url, status=response.status_code)
+
+        # See: https://www.vaultproject.io/api/index.html#http-status-codes
+        if response.status_code == 403:
+            utils.exit_with_message("Failed to authenticate to the Vault server: invalid token")
+        elif response.status_code == 404 and not missing_ok:
+            utils.exit_with_message("Failed to process request: invalid path")
+        return response
+
+    @operation
     def healthcheck(self):
         """ checks if the Vault server has been initialized and is not sealed """
         URL = urljoin(self.baseurl, "v1/sys/health")
 
-        response = self.request(method='GET', url=URL)
+        response = self.request(method='GET', url=URL, retries=False)
         body     = response.json()
 
         initialized = body['initialized']
@@ -58,6 +180,18 @@ class VaultClient:
             utils.output_message("the Vault server is sealed", err=True)
         return initialized, sealed
 
+    @operation
+    def read_version(self) -> str:
+        """ returns the version the Vault server reports, such as '1.11.0' """
+        URL = urljoin(self.baseurl, "v1/sys/health")
+
+        response = self.request(method='GET', url=URL, retries=False)
+        try:
+            return response.json().get('version') or ''
+        except ValueError:
+            return ''
+
+    @operation
     def initialize_server(self, log_file='vault.log', token_file='.vault-token'):
         """" initializes the Vault server and writes master & root key to disk """
         URL = urljoin(self.baseurl, "v1/sys/init")
@@ -67,7 +201,7 @@ class VaultClient:
             "secret_threshold": 3
         }
 
-        response = self.request(method='PUT', url=URL, json=params)
+        response = self.request(method='PUT', url=URL, json=params, retries=False)
 
         if response.status_code == 200:
             body = response.json()
@@ -82,12 +216,13 @@ class VaultClient:
         else:
             utils.output_message("failed to initialize the Vault server", err=True)
 
+    @operation
     def unseal_server(self):
         """" unseals the Vault server """
         URL = urljoin(self.baseurl, "v1/sys/unseal")
 
         for i in self.master_keys:
-            response = self.request(method='PUT', url=URL, json={'key': i})
+            response = self.request(method='PUT', url=URL, json={'key': i}, retries=False)
 
             if response.status_code == 200:
                 body = response.json()
@@ -98,9 +233,175 @@ class VaultClient:
             else:
                 utils.exit_with_message("failed to unseal the Vault server")
 
+    @operation
+    def read_mounts(self):
+        """ returns the configuration of every mounted secrets engine keyed by path """
+        URL = urljoin(self.baseurl, "v1/sys/mounts")
+
+        response = self.request(method='GET', url=URL, headers=self.headers)
+
+        if response.status_code != 200:
+            utils.exit_with_message("Failed to read the mounted secrets engines")
+
+        body = response.json()
+        mounts = body.get('data', body)
+        return {path.rstrip('/'): config for path, config in mounts.items() if isinstance(config, dict)}
+
+    @operation
+    def read_ca_certificate(self, name):
+        """ returns the PEM encoded certificate of a CA or None if it has not been generated """
+        URL = urljoin(self.baseurl, f"/v1/{name}/ca/pem")
+
+        response = self.request(method='GET', url=URL, headers=self.headers, missing_ok=True)
+
+        if response.status_code == 200 and response.text:
+            return response.text
+        return None
+
+    @operation
+    def read_crl_configuration(self, name):
+        """ returns the CRL configuration of a CA """
+        URL = urljoin(self.baseurl, f"/v1/{name}/config/crl")
+
+        response = self.request(method='GET', url=URL, headers=self.headers, missing_ok=True)
+
+        if response.status_code == 200:
+            return response.json()['data']
+        return None
+
+    @operation
+    def read_crl(self, name):
+        """ returns the DER encoded CRL of a CA or None if it has not been generated """
+        URL = urljoin(self.baseurl, f"/v1/{name}/crl")
+
+        response = self.request(method='GET', url=URL, headers=self.headers, missing_ok=True)
+
+        if response.status_code == 200 and response.content:
+            return response.content
+        return None
+
+    @operation
+    def rotate_crl(self, name):
+        """ rebuilds the CRL of a CA from the certificates revoked so far, returning whether it succeeded """
+        URL = urljoin(self.baseurl, f"/v1/{name}/crl/rotate")
+
+        # a CA that is missing is reported with the others that failed rather than ending the run
+        response = self.request(method='GET', url=URL, headers=self.headers, missing_ok=True)
+
+        try:
+            return response.status_code == 200 and bool(response.json()['data']['success'])
+        except (ValueError, KeyError, TypeError):
+            return False
+
+    @operation
+    def tidy(self, name, safety_buffer, pause_duration=None):
+        """ starts removing the expired certificates of a CA from storage, which Vault does in the background """
+        URL = urljoin(self.baseurl, f"/v1/{name}/tidy")
+
+        params = {'tidy_cert_store': True, 'tidy_revoked_certs': True, 'safety_buffer': safety_buffer}
+        if pause_duration:
+            params['pause_duration'] = pause_duration
+
+        response = self.request(method='POST', url=URL, headers=self.headers, json=params)
+
+        if response.status_code in (200, 202, 204):
+            utils.output_message(f"Started tidying CA: {name}")
+        else:
+            utils.exit_with_message(f"Failed to start tidying CA: {name}")
+
+    @operation
+    def read_tidy_status(self, name):
+        """ returns the progress of the last tidy of a CA or None if the Vault server does not report it """
+        URL = urljoin(self.baseurl, f"/v1/{name}/tidy-status")
+
+        response = self.request(method='GET', url=URL, headers=self.headers, missing_ok=True)
+
+        if response.status_code == 200:
+            return response.json()['data']
+        if response.status_code in (404, 405):
+            return None
+        utils.exit_with_message(f"Failed to read the tidy status of CA: {name}")
+
+    @operation
+    def list_roles(self, name):
+        """ returns the names of the roles configured for a CA """
+        URL = urljoin(self.baseurl, f"/v1/{name}/roles")
+
+        response = self.request(method='LIST', url=URL, headers=self.headers, missing_ok=True)
+
+        if response.status_code == 200:
+            return response.json()['data']['keys']
+        return []
+
+    @operation
+    def read_role(self, name, role):
+        """ returns the configuration of a role or None if it does not exist """
+        URL = urljoin(self.baseurl, f"/v1/{name}/roles/{role}")
+
+        response = self.request(method='GET', url=URL, headers=self.headers, missing_ok=True)
+
+        if response.status_code == 200:
+            return response.json()['data']
+        return None
+
+    @operation
+    def list_policies(self):
+        """ returns the names of the ACL policies """
+        URL = urljoin(self.baseurl, "v1/sys/policies/acl")
+
+        response = self.request(method='LIST', url=URL, headers=self.headers, missing_ok=True)
+
+        if response.status_code == 200:
+            return response.json()['data']['keys']
+        return []
+
+    @operation
+    def read_policy(self, name):
+        """ returns the document of an ACL policy or None if it does not exist """
+        URL = urljoin(self.baseurl, f"/v1/sys/policies/acl/{name}")
+
+        response = self.request(method='GET', url=URL, headers=self.headers, missing_ok=True)
+
+        if response.status_code == 200:
+            return response.json()['data']['policy']
+        return None
+
+    @operation
+    def issue_certificate(self, ca_name, role, params):
+        """ issues a certificate from a role of a CA, returning the response data or the reason it failed """
+        URL = urljoin(self.baseurl, f"/v1/{ca_name}/issue/{role}")
+
+        response = self.request(method='POST', url=URL, headers=self.headers, json=params)
+
+        if response.status_code == 200:
+            return response.json()['data'], None
+
+        try:
+            errors = response.json()['errors']
+        except (ValueError, KeyError, TypeError):
+            errors = []
+        return None, '; '.join(errors) or f"Vault returned status code {response.status_code}"
+
+    @operation
+    def write_secret(self, path, data):
+        """ writes a secret to a KV engine """
+        URL = urljoin(self.baseurl, f"/v1/{path}")
+
+        response = self.request(method='PUT', url=URL, headers=self.headers, json=data, idempotent=True)
+
+        if response.status_code in (200, 204):
+            utils.output_message(f"Published the trust bundle to: {path}")
+        else:
+            utils.exit_with_message(f"Failed to publish the trust bundle to: {path}")
+
+    @operation
     def mount_kv_engine(self, kvengine):
         """ mounts a KV v1 secrets engine """
-        response = self.request(method='POST', url=kvengine.url, headers=self.headers, json=kvengine.spec)
+        if self.state is not None and self.state.has_mount(kvengine.name):
+            utils.output_message(f"KV secrets engine '{kvengine.name}' already exists")
+            return
+
+        response = self.request(method='POST', url=kvengine.url, headers=self.headers, data=kvengine.spec_json)
 
         if response.status_code == 204:
             utils.output_message(f"Mounted KV secrets engine: {kvengine.name}")
@@ -109,6 +410,7 @@ class VaultClient:
         else:
             utils.exit_with_message(f"Failed to mount KV secrets engine: {kvengine.name}")
 
+    @operation
     def store_ca_private_key(self, ca):
         """ stores the private key for a CA in the specified KV engine """
 
@@ -119,11 +421,16 @@ class VaultClient:
         else:
             utils.exit_with_message(f"Failed to store private key for '{ca.name}' in KV engine: {ca.kv_engine}")
 
+    @operation
     def mount_pki_engine(self, ca):
         """ mounts a PKI secrets engine """
+        if self.state is not None and self.state.has_mount(ca.name):
+            utils.output_message(f"PKI secrets engine '{ca.name}' already exists")
+            return
+
         URL = urljoin(self.baseurl, f"v1/sys/mounts/{ca.name}")
 
-        response = self.request(method='POST', url=URL, headers=self.headers, json=ca.backend)
+        response = self.request(method='POST', url=URL, headers=self.headers, data=ca.backend_json)
 
         if response.status_code == 204:
             utils.output_message(f"Mounted PKI secrets engine: {ca.name}")
@@ -132,25 +439,31 @@ class VaultClient:
         else:
             utils.exit_with_message(f"Failed to mount PKI secrets engine: {ca.name}")
 
+    @operation
     def check_existing_ca(self, ca, quiet=False):
         """ checks if a CA already exists """
-        ca_exists = False
+        if self.state is not None:
+            ca_exists = self.state.has_ca(ca.name)
+        else:
+            URL = urljoin(self.baseurl, f"/v1/{ca.name}/ca/pem")
 
-        URL = urljoin(self.baseurl, f"/v1/{ca.name}/ca/pem")
+            response = self.request(method='GET', url=URL, headers=self.headers)
 
-        response = self.request(method='GET', url=URL, headers=self.headers)
+            ca_exists = response.status_code == 200
 
-        if response.status_code == 200:
-            ca_exists = True
+        if ca_exists:
             if not quiet:
                 utils.output_message(f"CA '{ca.name}' already exists")
         return ca_exists
 
+    @operation
     def create_root_ca(self, ca):
         """ generates a Root CA """
-        URL = urljoin(self.baseurl, f"/v1/{ca.name}/root/generate/internal")
+        if self.state is not None and self.state.has_ca(ca.name):
+            utils.output_message(f"Root CA '{ca.name}' has already been generated")
+            return
 
-        response = self.request(method='POST', url=URL, headers=self.headers, json=ca.spec)
+        response = self.request(method='POST', url=ca.url, headers=self.headers, data=ca.spec_json)
 
         if response.status_code == 200:
             body = response.json()
@@ -163,27 +476,40 @@ class VaultClient:
         else:
             utils.exit_with_message(f"Failed to generate Root CA: {ca.name}")
 
+    @operation
     def configure_ca_urls(self, ca):
         """ configures URLs for a CA """
-        response = self.request(method='POST', url=ca.config_url, headers=self.headers, json=ca.ca_urls)
+        response = self.request(method='POST', url=ca.config_url, headers=self.headers, data=ca.ca_urls_json, idempotent=True)
 
         if response.status_code == 204:
             utils.output_message(f"Configured URLs for CA: {ca.name}")
         else:
             utils.exit_with_message(f"Failed to configure URLs for CA: {ca.name}")
 
+    @operation
     def set_crl_configuration(self, ca):
         """ sets the duration for CRL validity """
-        response = self.request(method='POST', url=ca.crl_config_url, headers=self.headers, json=ca.crl_config)
+        response = self.request(method='POST', url=ca.crl_config_url, headers=self.headers, data=ca.crl_config_json, idempotent=True)
 
         if response.status_code == 204:
             utils.output_message(f"Set CRL configuration for CA: {ca.name}")
         else:
             utils.exit_with_message(f"Failed to set CRL configuration for CA: {ca.name}")
 
+    @operation
     def create_intermediate_ca(self, ca):
         """ generates an Intermediate CA """
-        response = self.request(method='POST', url=ca.url, headers=self.headers, json=ca.spec)
+        if ca.catype == 'local':
+            # cryptography is only imported when a CA is generated locally
+            from .keygen import KeyGenerator
+
+            keygen = self.keygen or KeyGenerator()
+            ca.private_key, ca.csr = keygen.result(ca.dict)
+
+            utils.output_message(f"Generated key pair locally for intermediate CA: {ca.name}")
+            return
+
+        response = self.request(method='POST', url=ca.url, headers=self.headers, data=ca.spec_json)
 
         if response.status_code == 200:
             body = response.json()
@@ -196,12 +522,10 @@ class VaultClient:
         else:
             utils.exit_with_message(f"Failed to generate intermediate CA: {ca.name}")
 
+    @operation
     def sign_intermediate_ca(self, ca):
         """ signs the certificate for an Intermediate CA with another CA """
-        spec = ca.spec.copy()
-        spec.update(csr=ca.csr)
-
-        response = self.request(method='POST', url=ca.issuer_sign_url, headers=self.headers, json=spec)
+        response = self.request(method='POST', url=ca.issuer_sign_url, headers=self.headers, data=ca.sign_json)
 
         if response.status_code == 200:
             body        = response.json()
@@ -220,35 +544,113 @@ class VaultClient:
         else:
             utils.exit_with_message(f"Failed to sign intermediate CA '{ca.name}' with issuing CA: {ca.issuer}")
 
+    @operation
     def set_intermediate_ca(self, ca):
         """ sets the signed certificate for an Intermediate CA """
 
-        params = {'certificate': ca.cert}
+        # the key pair of a local CA was never in Vault, so it is imported together with the signed certificate
+        if ca.catype == 'local':
+            url, params = ca.import_url, {'pem_bundle': f"{ca.private_key['private_key']}\n{ca.cert}"}
+        else:
+            url, params = ca.set_signed_url, {'certificate': ca.cert}
 
-        response = self.request(method='POST', url=ca.set_signed_url, headers=self.headers, json=params)
+        response = self.request(method='POST', url=url, headers=self.headers, json=params)
 
-        if response.status_code == 204:
-            utils.output_message(f"Set signed certificate for intermediate CA: {ca.name}")
-        else:
+        if response.status_code not in (200, 204):
             utils.exit_with_message(f"Failed to set signed certificate for intermediate CA: {ca.name}")
+        utils.output_message(f"Set signed certificate for intermediate CA: {ca.name}")
 
+        # newer Vault versions describe the imported issuers in a 200 response, the issuers of the chain have no key in the mount
+        data = {}
+        if response.status_code == 200:
+            try:
+                data = response.json().get('data') or {}
+            except ValueError:
+                pass
+        mapping = data.get('mapping') or {}
+        return [issuer for issuer in data.get('imported_issuers') or [] if mapping.get(issuer)]
+
+    @operation
+    def set_default_issuer(self, ca, issuer):
+        """ makes an issuer of a CA the one that signs the certificates it issues """
+        URL = urljoin(self.baseurl, f"/v1/{ca.name}/config/issuers")
+
+        response = self.request(method='POST', url=URL, headers=self.headers, json={'default': issuer}, idempotent=True)
+
+        if response.status_code in (200, 204):
+            utils.output_message(f"Set the default issuer of CA '{ca.name}' to: {issuer}")
+        else:
+            utils.exit_with_message(f"Failed to set the default issuer of CA: {ca.name}")
+
+    def map_concurrently(self, func, items):
+        """ calls func for every item using a bounded pool of workers, returning the results in order """
+        return list(self.imap_concurrently(func, items))
+
+    def imap_concurrently(self, func, items):
+        """ calls func for every item using a bounded pool of workers, yielding the results in order as they complete """
+        items = list(items)
+        if len(items) < 2:
+            yield from (func(i) for i in items)
+            return
+
+        # the workers inherit the operation tag of the caller for the metrics and its target for the output
+        func = utils.bind_target(tagged(func, current_operation()))
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(items))) as executor:
+            # only a couple of calls per worker are queued, rather than a future for each of thousands of roles
+            yield from utils.map_bounded(executor, func, items, self.pool_size * 2)
+
+    def report_results(self, results, summary):
+        """ outputs the (message, succeeded) results as they arrive and exits if any of them failed """
+        failed, first_failure = 0, None
+
+        for msg, succeeded in results:
+            if succeeded:
+                utils.output_message(msg)
+                continue
+
+            # a single failure is reported by the exit message, so the failures are only output once there is a second one
+            failed += 1
+            if failed == 1:
+                first_failure = msg
+                continue
+            if failed == 2:
+                utils.output_message(first_failure, err=True)
+            utils.output_message(msg, err=True)
+
+        if failed == 1:
+            utils.exit_with_message(first_failure)
+        elif failed:
+            utils.exit_with_message(summary.format(count=failed))
+
+    @operation
     def configure_ca_roles(self, ca):
         """ configures roles for an Intermediate CA """
-        for role in ca.roles:
+        def configure(role):
             name = role['name']
             config = role['config']
 
             URL = urljoin(self.baseurl, f"/v1/{ca.name}/roles/{name}")
 
-            response = self.request(method='POST', url=URL, headers=self.headers, json=config)
+            response = self.request(method='POST', url=URL, headers=self.headers, json=config, idempotent=True)
 
             if response.status_code == 204:
-                utils.output_message(f"Configured role '{name}' for intermediate CA: {ca.name}")
-            else:
-                utils.exit_with_message(f"Failed to configure role '{name}' for intermediate CA: {ca.name}")
+                return f"Configured role '{name}' for intermediate CA: {ca.name}", True
+            return f"Failed to configure role '{name}' for intermediate CA: {ca.name}", False
+
+        roles = ca.roles
+        if self.state is not None and not self.overwrite:
+            # only the roles whose settings differ from the ones in Vault are written
+            roles = [r for r in roles if not (self.state.has_role(ca.name, r['name']) and plan.role_matches(r['config'], self.state.roles[ca.name][r['name']]))]
+            if len(roles) < len(ca.roles):
+                utils.output_message(f"Skipped {len(ca.roles) - len(roles)} unchanged roles for intermediate CA: {ca.name}")
+
+        results = self.imap_concurrently(configure, roles)
+        self.report_results(results, f"Failed to configure {{count}} roles for intermediate CA: {ca.name}")
 
+    @operation
     def configure_ca_policies(self, ca):
-        for policy in ca.policies:
+        """ configures policies for an Intermediate CA """
+        def configure(policy):
             name = policy['name']
             document = {'policy': policy['policy']}
 
@@ -257,6 +659,14 @@ class VaultClient:
             response = self.request(method='PUT', url=URL, headers=self.headers, json=document)
 
             if response.status_code == 204:
-                utils.output_message(f"Configured policy '{name}' for intermediate CA: {ca.name}")
-            else:
-                utils.exit_with_message(f"Failed to configure policy '{name}' for intermediate CA: {ca.name}")
+                return f"Configured policy '{name}' for intermediate CA: {ca.name}", True
+            return f"Failed to configure policy '{name}' for intermediate CA: {ca.name}", False
+
+        policies = ca.policies
+        if self.state is not None and not self.overwrite:
+            policies = [p for p in policies if not self.state.policy_matches(p['name'], p['policy'])]
+            if len(policies) < len(ca.policies):
+                utils.output_message(f"Skipped {len(ca.policies) - len(policies)} unchanged policies for intermediate CA: {ca.name}")
+
+        results = self.imap_concurrently(configure, policies)
+        self.report_results(results, f"Failed to configure {{count}} policies for intermediate CA: {ca.name}")
@@ -0,0 +1,288 @@
+from .defaults import DEFAULT_INTERVAL
+from . import utils
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# how long to wait for an editor or `git checkout` to finish writing before re-applying
+SETTLE_DELAY = 0.2
+
+# inotify(7) event flags
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+IN_CLOEXEC     = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_manifest_file(path: str) -> bool:
+    return path.endswith(utils.MANIFEST_EXTENSIONS) and not os.path.basename(path).startswith('.')
+
+
+class ManifestSet:
+    """ keeps the validated documents of every manifest file in memory, so a change only re-parses the files it touched """
+
+    def __init__(self, path: str):
+        self.path  = os.path.abspath(os.path.expanduser(path))
+        self.files: Dict[str, Tuple[List[dict], List[dict], List[dict]]] = {}
+
+    @property
+    def is_directory(self) -> bool:
+        return os.path.isdir(self.path)
+
+    def list_files(self, directory: Optional[str]=None) -> List[str]:
+        if not self.is_directory:
+            return [self.path]
+        return utils.get_manifest_files(directory or self.path)
+
+    def load(self) -> None:
+        """ reads and validates every manifest file, exiting on the first error like apply does """
+        manifest_files = self.list_files()
+        errors: List[str] = []
+
+        documents = [list(utils.iter_manifest_file(path, errors)) for path in manifest_files]
+        utils.exit_on_manifest_errors(errors)
+
+        for path, file_documents in zip(manifest_files, documents):
+            self.files[path] = utils.get_validated_manifests(file_documents)
+
+    def refresh(self, paths: Set[str]) -> List[str]:
+        """ re-reads the changed files and directories, returning the files whose documents changed """
+        changed: Set[str] = set()
+
+        for path in paths:
+            if os.path.isdir(path):
+                # a directory was moved in or events were lost, so everything below it is read again
+                current = set(self.list_files(path))
+                changed.update(f for f in self.files if f.startswith(path + os.sep) and f not in current)
+                changed.update(current)
+            elif os.path.isfile(path) or path in self.files:
+                changed.add(path)
+            else:
+                # a directory that was deleted or moved away takes its manifest files with it
+                changed.update(f for f in self.files if f.startswith(path + os.sep))
+
+        updated = []
+        for path in sorted(changed):
+            if not os.path.exists(path):
+                if self.files.pop(path, None) is not None:
+                    utils.output_message(f"Removed manifest file: {path}")
+                    updated.append(path)
+                continue
+
+            if not self.is_directory and path != self.path:
+                continue
+
+            documents, error = utils.parse_manifest_file(path)
+            if error:
+                utils.output_message(f"{error}, keeping its previous version", err=True)
+                continue
+
+            try:
+                self.files[path] = utils.get_validated_manifests(documents)
+            except (SystemExit, Exception) as err:
+                utils.output_message(f"invalid manifest file {path}: {utils.error_message(err)}, keeping its previous version", err=True)
+                continue
+            updated.append(path)
+        return updated
+
+    def resources(self) -> Tuple[List[dict], List[dict], List[dict]]:
+        """ returns the Root CAs, intermediate CAs and KV engines of every file, in the order apply reads them """
+        roots: List[dict]         = []
+        intermediates: List[dict] = []
+        kv_engines: List[dict]    = []
+
+        for path in sorted(self.files):
+            file_roots, file_intermediates, file_kv_engines = self.files[path]
+            roots.extend(file_roots)
+            intermediates.extend(file_intermediates)
+            kv_engines.extend(file_kv_engines)
+        return roots, intermediates, kv_engines
+
+
+class PollingWatcher:
+    """ detects changed manifest files by comparing their modification time and size every interval """
+
+    def __init__(self, path: str, interval: float=DEFAULT_INTERVAL):
+        self.path     = os.path.abspath(os.path.expanduser(path))
+        self.interval = interval
+        self.stats    = self.scan()
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        stats = {}
+        try:
+            for path in utils.get_manifest_files(self.path) if os.path.isdir(self.path) else [self.path]:
+                st = os.stat(path)
+                stats[path] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            pass
+        return stats
+
+    def wait(self, timeout: Optional[float]=None) -> Set[str]:
+        """ blocks until a manifest file was created, modified or removed and returns their paths """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            time.sleep(self.interval)
+
+            stats   = self.scan()
+            changed = {path for path in set(stats) | set(self.stats) if stats.get(path) != self.stats.get(path)}
+            self.stats = stats
+
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """ detects changed manifest files with inotify(7), watching every directory below the manifest path """
+
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.directories: Dict[int, str] = {}
+
+        # a single manifest file is watched through its directory, since editors replace files on save
+        try:
+            if os.path.isdir(self.path):
+                self.add_directory(self.path, recursive=True)
+            else:
+                self.add_directory(os.path.dirname(self.path))
+        except OSError:
+            self.close()
+            raise
+
+    def add_directory(self, directory: str, recursive: bool=False) -> None:
+        wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"failed to watch {directory}")
+        self.directories[wd] = directory
+
+        if recursive:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'):
+                        self.add_directory(entry.path, recursive=True)
+
+    def read_events(self) -> Set[str]:
+        changed: Set[str] = set()
+        buffer = os.read(self.fd, 65536)
+
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            name   = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                changed.add(self.path)
+                continue
+
+            directory = self.directories.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.directories[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(directory)
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if os.path.basename(path).startswith('.') or self.path != os.path.commonpath([self.path, path]):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.add_directory(path, recursive=True)
+                    except OSError:
+                        # the directory was removed again before it could be watched
+                        pass
+                changed.add(path)
+            elif mask & IN_CREATE:
+                # the file is read once it has been written and closed
+                continue
+            elif is_manifest_file(path):
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout: Optional[float]=None) -> Set[str]:
+        """ blocks until a manifest file was created, modified or removed and returns their paths """
+        changed: Set[str] = set()
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        while ready:
+            changed |= self.read_events()
+
+            # batch the events of a save that touches several files
+            ready, _, _ = select.select([self.fd], [], [], SETTLE_DELAY)
+
+        if os.path.isfile(self.path):
+            changed = {path for path in changed if path == self.path}
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def create_watcher(path: str, poll: bool=False, interval: float=DEFAULT_INTERVAL):
+    """ returns an inotify watcher on Linux, falling back to polling where inotify is unavailable """
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as err:
+            utils.output_message(f"inotify is unavailable ({err}), polling for changes every {interval}s", err=True)
+    return PollingWatcher(path, interval)
+
+
+def watch_manifests(path: str, watcher, apply: Callable[[List[dict], List[dict], List[dict]], None]) -> None:
+    """ applies the manifests, then re-applies them whenever a manifest file changes until interrupted """
+    manifests = ManifestSet(path)
+    manifests.load()
+
+    def run() -> None:
+        try:
+            apply(*manifests.resources())
+        except (SystemExit, Exception) as err:
+            # a failed apply is retried on the next change, as the state file only records what was applied
+            utils.output_message(f"apply failed: {utils.error_message(err)}", err=True)
+
+    try:
+        run()
+        utils.output_message(f"Watching {len(manifests.files)} manifest files in {manifests.path} for changes")
+
+        while True:
+            updated = manifests.refresh(watcher.wait())
+            if updated:
+                utils.output_message(f"Detected changes in {len(updated)} manifest files")
+                run()
+    except KeyboardInterrupt:
+        utils.output_message("Stopped watching for changes")
+    finally:
+        watcher.close()
@@ -24,6 +24,9 @@ setup(name='pkictl',
     python_requires='>=3.6',
     platforms=['any'],
     install_requires=requirements,
+    extras_require={
+        'local-keygen': ['cryptography']
+    },
     zip_safe=False,
     classifiers=[
         'Development Status :: 4 - Beta',